@@ -0,0 +1,17 @@
+from flask import g, session
+
+
+def load_account(db):
+    """
+    Return the logged in user's row (id, username, cash).
+
+    The row is queried at most once per request and kept in g.account.
+    """
+
+    if "account" not in g:
+        rows = db.execute(
+            "SELECT id, username, cash FROM users WHERE id = ?", session["user_id"]
+        )
+        g.account = rows[0] if rows else None
+    return g.account
+
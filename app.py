@@ -1,40 +1,384 @@
+import hashlib
+import hmac
+import json
+import logging
 import os
-
-from cs50 import SQL
-from flask import Flask, flash, redirect, render_template, request, session, jsonify
-from flask_session import Session
+import queue
+import sys
+import time
+from datetime import datetime, timedelta
+
+import click
+from flask import (
+    Flask,
+    Response,
+    flash,
+    g,
+    redirect,
+    render_template,
+    request,
+    send_file,
+    session,
+    jsonify,
+    stream_template,
+)
 from werkzeug.security import check_password_hash, generate_password_hash
-from datetime import datetime
 import yfinance as yf
 
-from helpers import apology, login_required, lookup, usd, get_data
+import helpers
+from account import load_account
+from assets import StaticAssets
+from cache import TTLCache
+from database import Database, query_count
+from helpers import (
+    admin_required,
+    apology,
+    login_required,
+    lookup,
+    lookup_many,
+    usd,
+    get_data,
+    quote_cache,
+    add_tick_listener,
+    set_metadata_store,
+    set_price_history,
+    set_provider,
+    get_symbol_name,
+    daily_closes,
+    market_date,
+    set_admin_users,
+    set_symbol_universe,
+    valid_symbol,
+)
+from market_data import create_provider, record_tape
+from leaderboard import Leaderboard
+from ledger_archive import compact_ledger
+from metadata import MetadataStore
+from metrics import log_event, log_sampled, registry, set_log_sample_rate
+from orders import (
+    ORDER_TYPES,
+    SIDES,
+    OrderEngine,
+    cancel_order,
+    fill_order,
+    place_order,
+)
+import trading
+from pnl import average_cost_pnl, ledger_cache, portfolio_pnl
+from positions import check_positions, rebuild_positions
+from price_history import PriceHistory
+from profiler import RequestProfiler, report as profile_report
+from quote_stream import QuoteBroadcaster
+from schema import init_schema
+from sessions import SQLiteSessionInterface
+from snapshots import RANGES, catch_up, portfolio_history, take_snapshots
+from symbols import SymbolIndex
+from trading import TradeError
+from upstream import UpstreamClient, UpstreamError
 
 # Configure application
 app = Flask(__name__)
 
 # Enable template auto-reloading when there's a change in code
 app.config["TEMPLATES_AUTO_RELOAD"] = True
-# Disable caching for static files
+# Static files requested by their plain names must be revalidated
 app.config["SEND_FILE_MAX_AGE_DEFAULT"] = 0
 
 # Custom filter
 app.jinja_env.filters["usd"] = usd
 
-# Configure session to use filesystem (instead of signed cookies)
+# Serve static files under content-hashed names with immutable caching and
+# precompressed variants (see assets.py). Files are read once at startup, so
+# turn STATIC_FINGERPRINTS off while editing them
+app.config["STATIC_FINGERPRINTS"] = os.environ.get("STATIC_FINGERPRINTS", "1") == "1"
+assets = StaticAssets(app.static_folder)
+if app.config["STATIC_FINGERPRINTS"]:
+    assets.build()
+
+
+# url_for("static", filename=...) links to the fingerprinted name
+@app.url_defaults
+def fingerprint_static(endpoint, values):
+    if endpoint == "static" and "filename" in values:
+        values["filename"] = assets.fingerprinted(values["filename"])
+
+
+def static_file(filename):
+    """Serve a fingerprinted static file, or a plain one from static/"""
+
+    response = assets.send(filename)
+    if response is None:
+        response = app.send_static_file(filename)
+    return response
+
+
+app.view_functions["static"] = static_file
+
+# Configure market data backend: "yahoo" for live data or "tape" to replay
+# recorded quote tapes from MARKET_DATA_TAPES at MARKET_DATA_TAPE_SPEED x real time
+app.config["MARKET_DATA_PROVIDER"] = os.environ.get("MARKET_DATA_PROVIDER", "yahoo")
+app.config["MARKET_DATA_TAPES"] = os.environ.get("MARKET_DATA_TAPES", "tapes")
+app.config["MARKET_DATA_TAPE_SPEED"] = float(
+    os.environ.get("MARKET_DATA_TAPE_SPEED", 1)
+)
+
+# Configure upstream calls: seconds per attempt, total seconds per call with
+# retries, retries, consecutive failures that open a host's circuit breaker
+# and seconds it stays open
+app.config["UPSTREAM_TIMEOUT"] = float(os.environ.get("UPSTREAM_TIMEOUT", 3))
+app.config["UPSTREAM_DEADLINE"] = float(os.environ.get("UPSTREAM_DEADLINE", 8))
+app.config["UPSTREAM_RETRIES"] = int(os.environ.get("UPSTREAM_RETRIES", 2))
+app.config["UPSTREAM_BREAKER_FAILURES"] = int(
+    os.environ.get("UPSTREAM_BREAKER_FAILURES", 5)
+)
+app.config["UPSTREAM_BREAKER_RESET"] = float(
+    os.environ.get("UPSTREAM_BREAKER_RESET", 30)
+)
+upstream = UpstreamClient(
+    timeout=app.config["UPSTREAM_TIMEOUT"],
+    deadline=app.config["UPSTREAM_DEADLINE"],
+    retries=app.config["UPSTREAM_RETRIES"],
+    failure_threshold=app.config["UPSTREAM_BREAKER_FAILURES"],
+    reset_timeout=app.config["UPSTREAM_BREAKER_RESET"],
+)
+set_provider(
+    create_provider(
+        app.config["MARKET_DATA_PROVIDER"],
+        tapes=app.config["MARKET_DATA_TAPES"],
+        speed=app.config["MARKET_DATA_TAPE_SPEED"],
+        client=upstream,
+    )
+)
+
+# Configure symbol universe used to validate and autocomplete tickers. With
+# SYMBOLS_STRICT=1 symbols missing from SYMBOLS_FILE are rejected without
+# asking upstream (use it with a full exchange listing)
+app.config["SYMBOLS_FILE"] = os.environ.get("SYMBOLS_FILE", "data/symbols.csv")
+app.config["SYMBOLS_STRICT"] = os.environ.get("SYMBOLS_STRICT", "0") == "1"
+symbol_universe = SymbolIndex.load(app.config["SYMBOLS_FILE"])
+set_symbol_universe(symbol_universe, app.config["SYMBOLS_STRICT"])
+
+# Configure quote cache (seconds a quote is reused and max number of symbols kept)
+app.config["QUOTE_CACHE_TTL"] = int(os.environ.get("QUOTE_CACHE_TTL", 15))
+app.config["QUOTE_CACHE_SIZE"] = int(os.environ.get("QUOTE_CACHE_SIZE", 512))
+quote_cache.configure(
+    ttl=app.config["QUOTE_CACHE_TTL"], maxsize=app.config["QUOTE_CACHE_SIZE"]
+)
+# Configure P&L ledger cache (seconds an idle user's ledger stays in memory
+# and max number of users kept)
+app.config["LEDGER_CACHE_TTL"] = int(os.environ.get("LEDGER_CACHE_TTL", 86400))
+app.config["LEDGER_CACHE_SIZE"] = int(os.environ.get("LEDGER_CACHE_SIZE", 128))
+ledger_cache.configure(
+    ttl=app.config["LEDGER_CACHE_TTL"], maxsize=app.config["LEDGER_CACHE_SIZE"]
+)
+# Max seconds the portfolio page waits for all of its quotes
+app.config["QUOTE_BATCH_TIMEOUT"] = float(os.environ.get("QUOTE_BATCH_TIMEOUT", 5))
+
+# Max orders accepted by one /api/orders/batch request
+app.config["BATCH_ORDER_LIMIT"] = int(os.environ.get("BATCH_ORDER_LIMIT", 100))
+
+# Number of users shown on the leaderboard
+app.config["LEADERBOARD_SIZE"] = 50
+
+# Number of transactions shown per history page
+app.config["HISTORY_PAGE_SIZE"] = 50
+
+# Configure quote stream (seconds between upstream polls of a streamed symbol)
+app.config["QUOTE_STREAM_INTERVAL"] = float(os.environ.get("QUOTE_STREAM_INTERVAL", 5))
+quote_stream = QuoteBroadcaster(get_data, app.config["QUOTE_STREAM_INTERVAL"])
+
+# Configure SQLite database (pooled connections in WAL mode, waiting up to 5
+# seconds for locks held by other workers)
+db = Database("tradehub.db", timeout=5)
+db.init_app(app)
+init_schema(db)
+
+# Configure session: "sqlite" keeps sessions in the database (the cookie only
+# holds a random id), "cookie" keeps them in cookies signed with SECRET_KEY so
+# nodes don't need shared storage
 app.config["SESSION_PERMANENT"] = False
-app.config["SESSION_TYPE"] = "filesystem"
-Session(app)
+app.config["SESSION_BACKEND"] = os.environ.get("SESSION_BACKEND", "sqlite")
+# Seconds an unchanged session is served from memory before re-reading its row
+app.config["SESSION_CACHE_TTL"] = float(os.environ.get("SESSION_CACHE_TTL", 5))
+# Seconds between sweeps of expired sessions
+app.config["SESSION_SWEEP_INTERVAL"] = float(
+    os.environ.get("SESSION_SWEEP_INTERVAL", 300)
+)
+app.secret_key = os.environ.get("SECRET_KEY")
+if app.config["SESSION_BACKEND"] == "sqlite":
+    app.session_interface = SQLiteSessionInterface(
+        db,
+        cache_ttl=app.config["SESSION_CACHE_TTL"],
+        sweep_interval=app.config["SESSION_SWEEP_INTERVAL"],
+    )
+    app.session_interface.start_sweeper()
+elif app.config["SESSION_BACKEND"] != "cookie":
+    sys.exit(f"unknown session backend: {app.config['SESSION_BACKEND']}")
+elif not app.secret_key:
+    sys.exit("SESSION_BACKEND=cookie needs SECRET_KEY to be set")
+
+# Keep symbol fundamentals in the database for a day (METADATA_TTL seconds)
+# before refreshing them in the background
+app.config["METADATA_TTL"] = int(os.environ.get("METADATA_TTL", 86400))
+set_metadata_store(
+    MetadataStore(
+        db,
+        lambda symbol: helpers.provider.fundamentals(symbol),
+        app.config["METADATA_TTL"],
+    )
+)
 
-# Configure CS50 Library to use SQLite database
-db = SQL("sqlite:///tradehub.db")
+# Keep daily bars locally so previous closes, 52-week ranges and snapshots
+# don't need upstream calls for days already fetched
+set_price_history(
+    PriceHistory(
+        db, lambda symbol, start, end: helpers.provider.history(symbol, start, end)
+    )
+)
+
+# Rank users by equity and return, revalued on every trade and price tick.
+# Changes from other workers are picked up (and the ranking saved) every
+# LEADERBOARD_SYNC_INTERVAL seconds
+app.config["LEADERBOARD_SYNC_INTERVAL"] = float(
+    os.environ.get("LEADERBOARD_SYNC_INTERVAL", 60)
+)
+leaderboard = Leaderboard(db)
+leaderboard.load()
+add_tick_listener(leaderboard.on_tick)
+leaderboard.start(app.config["LEADERBOARD_SYNC_INTERVAL"])
+
+
+def fill_and_rank(order, price):
+    # Fill a triggered order and update its owner's place on the leaderboard
+    if fill_order(db, order, price):
+        leaderboard.refresh_user(order["user_id"])
+
+
+# Watch open limit/stop orders and fill them when a quote crosses their price.
+# Symbols with open orders are polled every ORDER_POLL_INTERVAL seconds
+app.config["ORDER_POLL_INTERVAL"] = float(os.environ.get("ORDER_POLL_INTERVAL", 5))
+order_engine = OrderEngine(db, fill=fill_and_rank)
+order_engine.sync()
+add_tick_listener(order_engine.on_tick)
+order_engine.start(
+    lambda symbols: lookup_many(symbols, timeout=app.config["QUOTE_BATCH_TIMEOUT"]),
+    app.config["ORDER_POLL_INTERVAL"],
+)
+
+# Configure logging: LOG_LEVEL of the tradehub logger, and the fraction of
+# hot-path events (requests, quote refreshes) logged as JSON lines
+app.config["LOG_LEVEL"] = os.environ.get("LOG_LEVEL", "INFO")
+app.config["LOG_SAMPLE_RATE"] = float(os.environ.get("LOG_SAMPLE_RATE", 0.01))
+logging.basicConfig(format="%(message)s")
+logging.getLogger("tradehub").setLevel(app.config["LOG_LEVEL"])
+set_log_sample_rate(app.config["LOG_SAMPLE_RATE"])
+
+# Bearer token required by /metrics (open when not set)
+app.config["METRICS_TOKEN"] = os.environ.get("METRICS_TOKEN")
+registry.register_cache("quote", quote_cache)
+registry.register_cache("market", helpers.market_cache)
+registry.register_cache("invalid_symbols", helpers.invalid_symbols)
+registry.register_cache("metadata", helpers.symbol_metadata.cache)
+registry.register_cache("ledger", ledger_cache)
+if app.config["SESSION_BACKEND"] == "sqlite":
+    registry.register_cache("session", app.session_interface.cache)
+
+# Users allowed on admin pages (comma-separated user ids)
+app.config["ADMIN_USER_IDS"] = [
+    int(user_id)
+    for user_id in os.environ.get("ADMIN_USER_IDS", "").split(",")
+    if user_id.strip()
+]
+set_admin_users(app.config["ADMIN_USER_IDS"])
+
+# Configure request profiler (off unless one of the first two is set): profile
+# PROFILE_SAMPLE_RATE of all requests and/or keep profiles of requests slower
+# than PROFILE_THRESHOLD_MS, with the "sampling" or "cprofile" collector. The
+# newest PROFILE_KEEP profiles are kept in PROFILE_DIR (see /admin/profiles)
+app.config["PROFILE_SAMPLE_RATE"] = float(os.environ.get("PROFILE_SAMPLE_RATE", 0))
+app.config["PROFILE_THRESHOLD_MS"] = float(os.environ.get("PROFILE_THRESHOLD_MS", 0))
+app.config["PROFILE_COLLECTOR"] = os.environ.get("PROFILE_COLLECTOR", "sampling")
+app.config["PROFILE_DIR"] = os.environ.get("PROFILE_DIR", "profiles")
+app.config["PROFILE_KEEP"] = int(os.environ.get("PROFILE_KEEP", 100))
+profiler = RequestProfiler(
+    app.config["PROFILE_DIR"],
+    sample_rate=app.config["PROFILE_SAMPLE_RATE"],
+    threshold=app.config["PROFILE_THRESHOLD_MS"] / 1000,
+    collector=app.config["PROFILE_COLLECTOR"],
+    keep=app.config["PROFILE_KEEP"],
+)
+
+
+# Profile request dispatch; the hooks are only installed when profiling is on
+def start_profile():
+    g.profile = profiler.start()
+
+
+def finish_profile(exception):
+    token = g.pop("profile", None)
+    if token is not None:
+        profiler.finish(token, request.method, request.endpoint or "unmatched")
+
+
+if profiler.enabled:
+    app.before_request(start_profile)
+    app.teardown_request(finish_profile)
+
+
+# Symbol checks that need a provider that's failing (see helpers.valid_symbol)
+@app.errorhandler(UpstreamError)
+def upstream_unavailable(e):
+    if request.path.startswith(("/api/", "/stream/")):
+        return jsonify({"error": "Quotes unavailable, try again later"}), 503
+    return apology("quote unavailable, try again later", 503)
+
+
+@app.before_request
+def start_timer():
+    g.request_started = time.perf_counter()
+
+
+# Record latency per route (time until the response is returned; streamed
+# bodies aren't included)
+@app.after_request
+def record_request(response):
+    if "request_started" in g:
+        elapsed = time.perf_counter() - g.request_started
+        route = request.url_rule.rule if request.url_rule else "unmatched"
+        registry.observe(
+            "tradehub_request_duration_seconds",
+            elapsed,
+            route=route,
+            method=request.method,
+            status=response.status_code,
+        )
+        log_sampled(
+            "request",
+            route=route,
+            method=request.method,
+            status=response.status_code,
+            ms=round(elapsed * 1000, 2),
+            queries=query_count(),
+        )
+    return response
 
 
 @app.after_request
 def after_request(response):
-    """Ensure responses aren't cached"""
-    response.headers["Cache-Control"] = "no-cache, no-store, must-revalidate"
-    response.headers["Expires"] = 0
-    response.headers["Pragma"] = "no-cache"
+    """Keep pages out of caches; other responses may be kept but revalidated"""
+
+    # Static files and responses that set their own caching keep it
+    if request.endpoint == "static" or "Cache-Control" in response.headers:
+        return response
+
+    # Pages show account data and must not come back from the browser cache
+    # (e.g. with the back button after logging out)
+    if response.mimetype == "text/html":
+        response.headers["Cache-Control"] = "no-cache, no-store, must-revalidate"
+        response.headers["Expires"] = 0
+        response.headers["Pragma"] = "no-cache"
+    else:
+        response.headers["Cache-Control"] = "private, no-cache"
     return response
 
 
@@ -42,33 +386,131 @@ def after_request(response):
 @app.context_processor
 def inject_username():
     if "user_id" in session:
-        user_id = session["user_id"]
-        username = db.execute("SELECT username FROM users WHERE id = ?", user_id)[0][
-            "username"
-        ]
-        return {"username": username}
+        # Username never changes, so keep it in the session after the first query
+        if "username" not in session:
+            session["username"] = load_account(db)["username"]
+        return {"username": session["username"]}
     else:
         return {"username": "None"}
 
 
-@app.route("/")
-@login_required
-def index():
-    """Show portfolio of stocks"""
+# Report number of SQL queries per request while testing/debugging
+@app.after_request
+def report_query_count(response):
+    if app.testing or app.debug:
+        response.headers["X-Query-Count"] = query_count()
+    return response
 
-    stocks = db.execute(
-        "SELECT symbol, symbol_name, SUM(amount) AS sum, AVG(price) AS average_price FROM stocks WHERE user_id = ? GROUP BY symbol HAVING sum > 0",
-        session["user_id"],
+
+@app.route("/metrics")
+def prometheus_metrics():
+    """Export metrics of this process in Prometheus text format"""
+
+    token = app.config["METRICS_TOKEN"]
+    if token and not hmac.compare_digest(
+        request.headers.get("Authorization", ""), f"Bearer {token}"
+    ):
+        return Response("unauthorized\n", status=401, mimetype="text/plain")
+    return Response(registry.render(), mimetype="text/plain; version=0.0.4")
+
+
+@app.route("/admin/profiles")
+@admin_required
+def admin_profiles():
+    """List kept request profiles, newest first"""
+
+    return jsonify(
+        {
+            "enabled": profiler.enabled,
+            "collector": profiler.collector,
+            "profiles": profiler.profiles(),
+        }
+    )
+
+
+@app.route("/admin/profiles/<name>")
+@admin_required
+def admin_profile(name):
+    """Return one profile (cProfile ones as a text report unless ?raw=1)"""
+
+    path = profiler.path(name)
+    if path is None:
+        return apology("profile not found", 404)
+    if name.endswith(".prof") and request.args.get("raw") != "1":
+        return Response(profile_report(path), mimetype="text/plain")
+    return send_file(path, mimetype="text/plain", as_attachment=name.endswith(".prof"))
+
+
+# Each user's open positions, reused while their ledger gets no new rows
+positions_cache = TTLCache(maxsize=10000, ttl=300)
+
+
+def load_portfolio(user_id):
+    """
+    Return (version, cash, stocks, quotes) of user's portfolio.
+
+    version is a tag of the user's last ledger row id, cash and the quotes of
+    the held symbols, so it changes exactly when the valued portfolio can.
+    Positions are only re-read when the last ledger row id changes.
+    """
+
+    # The user_id index is ordered by (user_id, id), so MAX(id) is one lookup
+    account = db.execute(
+        "SELECT cash, (SELECT MAX(id) FROM stocks WHERE user_id = users.id) AS ledger_id FROM users WHERE id = ?",
+        user_id,
+    )[0]
+
+    cached = positions_cache.get(user_id)
+    if cached is not None and cached[0] == account["ledger_id"]:
+        stocks = cached[1]
+    else:
+        stocks = [
+            dict(stock)
+            for stock in db.execute(
+                "SELECT symbol, symbol_name, quantity AS sum, cost_basis / quantity AS average_price FROM positions WHERE user_id = ? AND quantity > 0 ORDER BY symbol",
+                user_id,
+            )
+        ]
+        positions_cache.set(user_id, (account["ledger_id"], stocks))
+
+    # Get real-time prices of all stocks at once
+    quotes = lookup_many(
+        [stock["symbol"] for stock in stocks],
+        timeout=app.config["QUOTE_BATCH_TIMEOUT"],
     )
 
+    # The quote tick of a symbol is its price and previous close, which keeps
+    # the version the same across worker processes
+    ticks = [
+        (symbol, quote["price"], quote["previous_close"]) if quote else (symbol,)
+        for symbol, quote in sorted(quotes.items())
+    ]
+    version = hashlib.sha1(
+        repr((account["ledger_id"], account["cash"], ticks)).encode()
+    ).hexdigest()[:20]
+    return version, account["cash"], stocks, quotes
+
+
+def value_portfolio(cash, stocks, quotes):
+    """Value stocks at quotes; returns (stocks with values, totals dict)."""
+
+    stocks = [dict(stock) for stock in stocks]
+
     # Get current prices of each stock that the user has and calculate their total
     total = 0  # initialize total
     total_performance = 0  # initialize total_performance
 
     for stock in stocks:
-        # Get real-time stock price
-        stock_info = lookup(stock["symbol"])
+        stock_info = quotes[stock["symbol"]]
+
+        # Fall back to the average price if the quote didn't arrive in time
+        if stock_info is None:
+            stock_info = {
+                "price": stock["average_price"],
+                "previous_close": stock["average_price"],
+            }
         stock["price"] = stock_info["price"]
+        stock["stale"] = stock_info.get("stale", False)
 
         # Calculate today's price percentage difference
         stock["previous_close"] = stock_info["previous_close"]
@@ -97,24 +539,101 @@ def index():
     else:
         total_performance_percentage = round(total_performance / total * 100, 2)
 
-    # Query cash from DB
-    user_cash = db.execute("SELECT cash FROM users WHERE id = ?", session["user_id"])[
-        0
-    ]["cash"]
+    return stocks, {
+        "cash": cash,
+        "holdings": total,
+        # TOTAL (stock values + user cash)
+        "total": total + cash,
+        "performance": total_performance,
+        "performance_percentage": total_performance_percentage,
+    }
 
-    # Calculate TOTAL (stock values + user cash)
-    total = total + user_cash
+
+def conditional_json(version, build):
+    """
+    Return 304 if the client already has version (If-None-Match), else the
+    JSON of build() tagged with it. Clients may keep it but must revalidate.
+    """
+
+    if request.if_none_match.contains(version):
+        response = Response(status=304)
+    else:
+        response = jsonify(build())
+    response.set_etag(version)
+    response.headers["Cache-Control"] = "private, no-cache"
+    return response
+
+
+@app.route("/")
+@login_required
+def index():
+    """Show portfolio of stocks"""
+
+    _, cash, stocks, quotes = load_portfolio(session["user_id"])
+    stocks, totals = value_portfolio(cash, stocks, quotes)
 
     return render_template(
         "index.html",
         stocks=stocks,
-        cash=user_cash,
-        total=total,
-        total_performance=total_performance,
-        total_performance_percentage=total_performance_percentage,
+        cash=totals["cash"],
+        total=totals["total"],
+        total_performance=totals["performance"],
+        total_performance_percentage=totals["performance_percentage"],
     )
 
 
+@app.route("/api/portfolio")
+@login_required
+def portfolio_api():
+    """Return cash, holdings value and performance (conditional GET via ETag)"""
+
+    version, cash, stocks, quotes = load_portfolio(session["user_id"])
+
+    def build():
+        _, totals = value_portfolio(cash, stocks, quotes)
+        return {
+            "cash": round(totals["cash"], 2),
+            "holdings": round(totals["holdings"], 2),
+            "total": round(totals["total"], 2),
+            "performance": round(totals["performance"], 2),
+            "performance_percentage": totals["performance_percentage"],
+            "positions": len(stocks),
+        }
+
+    return conditional_json(version, build)
+
+
+@app.route("/api/positions")
+@login_required
+def positions_api():
+    """Return open positions at current prices (conditional GET via ETag)"""
+
+    version, cash, stocks, quotes = load_portfolio(session["user_id"])
+
+    def build():
+        valued, _ = value_portfolio(cash, stocks, quotes)
+        return {
+            "positions": [
+                {
+                    "symbol": stock["symbol"],
+                    "name": stock["symbol_name"],
+                    "shares": stock["sum"],
+                    "average_price": round(stock["average_price"], 2),
+                    "price": stock["price"],
+                    "previous_close": stock["previous_close"],
+                    "percentage_change": stock["percentage_change"],
+                    "value": round(stock["total"], 2),
+                    "performance": round(stock["performance"], 2),
+                    "performance_percentage": stock["performance_percentage"],
+                    "stale": stock["stale"],
+                }
+                for stock in valued
+            ]
+        }
+
+    return conditional_json(version, build)
+
+
 @app.route("/buy", methods=["GET", "POST"])
 @login_required
 def buy():
@@ -123,9 +642,7 @@ def buy():
     # User reached route via GET
     if request.method == "GET":
         # Query cash from DB
-        user_cash = db.execute(
-            "SELECT cash FROM users WHERE id = ?", session["user_id"]
-        )[0]["cash"]
+        user_cash = load_account(db)["cash"]
 
         return render_template("buy.html", user_cash=user_cash)
 
@@ -139,7 +656,7 @@ def buy():
             return apology("must provide ticker symbol", 400)
 
         # Ensure provided symbol is correct
-        elif lookup(symbol) == None:
+        elif not valid_symbol(symbol):
             return apology("invalid symbol")
 
         # Ensure amount of share are provided
@@ -154,46 +671,29 @@ def buy():
         except ValueError:
             return apology("non-integer shares", 400)
 
-        # Check if the user has enough cash
-        price = lookup(symbol)["price"]
-        total = price * shares
-        cash_query = db.execute(
-            "SELECT cash FROM users WHERE id = ?", session["user_id"]
-        )
-        if cash_query:
-            user_cash = cash_query[0]["cash"]
-        else:
-            return apology("no cash in DB")
+        # Get current price (never a stale one for a trade)
+        quote = lookup(symbol, allow_stale=False)
+        if quote is None:
+            return apology("quote unavailable, try again later", 503)
 
-        if total > user_cash:
+        # Check if the user has enough cash
+        price = quote["price"]
+        user_cash = load_account(db)["cash"]
+        if price * shares > user_cash:
             return apology("not enough cash")
 
-        else:
-            # Get current date/time and convert to SQL format YYYY-MM-DD HH:MM:SS
-            date_time = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-
-            # Get stock name
-            symbol_name = get_data(symbol)["symbol_name"]
-
-            # Capitalize symbol
-            symbol = symbol.upper()
+        # Get stock name
+        symbol_name = get_symbol_name(symbol)
 
-            # Buy stocks
-            db.execute(
-                "INSERT INTO stocks (symbol, symbol_name, price, amount, date_time, user_id) VALUES (?, ?, ?, ?, ?, ?)",
-                symbol,
-                symbol_name,
-                price,
-                shares,
-                date_time,
-                session["user_id"],
-            )
+        # Capitalize symbol
+        symbol = symbol.upper()
 
-            # Correct cash after purchase in DB
-            user_cash = user_cash - total
-            db.execute(
-                "UPDATE users SET cash = ? WHERE id = ?", user_cash, session["user_id"]
-            )
+        # Buy stocks (cash is re-checked atomically in case it changed meanwhile)
+        try:
+            trading.buy(db, session["user_id"], symbol, symbol_name, price, shares)
+        except TradeError as e:
+            return apology(str(e))
+        leaderboard.refresh_user(session["user_id"])
 
         # Alert the user
         flash(f"{symbol} x {shares} bought!")
@@ -205,15 +705,131 @@ def buy():
 @app.route("/history")
 @login_required
 def history():
-    """Show history of transactions"""
+    """Show history of transactions, newest first, one page at a time"""
+
+    symbol = request.args.get("symbol", "").strip().upper()
+    start = request.args.get("start", "")
+    end = request.args.get("end", "")
+    before = request.args.get("before", "")
+    archived = "1" if request.args.get("archived") == "1" else ""
+
+    conditions = ""
+    args = []
+
+    # Filter by symbol
+    if symbol:
+        conditions += " AND symbol = ?"
+        args.append(symbol)
+
+    # Filter by date range (YYYY-MM-DD, both ends inclusive)
+    try:
+        if start:
+            datetime.strptime(start, "%Y-%m-%d")
+            conditions += " AND date_time >= ?"
+            args.append(start)
+        if end:
+            datetime.strptime(end, "%Y-%m-%d")
+            conditions += " AND date_time < date(?, '+1 day')"
+            args.append(end)
+    except ValueError:
+        return apology("invalid date", 400)
+
+    # Continue after the last row of the previous page ("date_time,id" cursor)
+    if before:
+        before_date_time, _, before_id = before.rpartition(",")
+        if not before_date_time or not before_id.isdigit():
+            return apology("invalid page", 400)
+        conditions += " AND (date_time, id) < (?, ?)"
+        args += [before_date_time, int(before_id)]
+
+    # The ledger shows compacted trades as carry-forward rows; with ?archived=1
+    # the trades themselves are read back from stocks_archive instead
+    columns = "id, symbol, symbol_name, price, amount, date_time"
+    query = f"SELECT {columns}, carry_forward FROM stocks WHERE user_id = ?{conditions}"
+    args = [session["user_id"], *args]
+    if archived:
+        query = (
+            f"SELECT {columns}, 0 AS carry_forward FROM stocks WHERE user_id = ?{conditions} AND carry_forward = 0 "
+            f"UNION ALL SELECT {columns}, 0 FROM stocks_archive WHERE user_id = ?{conditions}"
+        )
+        args = args + args
+
+    # Fetch one extra row to know whether there's a next page
+    page_size = app.config["HISTORY_PAGE_SIZE"]
+    query += " ORDER BY date_time DESC, id DESC LIMIT ?"
+    page = {"next": None}
+
+    def stocks():
+        # Yield rows straight from the cursor; the cursor of the next page is
+        # known once the extra row shows up (the link is rendered after the table)
+        last = None
+        for count, stock in enumerate(db.iterate(query, *args, page_size + 1)):
+            if count == page_size:
+                page["next"] = f"{last['date_time']},{last['id']}"
+                break
+            last = stock
+            yield stock
+
+    # Stream the page so the browser gets the first rows right away
+    filters = {"symbol": symbol, "start": start, "end": end, "archived": archived}
+    return stream_template(
+        "history.html",
+        stocks=stocks(),
+        filters=filters,
+        links={key: value for key, value in filters.items() if value},
+        paginated=bool(before),
+        page=page,
+    )
 
-    # Query transactions history from stocks table
-    stocks = db.execute(
-        "SELECT symbol, symbol_name, price, amount, date_time FROM stocks WHERE user_id = ?",
+
+@app.route("/api/pnl")
+@login_required
+def pnl():
+    """Return realized and unrealized P&L (FIFO tax lots or average cost)"""
+
+    method = request.args.get("method", "fifo")
+    if method not in ("fifo", "average"):
+        return jsonify({"error": "method must be fifo or average"}), 400
+
+    # Only open positions need current prices
+    rows = db.execute(
+        "SELECT symbol FROM positions WHERE user_id = ? AND quantity > 0",
         session["user_id"],
     )
+    quotes = lookup_many(
+        [row["symbol"] for row in rows], timeout=app.config["QUOTE_BATCH_TIMEOUT"]
+    )
+
+    if method == "average":
+        return jsonify(average_cost_pnl(db, session["user_id"], quotes))
+    # Open FIFO lots and sales are listed with ?details=1
+    details = request.args.get("details") == "1"
+    return jsonify(portfolio_pnl(db, session["user_id"], quotes, details=details))
+
+
+@app.route("/api/portfolio/history")
+@login_required
+def portfolio_history_api():
+    """Return daily portfolio value for ?range= (1m, 3m, 6m, 1y, 5y or all)"""
+
+    period = request.args.get("range", "1m")
+    if period not in RANGES:
+        return jsonify({"error": f"range must be one of {', '.join(RANGES)}"}), 400
+    return jsonify(portfolio_history(db, session["user_id"], period, market_date()))
 
-    return render_template("history.html", stocks=stocks)
+
+@app.route("/leaderboard")
+@login_required
+def leaderboard_page():
+    """Show top users by equity or return (?by=return) and the user's own rank"""
+
+    by = "return" if request.args.get("by") == "return" else "equity"
+    return render_template(
+        "leaderboard.html",
+        by=by,
+        leaders=leaderboard.top(app.config["LEADERBOARD_SIZE"], by),
+        me=leaderboard.rank(session["user_id"], by),
+    )
 
 
 @app.route("/login", methods=["GET", "POST"])
@@ -246,10 +862,7 @@ def login():
 
         # Remember which user has logged in
         session["user_id"] = rows[0]["id"]
-
-        # Assign the username to the global variable
-        global username
-        username = request.form.get("username")
+        session["username"] = rows[0]["username"]
 
         # Redirect user to home page
         return redirect("/")
@@ -279,14 +892,11 @@ def quote():
     if request.method == "POST":
         if request.headers.get("X-Requested-With") == "XMLHttpRequest":
             try:
-                # Log headers and JSON payload
-                print("Headers:", request.headers)
-                print("Request data:", request.get_data())
-
                 # Get the symbol from the AJAX request
                 symbol = request.get_json()["symbol"]
                 if not symbol:
                     return jsonify({"error": "Invalid symbol"}), 400
+                log_sampled("quote_refresh", symbol=symbol)
 
                 # Call the get_data() function to get the updated stock data
                 stock_data = get_data(symbol)
@@ -296,7 +906,7 @@ def quote():
 
                 return jsonify(stock_data)
             except Exception as e:
-                print(f"Error processing request: {e}")  # Log the error
+                log_event("quote_refresh_failed", logging.ERROR, error=repr(e))
                 return (
                     jsonify(
                         {"error": "An error occurred while processing the request"}
@@ -313,23 +923,22 @@ def quote():
                 return apology("must provide ticker symbol")
 
             # Ensure provided symbol is correct
-            elif lookup(symbol) == None:
+            elif not valid_symbol(symbol):
                 return apology("invalid symbol")
 
             # Call the get_data() function to get stock data
             stock_data = get_data(symbol)
 
             # Query cash from DB
-            user_cash = db.execute(
-                "SELECT cash FROM users WHERE id = ?", session["user_id"]
-            )[0]["cash"]
+            user_cash = load_account(db)["cash"]
 
             # Query available shares from DB for a current logged in user
-            available_shares = db.execute(
-                "SELECT SUM(amount) AS sum FROM stocks WHERE user_id = ? AND symbol = ?",
+            rows = db.execute(
+                "SELECT quantity FROM positions WHERE user_id = ? AND symbol = ?",
                 session["user_id"],
                 symbol.upper(),
-            )[0]["sum"]
+            )
+            available_shares = rows[0]["quantity"] if rows else 0
 
             return render_template(
                 "quoted.html",
@@ -343,6 +952,56 @@ def quote():
         return render_template("quote.html")
 
 
+@app.route("/symbols/search")
+@login_required
+def search_symbols():
+    """Autocomplete ticker symbols and company names"""
+
+    return jsonify(symbol_universe.search(request.args.get("q", "")))
+
+
+@app.route("/stream/quotes")
+@login_required
+def stream_quotes():
+    """Stream quote updates for symbols as Server-Sent Events."""
+
+    symbols = {
+        symbol.strip().upper()
+        for symbol in request.args.get("symbols", "").split(",")
+        if symbol.strip()
+    }
+
+    # Ensure a sensible number of symbols was requested
+    if not symbols or len(symbols) > 20:
+        return jsonify({"error": "Provide 1 to 20 comma-separated symbols"}), 400
+
+    # Only poll upstream for symbols that exist
+    unknown = sorted(symbol for symbol in symbols if not valid_symbol(symbol))
+    if unknown:
+        return jsonify({"error": f"Unknown symbols: {', '.join(unknown)}"}), 400
+
+    subscription = quote_stream.subscribe(symbols)
+
+    def events():
+        try:
+            yield "retry: 5000\n\n"
+            while True:
+                try:
+                    symbol, fields = subscription.get(timeout=15)
+                except queue.Empty:
+                    # Keep idle connections (and proxies) from timing out
+                    yield ": keep-alive\n\n"
+                    continue
+                yield f"event: quote\ndata: {json.dumps({**fields, 'symbol': symbol})}\n\n"
+        finally:
+            # Client went away
+            quote_stream.unsubscribe(subscription)
+
+    return Response(
+        events(), mimetype="text/event-stream", headers={"X-Accel-Buffering": "no"}
+    )
+
+
 @app.route("/register", methods=["GET", "POST"])
 def register():
     """Register user"""
@@ -382,6 +1041,8 @@ def register():
         # Log user in immediately after registration
         rows = db.execute("SELECT * FROM users WHERE username = ?", username)
         session["user_id"] = rows[0]["id"]
+        session["username"] = rows[0]["username"]
+        leaderboard.refresh_user(session["user_id"])
 
         # Alert the user
         flash("You have successfully registered!")
@@ -401,7 +1062,7 @@ def sell():
 
     # Query stocks from DB for a current logged in user
     stocks = db.execute(
-        "SELECT symbol, SUM(amount) AS sum FROM stocks WHERE user_id = ? GROUP BY symbol HAVING sum > 0",
+        "SELECT symbol, quantity AS sum FROM positions WHERE user_id = ? AND quantity > 0 ORDER BY symbol",
         session["user_id"],
     )
 
@@ -434,37 +1095,26 @@ def sell():
             return apology("invalid shares", 400)
 
         else:
-            # Get user's cash value
-            cash = db.execute(
-                "SELECT cash FROM users WHERE id = ?", session["user_id"]
-            )[0]["cash"]
-
-            # Get current stock price and total value
-            price = lookup(symbol)["price"]
-            total = price * int(shares)
+            # Get current stock price (never a stale one for a trade)
+            quote = lookup(symbol, allow_stale=False)
+            if quote is None:
+                return apology("quote unavailable, try again later", 503)
+            price = quote["price"]
 
             # Get stock name
-            symbol_name = get_data(symbol)["symbol_name"]
+            symbol_name = get_symbol_name(symbol)
 
             # Capitalize symbol
             symbol = symbol.upper()
 
-            # Sell shares and update DB with negative amount of shares and updated cash value
-            date_time = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-            db.execute(
-                "INSERT INTO stocks (symbol, symbol_name, price, amount, date_time, user_id) VALUES (?, ?, ?, ?, ?, ?);",
-                symbol,
-                symbol_name,
-                price,
-                -int(shares),
-                date_time,
-                session["user_id"],
-            )
-
-            cash = cash + total
-            db.execute(
-                "UPDATE users SET cash = ? WHERE id = ?", cash, session["user_id"]
-            )
+            # Sell shares, updating ledger, position and cash in one transaction
+            try:
+                trading.sell(
+                    db, session["user_id"], symbol, symbol_name, price, int(shares)
+                )
+            except TradeError as e:
+                return apology(str(e), 400)
+            leaderboard.refresh_user(session["user_id"])
 
             # Alert the user
             flash(f"{symbol} x {shares} sold!")
@@ -473,6 +1123,177 @@ def sell():
             return redirect("/")
 
 
+@app.route("/api/orders/batch", methods=["POST"])
+@login_required
+def batch_orders():
+    """
+    Execute many market orders at once, all or nothing.
+
+    Expects {"orders": [{"symbol", "side": "buy" or "sell", "shares"}, ...]}.
+    Every distinct symbol is priced once, sells run before buys so their
+    proceeds can pay for them, and the whole batch is one transaction.
+    """
+
+    data = request.get_json(silent=True) or {}
+    batch = data.get("orders")
+    limit = app.config["BATCH_ORDER_LIMIT"]
+    if not isinstance(batch, list) or not 1 <= len(batch) <= limit:
+        return jsonify({"error": f"Provide 1 to {limit} orders"}), 400
+
+    # Validate every order before touching the database
+    orders = []
+    for index, order in enumerate(batch):
+        if not isinstance(order, dict):
+            return jsonify({"error": "Invalid order", "index": index}), 400
+        symbol = str(order.get("symbol") or "").upper()
+        side = order.get("side")
+        shares = order.get("shares")
+        if not symbol or not valid_symbol(symbol):
+            return jsonify({"error": "Invalid symbol", "index": index}), 400
+        if side not in SIDES:
+            return jsonify({"error": "Side must be buy or sell", "index": index}), 400
+        if not isinstance(shares, int) or isinstance(shares, bool) or shares < 1:
+            return jsonify({"error": "Invalid shares", "index": index}), 400
+        orders.append({"symbol": symbol, "side": side, "shares": shares})
+
+    # One price per distinct symbol
+    symbols = sorted({order["symbol"] for order in orders})
+    quotes = lookup_many(
+        symbols, timeout=app.config["QUOTE_BATCH_TIMEOUT"], allow_stale=False
+    )
+    for index, order in enumerate(orders):
+        if quotes[order["symbol"]] is None:
+            return jsonify({"error": "No price available", "index": index}), 503
+        order["price"] = quotes[order["symbol"]]["price"]
+        order["total"] = round(order["price"] * order["shares"], 2)
+    names = {symbol: get_symbol_name(symbol) for symbol in symbols}
+
+    # Check the whole batch against holdings and cash (re-checked atomically)
+    holdings = {
+        row["symbol"]: row["quantity"]
+        for row in db.execute(
+            "SELECT symbol, quantity FROM positions WHERE user_id = ?",
+            session["user_id"],
+        )
+    }
+    cash = load_account(db)["cash"]
+    for order in orders:
+        if order["side"] == "sell":
+            symbol = order["symbol"]
+            holdings[symbol] = holdings.get(symbol, 0) - order["shares"]
+            cash += order["price"] * order["shares"]
+    for order in orders:
+        if order["side"] == "buy":
+            cash -= order["price"] * order["shares"]
+    if any(quantity < 0 for quantity in holdings.values()):
+        return jsonify({"error": "not enough shares"}), 400
+    if cash < 0:
+        return jsonify({"error": "not enough cash"}), 400
+
+    # Sells first so their proceeds are available to the buys
+    def operation():
+        for order in sorted(orders, key=lambda order: order["side"] != "sell"):
+            if order["side"] == "sell":
+                execute = trading.execute_sell
+            else:
+                execute = trading.execute_buy
+            execute(
+                db,
+                session["user_id"],
+                order["symbol"],
+                names[order["symbol"]],
+                order["price"],
+                order["shares"],
+            )
+
+    try:
+        trading.run_transaction(db, operation)
+    except TradeError as e:
+        return jsonify({"error": str(e)}), 400
+    leaderboard.refresh_user(session["user_id"])
+
+    cash = db.execute("SELECT cash FROM users WHERE id = ?", session["user_id"])
+    return jsonify({"orders": orders, "cash": round(cash[0]["cash"], 2)})
+
+
+@app.route("/orders", methods=["GET", "POST"])
+@login_required
+def orders():
+    """Show and place limit and stop orders"""
+
+    # User reached route via GET
+    if request.method == "GET":
+        user_orders = db.execute(
+            "SELECT * FROM orders WHERE user_id = ? ORDER BY status != 'open', id DESC LIMIT 100",
+            session["user_id"],
+        )
+        return render_template("orders.html", orders=user_orders)
+
+    # User reached route via POST (by submitting the order form)
+    symbol = request.form.get("symbol")
+    side = request.form.get("side")
+    order_type = request.form.get("order_type")
+
+    if not symbol:
+        return apology("must provide ticker symbol", 400)
+    elif not valid_symbol(symbol):
+        return apology("invalid symbol")
+    elif side not in SIDES or order_type not in ORDER_TYPES:
+        return apology("invalid order type", 400)
+
+    # Ensure price is positive and shares a positive integer
+    try:
+        price = round(float(request.form.get("price")), 2)
+        shares = int(request.form.get("shares"))
+    except (TypeError, ValueError):
+        return apology("invalid price or shares", 400)
+    if price <= 0 or shares < 1:
+        return apology("invalid price or shares", 400)
+
+    symbol = symbol.upper()
+
+    # Check cash or shares now (they're checked again when the order fills)
+    if side == "buy":
+        if price * shares > load_account(db)["cash"]:
+            return apology("not enough cash")
+    else:
+        rows = db.execute(
+            "SELECT quantity FROM positions WHERE user_id = ? AND symbol = ?",
+            session["user_id"],
+            symbol,
+        )
+        if not rows or rows[0]["quantity"] < shares:
+            return apology("not enough shares")
+
+    order = place_order(
+        db,
+        session["user_id"],
+        symbol,
+        get_symbol_name(symbol),
+        side,
+        order_type,
+        price,
+        shares,
+    )
+    order_engine.add(order)
+
+    flash(f"{order_type.capitalize()} order to {side} {symbol} x {shares} placed!")
+    return redirect("/orders")
+
+
+@app.route("/orders/<int:order_id>/cancel", methods=["POST"])
+@login_required
+def cancel(order_id):
+    """Cancel an open order"""
+
+    if not cancel_order(db, session["user_id"], order_id):
+        return apology("order is not open", 400)
+    order_engine.discard(order_id)
+
+    flash("Order cancelled!")
+    return redirect("/orders")
+
+
 @app.route("/change_password", methods=["GET", "POST"])
 def change_password():
     """Change user's password"""
@@ -530,9 +1351,7 @@ def money():
     # User reached route via GET (as by clicking a link or via redirect)
     if request.method == "GET":
         # Query user's cash balance
-        user_cash = db.execute(
-            "SELECT cash FROM users WHERE id = ?", session["user_id"]
-        )[0]["cash"]
+        user_cash = load_account(db)["cash"]
         return render_template("money.html", user_cash=user_cash)
 
     # User reached route via POST (as by submitting a form via POST)
@@ -551,28 +1370,96 @@ def money():
         elif not action:
             return apology("must provide action", 400)
 
-        # Get user's cash value
-        user_cash = db.execute(
-            "SELECT cash FROM users WHERE id = ?", session["user_id"]
-        )[0]["cash"]
-
         # Deposit
         if action == "deposit":
-            cash = user_cash + float(amount)
-            db.execute(
-                "UPDATE users SET cash = ? WHERE id = ?", cash, session["user_id"]
-            )
+            trading.deposit(db, session["user_id"], float(amount))
+            leaderboard.refresh_user(session["user_id"])
             flash(f"${amount} was deposited!")
             return redirect("/")
         # Withdraw
         elif action == "withdraw":
-            if float(amount) > user_cash:
+            try:
+                trading.withdraw(db, session["user_id"], float(amount))
+            except TradeError:
                 return apology("insufficient funds", 400)
-            cash = user_cash - float(amount)
-            db.execute(
-                "UPDATE users SET cash = ? WHERE id = ?", cash, session["user_id"]
-            )
+            leaderboard.refresh_user(session["user_id"])
             flash(f"${amount} was withdrawn")
             return redirect("/")
         else:
             return apology("invalid action", 400)
+
+
+@app.cli.command("rebuild-positions")
+def rebuild_positions_command():
+    """Rebuild the positions table from the stocks ledger."""
+
+    count = rebuild_positions(db)
+    click.echo(f"Rebuilt {count} positions")
+
+
+@app.cli.command("check-positions")
+def check_positions_command():
+    """Check the positions table against the stocks ledger."""
+
+    mismatches = check_positions(db)
+    for user_id, symbol, expected, actual in mismatches:
+        click.echo(f"user {user_id} {symbol}: expected {expected}, found {actual}")
+
+    if mismatches:
+        click.echo(f"{len(mismatches)} positions don't match the ledger")
+        sys.exit(1)
+    click.echo("Positions match the ledger")
+
+
+@app.cli.command("compact-ledger")
+@click.option(
+    "--days",
+    default=365,
+    help="Archive trades older than this many days.",
+)
+@click.option("--user", "user_id", type=int, default=None, help="Only this user.")
+def compact_ledger_command(days, user_id):
+    """Move old trades into stocks_archive, leaving carry-forward rows."""
+
+    before = (market_date() - timedelta(days=days)).isoformat()
+    archived, carried = compact_ledger(db, before, user_id)
+    click.echo(
+        f"Archived {archived} trades made before {before} "
+        f"into {carried} carry-forward rows"
+    )
+
+
+@app.cli.command("record-tape")
+@click.argument("symbol")
+@click.option("--ticks", default=60, help="Number of ticks to record.")
+@click.option("--interval", default=1.0, help="Seconds between ticks.")
+def record_tape_command(symbol, ticks, interval):
+    """Record live quotes for SYMBOL into a tape for the tape provider."""
+
+    symbol = symbol.upper()
+    os.makedirs(app.config["MARKET_DATA_TAPES"], exist_ok=True)
+    path = os.path.join(app.config["MARKET_DATA_TAPES"], f"{symbol}.jsonl")
+    record_tape(create_provider("yahoo"), symbol, path, ticks, interval)
+    click.echo(f"Recorded {symbol} to {path}")
+
+
+@app.cli.command("snapshot-portfolios")
+@click.option(
+    "--start",
+    default=None,
+    help="First day to snapshot (YYYY-MM-DD). Defaults to the last snapshot.",
+)
+def snapshot_portfolios_command(start):
+    """Take end-of-day portfolio snapshots, catching up on missed days."""
+
+    def quote(symbol):
+        stock = lookup(symbol, allow_stale=False)
+        return stock["price"] if stock else None
+
+    today = market_date()
+    if start:
+        start = datetime.strptime(start, "%Y-%m-%d").date()
+        count = take_snapshots(db, start, today, daily_closes, quote, today)
+    else:
+        count = catch_up(db, today, daily_closes, quote)
+    click.echo(f"Wrote {count} snapshots")
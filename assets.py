@@ -0,0 +1,128 @@
+import gzip
+import hashlib
+import mimetypes
+import os
+import posixpath
+import re
+
+from flask import Response, request
+
+# Optional: brotli variants are only built when the package is installed
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# File types worth compressing (images are compressed already)
+COMPRESSIBLE = {".css", ".js", ".json", ".map", ".svg", ".txt", ".html"}
+
+# Cache-Control of fingerprinted files, whose content never changes
+IMMUTABLE = "public, max-age=31536000, immutable"
+
+# url(...) references in stylesheets
+CSS_URL = re.compile(r"""url\(\s*(['"]?)([^'")]+)\1\s*\)""")
+
+
+class StaticAssets:
+    """
+    Fingerprinted copies of the files under a static directory.
+
+    build() reads every file once, names it after a hash of its content
+    (styles.css -> styles.<hash>.css) and precomputes gzip and, if the brotli
+    package is installed, brotli variants of text files. Stylesheets are
+    rewritten to point at the fingerprinted names of the files they use.
+
+    Fingerprinted URLs never change content, so they are served with a
+    one-year immutable Cache-Control and the best encoding the client accepts.
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+        self.names = {}  # filename -> fingerprinted filename
+        self.files = {}  # fingerprinted filename -> file dict (see _add)
+
+    def build(self):
+        """Fingerprint and compress all files of the directory."""
+
+        filenames = []
+        for root, _, files in os.walk(self.directory):
+            for name in files:
+                path = os.path.relpath(os.path.join(root, name), self.directory)
+                filenames.append(path.replace(os.sep, "/"))
+
+        # Stylesheets last, so the files they refer to have their names
+        for filename in sorted(filenames, key=lambda name: name.endswith(".css")):
+            with open(os.path.join(self.directory, filename), "rb") as file:
+                body = file.read()
+            if filename.endswith(".css"):
+                body = self._rewrite_css(filename, body)
+            self._add(filename, body)
+        return self
+
+    def fingerprinted(self, filename):
+        """Return fingerprinted name of filename (unchanged if unknown)."""
+
+        return self.names.get(filename, filename)
+
+    def send(self, filename):
+        """Return response for a fingerprinted filename, or None if unknown."""
+
+        asset = self.files.get(filename)
+        if asset is None:
+            return None
+
+        if request.if_none_match.contains(asset["etag"]):
+            response = Response(status=304)
+        else:
+            # Best encoding the client accepts
+            encoding = None
+            for candidate in ("br", "gzip"):
+                if candidate in asset and request.accept_encodings[candidate]:
+                    encoding = candidate
+                    break
+            response = Response(
+                asset[encoding] if encoding else asset["body"],
+                mimetype=asset["mimetype"],
+            )
+            if encoding:
+                response.headers["Content-Encoding"] = encoding
+
+        response.set_etag(asset["etag"])
+        response.headers["Cache-Control"] = IMMUTABLE
+        if "gzip" in asset:
+            response.headers["Vary"] = "Accept-Encoding"
+        return response
+
+    def _add(self, filename, body):
+        digest = hashlib.sha256(body).hexdigest()[:12]
+        root, extension = os.path.splitext(filename)
+        name = f"{root}.{digest}{extension}"
+
+        mimetype = mimetypes.guess_type(filename)[0] or "application/octet-stream"
+        asset = {"body": body, "etag": digest, "mimetype": mimetype}
+        if extension in COMPRESSIBLE:
+            # Keep a variant only when it's actually smaller
+            compressed = gzip.compress(body, compresslevel=9, mtime=0)
+            if len(compressed) < len(body):
+                asset["gzip"] = compressed
+            if brotli is not None:
+                compressed = brotli.compress(body, quality=11)
+                if len(compressed) < len(body):
+                    asset["br"] = compressed
+
+        self.names[filename] = name
+        self.files[name] = asset
+
+    def _rewrite_css(self, filename, body):
+        # Point relative url(...) references at fingerprinted names
+        directory = posixpath.dirname(filename)
+
+        def replace(match):
+            url = match[2]
+            target = posixpath.normpath(posixpath.join(directory, url))
+            if target not in self.names:
+                return match[0]
+            name = posixpath.relpath(self.names[target], directory or ".")
+            return f"url({match[1]}{name}{match[1]})"
+
+        return CSS_URL.sub(replace, body.decode("utf-8")).encode("utf-8")
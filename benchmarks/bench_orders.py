@@ -0,0 +1,173 @@
+"""
+Benchmark the limit/stop order trigger engine against recorded quote tapes.
+
+Creates a scratch database with --orders open orders spread around the prices
+of the tapes in tapes/, then replays every tick of every tape through
+OrderEngine.on_tick and reports load time, tick throughput and per-tick
+latency. With --fill, triggered orders are also filled against the database.
+
+Usage: python benchmarks/bench_orders.py [--orders 200000] [--users 1000] [--fill]
+"""
+
+import argparse
+import glob
+import json
+import os
+import random
+import sqlite3
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from database import Database  # noqa: E402
+from orders import OrderEngine, fill_order, triggers_on_fall  # noqa: E402
+from schema import init_schema  # noqa: E402
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+
+
+def load_tapes(directory):
+    # Return {symbol: [(time, price)]} from the JSONL tapes
+    tapes = {}
+    for path in sorted(glob.glob(os.path.join(directory, "*.jsonl"))):
+        symbol = os.path.splitext(os.path.basename(path))[0]
+        with open(path) as file:
+            ticks = [json.loads(line) for line in file if line.strip()]
+        tapes[symbol] = [
+            (float(tick["time"]), tick["price"]) for tick in ticks if "price" in tick
+        ]
+    return tapes
+
+
+def create_database(path, tapes, users, orders):
+    # Copy the users/stocks tables of tradehub.db, add the app's tables and
+    # fill them with users and random open orders around each tape's prices
+    source = sqlite3.connect(os.path.join(ROOT, "tradehub.db"))
+    tables = source.execute(
+        "SELECT sql FROM sqlite_master WHERE type = 'table' AND name IN ('users', 'stocks')"
+    ).fetchall()
+    source.close()
+
+    connection = sqlite3.connect(path)
+    for (sql,) in tables:
+        connection.execute(sql)
+    connection.executemany(
+        "INSERT INTO users (id, username, hash, cash) VALUES (?, ?, '', ?)",
+        [(user, f"user{user}", 1_000_000) for user in range(1, users + 1)],
+    )
+
+    # Orders rest on the side of the opening price where they don't trigger
+    # yet, anywhere up to the tape's range (and as far again) away from it
+    ranges = {}
+    for symbol, ticks in tapes.items():
+        prices = [price for _, price in ticks]
+        ranges[symbol] = (prices[0], min(prices), max(prices))
+    rows = []
+    for _ in range(orders):
+        symbol = random.choice(list(ranges))
+        opening, low, high = ranges[symbol]
+        side = random.choice(("buy", "sell"))
+        order_type = random.choice(("limit", "stop"))
+        if triggers_on_fall({"side": side, "order_type": order_type}):
+            trigger_price = random.uniform(2 * low - opening, opening - 0.01)
+        else:
+            trigger_price = random.uniform(opening + 0.01, 2 * high - opening)
+        rows.append(
+            (
+                random.randint(1, users),
+                symbol,
+                symbol,
+                side,
+                order_type,
+                round(trigger_price, 2),
+                random.randint(1, 10),
+            )
+        )
+    connection.commit()
+    connection.close()
+
+    db = Database(path)
+    init_schema(db)
+    connection = sqlite3.connect(path)
+    connection.executemany(
+        "INSERT INTO orders (user_id, symbol, symbol_name, side, order_type, trigger_price, shares, status, created_at) "
+        "VALUES (?, ?, ?, ?, ?, ?, ?, 'open', datetime('now'))",
+        rows,
+    )
+    connection.commit()
+    connection.close()
+    return db
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--orders", type=int, default=200_000)
+    parser.add_argument("--users", type=int, default=1000)
+    parser.add_argument("--tapes", default=os.path.join(ROOT, "tapes"))
+    parser.add_argument("--fill", action="store_true", help="fill triggered orders")
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    random.seed(args.seed)
+    tapes = load_tapes(args.tapes)
+    if not tapes:
+        sys.exit(f"no tapes in {args.tapes}")
+
+    # One feed of (time, symbol, price) ticks across all tapes
+    feed = sorted(
+        (tick_time, symbol, price)
+        for symbol, ticks in tapes.items()
+        for tick_time, price in ticks
+    )
+
+    with tempfile.TemporaryDirectory() as directory:
+        started = time.perf_counter()
+        db = create_database(
+            os.path.join(directory, "bench.db"), tapes, args.users, args.orders
+        )
+        print(f"created {args.orders} orders in {time.perf_counter() - started:.2f}s")
+
+        fills = []
+        if args.fill:
+            fill = lambda order, price: fills.append(fill_order(db, order, price))
+        else:
+            fill = lambda order, price: fills.append(True)
+        engine = OrderEngine(db, fill=fill, sync_interval=float("inf"))
+
+        started = time.perf_counter()
+        engine.sync()
+        print(f"loaded {len(engine)} open orders in {time.perf_counter() - started:.2f}s")
+
+        latencies = []
+        triggered = 0
+        started = time.perf_counter()
+        for _, symbol, price in feed:
+            tick_started = time.perf_counter()
+            triggered += len(engine.on_tick(symbol, price))
+            latencies.append(time.perf_counter() - tick_started)
+        elapsed = time.perf_counter() - started
+
+        latencies.sort()
+        print(
+            f"replayed {len(feed)} ticks in {elapsed:.3f}s "
+            f"({len(feed) / elapsed:,.0f} ticks/s), triggered {triggered} orders"
+        )
+        print(
+            f"tick latency: median {latencies[len(latencies) // 2] * 1e6:.0f}us, "
+            f"p99 {latencies[int(len(latencies) * 0.99)] * 1e6:.0f}us, "
+            f"max {latencies[-1] * 1e6:.0f}us"
+        )
+
+        started = time.perf_counter()
+        engine.shutdown()
+        if args.fill:
+            print(
+                f"filled {sum(fills)} of {len(fills)} triggered orders "
+                f"(others rejected) in {time.perf_counter() - started:.2f}s after replay"
+            )
+
+
+if __name__ == "__main__":
+    main()
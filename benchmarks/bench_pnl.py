@@ -0,0 +1,138 @@
+"""
+Benchmark /api/pnl's FIFO P&L on a long stocks ledger.
+
+Creates a scratch database with one user who made --rows trades in --symbols
+symbols, then times portfolio_pnl (and JSON encoding of its result, as the
+route does) on the first load (ledger read row by row), on a cold load
+(ledger from ledger_columns, as after a restart or cache eviction), warm, after
+--append new trades and with details.
+
+Usage: python benchmarks/bench_pnl.py [--rows 1000000] [--symbols 500]
+"""
+
+import argparse
+import json
+import os
+import random
+import sqlite3
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from database import Database  # noqa: E402
+from pnl import ledger_cache, portfolio_pnl  # noqa: E402
+from schema import init_schema  # noqa: E402
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+
+
+def trades(symbols, count, first_id=1):
+    # Random (id, symbol, price, amount, date_time) trades that never sell
+    # more shares than are held, one minute apart
+    held = dict.fromkeys(symbols, 0)
+    started = time.mktime((2020, 1, 1, 0, 0, 0, 0, 0, -1))
+    for offset in range(count):
+        symbol = random.choice(symbols)
+        if held[symbol] and random.random() < 0.4:
+            amount = -random.randint(1, held[symbol])
+        else:
+            amount = random.randint(1, 10)
+        held[symbol] += amount
+        yield (
+            first_id + offset,
+            symbol,
+            round(random.uniform(10, 500), 2),
+            amount,
+            time.strftime(
+                "%Y-%m-%d %H:%M:%S", time.gmtime(started + (first_id + offset) * 60)
+            ),
+        )
+
+
+def insert(path, rows):
+    connection = sqlite3.connect(path)
+    connection.executemany(
+        "INSERT INTO stocks (id, symbol, symbol_name, price, amount, date_time, user_id) "
+        "VALUES (?, ?, ?, ?, ?, ?, 1)",
+        ((row[0], row[1], row[1], *row[2:]) for row in rows),
+    )
+    connection.commit()
+    connection.close()
+
+
+def create_database(path, symbols, rows):
+    # Copy the users/stocks tables (and indexes) of tradehub.db, add the app's
+    # tables and give user 1 a ledger of rows trades
+    source = sqlite3.connect(os.path.join(ROOT, "tradehub.db"))
+    tables = source.execute(
+        "SELECT sql FROM sqlite_master WHERE tbl_name IN ('users', 'stocks') AND sql IS NOT NULL "
+        "ORDER BY type = 'index'"
+    ).fetchall()
+    source.close()
+
+    connection = sqlite3.connect(path)
+    for (sql,) in tables:
+        connection.execute(sql)
+    connection.execute(
+        "INSERT INTO users (id, username, hash, cash) VALUES (1, 'user1', '', 0)"
+    )
+    connection.commit()
+    connection.close()
+
+    db = Database(path)
+    init_schema(db)
+    insert(path, trades(symbols, rows))
+    return db
+
+
+def timed(label, call, repeat=1):
+    # Run call repeat times and print the median time
+    times = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        call()
+        times.append(time.perf_counter() - started)
+    times.sort()
+    print(f"{label}: {times[len(times) // 2]:.3f}s")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--rows", type=int, default=1_000_000)
+    parser.add_argument("--symbols", type=int, default=500)
+    parser.add_argument("--append", type=int, default=100)
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    random.seed(args.seed)
+    symbols = [f"S{index:04d}" for index in range(args.symbols)]
+    quotes = {
+        symbol: {"price": round(random.uniform(10, 500), 2), "symbol": symbol}
+        for symbol in symbols
+    }
+
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "bench.db")
+        started = time.perf_counter()
+        db = create_database(path, symbols, args.rows)
+        print(f"created {args.rows} trades in {time.perf_counter() - started:.2f}s")
+
+        def pnl(details=False):
+            # (sorting keys like Flask's jsonify)
+            result = portfolio_pnl(db, 1, quotes, details=details)
+            json.dumps(result, sort_keys=True)
+
+        timed("first load (row by row)", pnl)
+        ledger_cache.clear()
+        timed("cold load (ledger_columns)", pnl)
+        timed("warm", pnl, repeat=5)
+
+        insert(path, trades(symbols, args.append, first_id=args.rows + 1))
+        timed(f"after {args.append} new trades", pnl)
+        timed("warm with details", lambda: pnl(details=True))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,150 @@
+import threading
+import time
+from collections import OrderedDict
+
+
+class _Call:
+    """An upstream load in progress that other callers can wait on."""
+
+    def __init__(self):
+        self.event = threading.Event()
+        self.value = None
+        self.error = None
+
+
+class TTLCache:
+    """
+    Thread-safe LRU cache whose entries expire after a time-to-live.
+
+    Concurrent misses for the same key are coalesced (single-flight): the first
+    caller runs the loader and every other caller waits for its result.
+    """
+
+    def __init__(self, maxsize=512, ttl=60):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._entries = OrderedDict()  # key -> (expires_at, value)
+        self._calls = {}  # key -> _Call
+        self._lock = threading.Lock()
+
+        # Lookups served from the cache and ones that missed (see metrics.py)
+        self.hits = 0
+        self.misses = 0
+
+    def configure(self, maxsize=None, ttl=None):
+        """Change cache size and/or default TTL (in seconds)."""
+
+        with self._lock:
+            if ttl is not None:
+                self.ttl = ttl
+            if maxsize is not None:
+                self.maxsize = maxsize
+                self._evict()
+
+    def get(self, key):
+        """Return fresh cached value for key or None."""
+
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            if entry[0] <= time.monotonic():
+                del self._entries[key]
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def peek(self, key):
+        """Return fresh cached value for key or None, without counting a lookup."""
+
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[0] <= time.monotonic():
+                return None
+            return entry[1]
+
+    def set(self, key, value, ttl=None):
+        """Store value for key, expiring after ttl seconds (default TTL if None)."""
+
+        if ttl is None:
+            ttl = self.ttl
+        with self._lock:
+            self._entries[key] = (time.monotonic() + ttl, value)
+            self._entries.move_to_end(key)
+            self._evict()
+
+    def get_or_load(self, key, loader, ttl=None, count=True):
+        """
+        Return cached value for key, calling loader() once on a miss.
+
+        None results are returned but not cached. Callers that join a load
+        already running count as hits. Pass count=False when the lookup was
+        already counted (e.g. by a get() that missed).
+        """
+
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] > time.monotonic():
+                self._entries.move_to_end(key)
+                if count:
+                    self.hits += 1
+                return entry[1]
+
+            # Join the load that's already running for this key, if any
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+            if count:
+                if leader:
+                    self.misses += 1
+                else:
+                    self.hits += 1
+
+        if not leader:
+            call.event.wait()
+            if call.error is not None:
+                raise call.error
+            return call.value
+
+        try:
+            call.value = loader()
+            if call.value is not None:
+                self.set(key, call.value, ttl)
+            return call.value
+        except Exception as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.event.set()
+
+    def loading(self, key):
+        """Return whether a get_or_load() for key is running right now."""
+
+        with self._lock:
+            return key in self._calls
+
+    def invalidate(self, key):
+        """Drop key from the cache."""
+
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self):
+        """Drop all entries."""
+
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def _evict(self):
+        # Drop least recently used entries (caller holds the lock)
+        while len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
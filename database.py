@@ -0,0 +1,146 @@
+import queue
+import sqlite3
+import threading
+import time
+
+from flask import g, has_app_context
+
+from metrics import observe_query
+
+# Connection settings: WAL so readers don't block the writer, NORMAL sync (safe
+# with WAL), memory-mapped reads and a 16 MB page cache per connection
+PRAGMAS = (
+    "PRAGMA journal_mode = WAL",
+    "PRAGMA synchronous = NORMAL",
+    "PRAGMA mmap_size = 268435456",
+    "PRAGMA cache_size = -16000",
+    "PRAGMA temp_store = MEMORY",
+    "PRAGMA foreign_keys = ON",
+)
+
+
+class Database:
+    """
+    Thin data-access layer over sqlite3 with cs50.SQL-style execute().
+
+    Each thread borrows a connection from a pool on its first query and keeps
+    it until release() (called when a Flask app context ends), so connections,
+    their PRAGMAs and their prepared statement caches are reused across
+    requests. Rows are sqlite3.Row objects (indexable by column name).
+    """
+
+    def __init__(self, path, timeout=5, pool_size=16, cached_statements=256):
+        self.path = path
+        self.timeout = timeout
+        self.cached_statements = cached_statements
+        self._idle = queue.LifoQueue(maxsize=pool_size)
+        self._local = threading.local()
+
+    def execute(self, sql, *args):
+        """
+        Execute one SQL statement with ? placeholders bound to args.
+
+        Returns a list of rows for statements that return rows, the new row's
+        id for an INSERT, the number of affected rows for UPDATE/DELETE and
+        True otherwise.
+        """
+
+        _count_query()
+        started = time.perf_counter()
+        try:
+            cursor = self._connection().execute(sql, args)
+            if cursor.description is not None:
+                return cursor.fetchall()
+
+            command = sql.lstrip().split(None, 1)[0].upper()
+            if command in ("INSERT", "REPLACE"):
+                return cursor.lastrowid if cursor.rowcount == 1 else None
+            elif command in ("UPDATE", "DELETE"):
+                return cursor.rowcount
+            return True
+        finally:
+            observe_query(sql, time.perf_counter() - started)
+
+    def iterate(self, sql, *args):
+        """Yield rows of a SELECT one at a time instead of building a list."""
+
+        _count_query()
+        started = time.perf_counter()
+        cursor = self._connection().execute(sql, args)
+        observe_query(sql, time.perf_counter() - started)
+        yield from cursor
+
+    def tuples(self, sql, *args):
+        """
+        Return rows of a SELECT as plain tuples, which are much cheaper to
+        build than sqlite3.Row objects for bulk reads.
+        """
+
+        _count_query()
+        started = time.perf_counter()
+        try:
+            cursor = self._connection().cursor()
+            cursor.row_factory = None
+            return cursor.execute(sql, args).fetchall()
+        finally:
+            observe_query(sql, time.perf_counter() - started)
+
+    def release(self):
+        """Return this thread's connection to the pool, rolling back leftovers."""
+
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            return
+        del self._local.connection
+
+        if connection.in_transaction:
+            connection.rollback()
+        try:
+            self._idle.put_nowait(connection)
+        except queue.Full:
+            connection.close()
+
+    def init_app(self, app):
+        """Release the connection at the end of every Flask app context."""
+
+        app.teardown_appcontext(lambda exception: self.release())
+
+    def _connection(self):
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            try:
+                connection = self._idle.get_nowait()
+            except queue.Empty:
+                connection = self._connect()
+            self._local.connection = connection
+        return connection
+
+    def _connect(self):
+        # isolation_level=None: autocommit unless a BEGIN is executed explicitly
+        connection = sqlite3.connect(
+            self.path,
+            timeout=self.timeout,
+            isolation_level=None,
+            check_same_thread=False,
+            cached_statements=self.cached_statements,
+        )
+        connection.row_factory = sqlite3.Row
+        for pragma in PRAGMAS:
+            connection.execute(pragma)
+        return connection
+
+
+def _count_query():
+    if has_app_context():
+        g.query_count = g.get("query_count", 0) + 1
+
+
+def query_count():
+    """
+    Return number of queries run so far in the current request.
+
+    In testing/debug mode app.py reports it in the X-Query-Count header so that
+    tests can check query budgets per route.
+    """
+
+    return g.get("query_count", 0)
@@ -1,14 +1,59 @@
-import csv
-from datetime import datetime, time, timedelta
+from concurrent.futures import ThreadPoolExecutor, wait
+from datetime import datetime
+import logging
 import pytz
-import requests
-import urllib
-import uuid
-import yfinance as yf
+import time as _time
 
-from flask import redirect, render_template, request, session
+from flask import has_request_context, redirect, render_template, request, session
 from functools import wraps
 
+from cache import TTLCache
+from market_calendar import MarketCalendar
+from market_data import YahooProvider
+from metrics import log_event, registry, timed
+from upstream import UpstreamError
+
+# Backend that supplies quotes and market details (see market_data.py)
+provider = YahooProvider()
+
+# Store of slow-moving symbol fundamentals, set up by app.py (see metadata.py)
+symbol_metadata = None
+
+# Local store of daily bars, set up by app.py (see price_history.py)
+price_history = None
+
+# Known ticker symbols, set up by app.py (see symbols.py)
+symbol_universe = None
+symbols_strict = False
+
+# Symbols found not to exist upstream (only used when symbols_strict is off)
+invalid_symbols = TTLCache(maxsize=10000, ttl=3600)
+
+# Ids of users allowed on admin pages, set up by app.py
+admin_user_ids = set()
+
+# Recent quotes shared by all requests handled by this process
+quote_cache = TTLCache(maxsize=512, ttl=15)
+
+# Precomputed NYSE trading sessions (see market_calendar.py)
+market_calendar = MarketCalendar()
+
+# Seconds after the close before quotes are cached until the next open
+CLOSE_SETTLE = 300
+
+# Market details (bid/ask, day range, volume) cached while the market is closed
+market_cache = TTLCache(maxsize=512, ttl=15)
+
+# Last successfully fetched quote of each symbol, served (marked as stale)
+# while the provider is failing
+last_quotes = TTLCache(maxsize=4096, ttl=7 * 24 * 3600)
+
+# Functions called with (symbol, price) for every freshly fetched quote
+tick_listeners = []
+
+# Worker threads used by lookup_many to fetch several quotes at once
+quote_pool = ThreadPoolExecutor(max_workers=8, thread_name_prefix="quote")
+
 
 def apology(message, code=400):
     """Render message as an apology to user."""
@@ -51,6 +96,27 @@ def login_required(f):
     return decorated_function
 
 
+def admin_required(f):
+    """Decorate routes to require login as one of admin_user_ids."""
+
+    @wraps(f)
+    def decorated_function(*args, **kwargs):
+        if session.get("user_id") is None:
+            return redirect("/login")
+        if session["user_id"] not in admin_user_ids:
+            return apology("forbidden", 403)
+        return f(*args, **kwargs)
+
+    return decorated_function
+
+
+def set_admin_users(user_ids):
+    """Set ids of the users allowed on admin pages."""
+
+    global admin_user_ids
+    admin_user_ids = set(user_ids)
+
+
 def usd(value):
     """Format value as USD."""
 
@@ -89,94 +155,280 @@ def custom_humanize(number):
         return f"{number:.2f}{suffixes[magnitude]}"
 
 
+def market_date():
+    """Return today's date in New York (the exchange's trading date)."""
+
+    return datetime.now(pytz.timezone("US/Eastern")).date()
+
+
 def market_is_open():
-    # Define NYSE regular trading hours
-    nyse_open = time(9, 30)
-    nyse_close = time(16, 0)
-
-    # Define NYSE early closing hour (1:00 PM ET)
-    nyse_early_close = time(13, 0)
-
-    # Get the current time in Eastern Time (ET)
-    eastern = pytz.timezone("US/Eastern")
-    now = datetime.now(eastern)
-    current_time = now.time()
-
-    # List of NYSE holidays (sample)
-    holidays = [
-        datetime(2024, 1, 1),  # New Year's Day
-        datetime(2024, 7, 4),  # Independence Day
-        datetime(2024, 12, 25),  # Christmas Day
-    ]
-
-    # List of early closing days (sample)
-    early_closings = [
-        datetime(2024, 11, 29),  # Day after Thanksgiving
-        datetime(2024, 12, 24),  # Christmas Eve
-    ]
-
-    # Remove time part from current date for comparison
-    today = now.date()
-
-    # Check if today is a holiday
-    if today in [holiday.date() for holiday in holidays]:
-        return False
+    """Return whether the NYSE is in a trading session right now."""
 
-    # Check if today is a weekend
-    if now.weekday() >= 5:  # Saturday is 5 and Sunday is 6
-        return False
+    return market_calendar.is_open()
 
-    # Check if today is an early closing day
-    if today in [early_closing.date() for early_closing in early_closings]:
-        if nyse_open <= current_time < nyse_early_close:
-            return True
+
+def closed_market_ttl():
+    """
+    Return for how many seconds a freshly fetched quote stays valid while
+    the market is closed (until the next open), or None while it's open.
+
+    Quotes fetched within CLOSE_SETTLE seconds after the close still use the
+    regular TTL, since they may not include the closing auction yet. So do
+    quotes of providers whose prices don't follow market hours (tapes).
+    """
+
+    if not provider.follows_market_hours:
+        return None
+    now = _time.time()
+    wait = market_calendar.seconds_until_open(now)
+    if not wait:
+        return None
+    last_close = market_calendar.last_close(now)
+    if last_close is not None and now - last_close.timestamp() < CLOSE_SETTLE:
+        return None
+    return wait
+
+
+@timed
+def lookup(symbol, allow_stale=True):
+    """
+    Look up quote for symbol (served from quote_cache when fresh).
+
+    If the quote can't be fetched right now (the provider is failing or
+    another request is already refreshing it) the last known quote is
+    returned with "stale": True, unless allow_stale is off (e.g. for trades).
+    """
+
+    return _cached_quote(symbol.upper(), user_agent(), allow_stale)
+
+
+@timed
+def lookup_many(symbols, timeout=5, allow_stale=True):
+    """
+    Look up quotes for several symbols at once.
+
+    Cached quotes are returned immediately, the rest are fetched concurrently
+    by quote_pool. Returns a dict mapping each (capitalized) symbol to its
+    quote, or to None if the symbol is invalid or its quote didn't arrive
+    within timeout seconds (the last known quote if allow_stale is on).
+    """
+
+    agent = user_agent()
+    quotes = {}
+    pending = {}
+
+    for symbol in {symbol.upper() for symbol in symbols}:
+        quote = quote_cache.get(symbol)
+        if quote is not None:
+            quotes[symbol] = dict(quote)
         else:
-            return False
+            # (the miss is already counted by get())
+            future = quote_pool.submit(
+                _cached_quote, symbol, agent, allow_stale, counted=True
+            )
+            pending[future] = symbol
+
+    # Wait for all fetches to finish, but no longer than timeout in total
+    done, _ = wait(pending, timeout=timeout)
+    for future, symbol in pending.items():
+        if future in done and future.exception() is None:
+            quotes[symbol] = future.result()
+        elif allow_stale:
+            quotes[symbol] = _stale_quote(symbol)
+        else:
+            quotes[symbol] = None
 
-    # Check if current time is within regular trading hours
-    if nyse_open <= current_time < nyse_close:
-        return True
-    else:
-        return False
+    return quotes
 
 
-def lookup(symbol):
-    """Look up quote for symbol."""
+def _cached_quote(symbol, agent, allow_stale=False, counted=False):
+    # Don't wait for a refresh that's already running or for a provider that
+    # is failing when there's a last known quote to serve
+    if (
+        allow_stale
+        and (quote_cache.loading(symbol) or not provider.available())
+        and quote_cache.peek(symbol) is None
+    ):
+        stale = _stale_quote(symbol)
+        if stale is not None:
+            return stale
 
-    # Prepare API request
-    symbol = symbol.upper()
-    end = datetime.now(pytz.timezone("US/Eastern"))
-    start = end - timedelta(days=7)
-
-    # Yahoo Finance API
-    url = (
-        f"https://query1.finance.yahoo.com/v7/finance/download/{urllib.parse.quote_plus(symbol)}"
-        f"?period1={int(start.timestamp())}"
-        f"&period2={int(end.timestamp())}"
-        f"&interval=1d&events=history&includeAdjustedClose=true"
-    )
-
-    # Query API
+    # While the market is closed the last quote is served until the next open
+    # (counted is set when the caller already counted this cache lookup)
     try:
-        response = requests.get(
-            url,
-            cookies={"session": str(uuid.uuid4())},
-            headers={"Accept": "*/*", "User-Agent": request.headers.get("User-Agent")},
+        quote = quote_cache.get_or_load(
+            symbol,
+            lambda: fetch_quote(symbol, agent),
+            closed_market_ttl(),
+            count=not counted,
         )
-        response.raise_for_status()
+    except UpstreamError:
+        return _stale_quote(symbol) if allow_stale else None
+
+    # Hand out a copy so callers can't modify the cached quote
+    return dict(quote) if quote else None
 
-        # CSV header: Date,Open,High,Low,Close,Adj Close,Volume
-        quotes = list(csv.DictReader(response.content.decode("utf-8").splitlines()))
-        price = round(float(quotes[-1]["Adj Close"]), 2)
-        previous_close = round(float(quotes[-2]["Adj Close"]), 2)
 
-        return {"price": price, "previous_close": previous_close, "symbol": symbol}
-    except (KeyError, IndexError, requests.RequestException, ValueError):
+def _stale_quote(symbol):
+    # Last known quote of symbol marked as stale, or None
+    quote = last_quotes.get(symbol)
+    if not quote:
         return None
+    registry.inc("tradehub_stale_quotes_total")
+    return {**quote, "stale": True}
 
 
+def user_agent():
+    """Return User-Agent of the current request (if any) for upstream calls."""
+
+    if has_request_context():
+        return request.headers.get("User-Agent")
+    return None
+
+
+def fetch_quote(symbol, agent=None):
+    """Fetch quote for symbol from the market data provider, bypassing the cache."""
+
+    quote = provider.quote(symbol.upper(), agent)
+
+    if quote is None:
+        return None
+
+    # Previous close comes from the local price history when it has one
+    if price_history is not None:
+        previous_close = price_history.previous_close(symbol, market_date())
+        if previous_close is not None:
+            quote["previous_close"] = round(previous_close, 2)
+
+    last_quotes.set(quote["symbol"], quote)
+
+    # Let listeners (e.g. the order engine) see the new price
+    for listener in tick_listeners:
+        try:
+            listener(quote["symbol"], quote["price"])
+        except Exception as e:
+            log_event("tick_listener_failed", logging.ERROR, error=repr(e))
+    return quote
+
+
+def add_tick_listener(listener):
+    """Call listener(symbol, price) for every quote fetched from now on."""
+
+    tick_listeners.append(listener)
+
+
+def set_symbol_universe(index, strict=False):
+    """
+    Set the SymbolIndex used by valid_symbol.
+
+    If strict, symbols missing from the index are invalid. Otherwise they're
+    checked upstream once and the answer is remembered.
+    """
+
+    global symbol_universe, symbols_strict
+    symbol_universe = index
+    symbols_strict = strict
+
+
+def valid_symbol(symbol):
+    """
+    Check whether symbol exists, without network access for known symbols.
+
+    Only the provider's answer that a symbol is unknown is remembered. Raises
+    UpstreamError if the provider can't be asked right now (app.py answers it
+    with a 503), unless a quote of symbol was seen before.
+    """
+
+    symbol = symbol.upper()
+    if symbol_universe is not None:
+        if symbol in symbol_universe:
+            return True
+        if symbols_strict:
+            return False
+    if invalid_symbols.get(symbol):
+        return False
+
+    try:
+        quote = quote_cache.get_or_load(
+            symbol, lambda: fetch_quote(symbol, user_agent()), closed_market_ttl()
+        )
+    except UpstreamError:
+        if last_quotes.get(symbol):
+            return True
+        raise
+    if quote is None:
+        invalid_symbols.set(symbol, True)
+        return False
+    if symbol_universe is not None:
+        symbol_universe.add({"symbol": symbol, "name": get_symbol_name(symbol)})
+    return True
+
+
+def set_metadata_store(store):
+    """Set the MetadataStore that get_data and symbol_name read fundamentals from."""
+
+    global symbol_metadata
+    symbol_metadata = store
+
+
+def fundamentals(symbol):
+    """Return slow-moving details (name, market cap, P/E...) for symbol."""
+
+    if symbol_metadata is None:
+        return provider.fundamentals(symbol.upper())
+    return symbol_metadata.get(symbol)
+
+
+def get_symbol_name(symbol):
+    """Return company name for symbol."""
+
+    return fundamentals(symbol).get("longName", symbol.upper())
+
+
+def set_price_history(store):
+    """Set the PriceHistory used for daily closes (None to always fetch)."""
+
+    global price_history
+    price_history = store
+
+
+def daily_closes(symbol, start, end):
+    """Return {YYYY-MM-DD: close} of symbol from start to end (dates)."""
+
+    if price_history is not None:
+        return price_history.closes(symbol, start, end, market_date())
+    try:
+        bars = provider.history(symbol.upper(), start, end)
+    except UpstreamError:
+        return {}
+    return {bar["date"]: bar["close"] for bar in bars}
+
+
+def market_details(symbol):
+    """Fetch market details for symbol (cached until the next open when closed)."""
+
+    ttl = closed_market_ttl()
+    try:
+        if ttl is None:
+            return provider.market(symbol)
+        return market_cache.get_or_load(symbol, lambda: provider.market(symbol), ttl)
+    except UpstreamError:
+        # The page is still rendered from the quote and the stored details
+        return {}
+
+
+def set_provider(new_provider):
+    """Replace the market data provider used by lookup and get_data."""
+
+    global provider
+    provider = new_provider
+    quote_cache.clear()
+    market_cache.clear()
+
+
+@timed
 def get_data(symbol):
-    """Look up quote for symbol using yfinance."""
+    """Look up quote and market details for symbol."""
 
     # Capitalize symbol
     symbol = symbol.upper()
@@ -184,22 +436,34 @@ def get_data(symbol):
     # Fetch the real-time market data
     try:
         # Get the current price of the stock using lookup function
-        current_price = usd(lookup(symbol).get("price", 0))
-
-        # Create a Ticker object for the specified stock
-        stock = yf.Ticker(symbol)
-
-        # Get stock_info dictionary
-        stock_info = stock.info
+        quote = lookup(symbol)
+        if quote is None:
+            return None
+        current_price = usd(quote.get("price", 0))
+
+        # Get stock_info dictionary (yfinance Ticker.info keys): fundamentals
+        # come from the metadata store, only market details are fetched now
+        stock_info = {**fundamentals(symbol), **market_details(symbol)}
+
+        # Previous close and 52-week range from the local price history
+        if price_history is not None:
+            today = market_date()
+            previous_close = price_history.previous_close(symbol, today)
+            if previous_close is not None:
+                stock_info["previousClose"] = previous_close
+            high, low = price_history.year_range(symbol, today)
+            if high is not None:
+                stock_info["fiftyTwoWeekHigh"] = high
+                stock_info["fiftyTwoWeekLow"] = low
 
         # Get necessary market details data from stock_info dictionary
         previous_close = usd(round(stock_info.get("previousClose", 0), 2))
         open_price = usd(round(stock_info.get("open", 0), 2))
         day_high = usd(round(stock_info.get("dayHigh", 0), 2))
         day_low = usd(round(stock_info.get("dayLow", 0), 2))
-        bid_price = usd(round(stock_info.get("bid", 0), 2))
+        bid_price = usd(round(stock_info["bid"], 2)) if "bid" in stock_info else "-"
         bid_size = stock_info.get("bidSize", "N/A")
-        ask_price = usd(round(stock_info.get("ask", 0), 2))
+        ask_price = usd(round(stock_info["ask"], 2)) if "ask" in stock_info else "-"
         ask_size = stock_info.get("askSize", "N/A")
         volume = custom_humanize(stock_info.get("volume", 0))
         average_volume = custom_humanize(stock_info.get("averageVolume", 0))
@@ -282,6 +546,7 @@ def get_data(symbol):
             "price_diff": price_diff,
             "price_diff_color": price_diff_color,
             "percentage_change": percentage_change,
+            "stale": quote.get("stale", False),
         }
     except (KeyError, IndexError, ValueError):
         return None
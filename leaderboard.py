@@ -0,0 +1,283 @@
+import bisect
+import logging
+import threading
+import time
+
+from metrics import log_event
+
+# A tick re-sorts the rankings instead of moving holders one by one when more
+# than 1 / RESORT_FRACTION of all users hold the symbol
+RESORT_FRACTION = 16
+
+
+class Leaderboard:
+    """
+    Ranking of all users by total equity and by return, kept up to date
+    incrementally.
+
+    Each user's cash and holdings are kept in memory together with a
+    symbol -> holders reverse index. A trade re-reads just that user
+    (refresh_user), and a price tick revalues just the holders of that symbol.
+    Both rankings are sorted lists of (-value, user_id), so a user moves with
+    two binary searches, and top() and rank() don't touch the database.
+
+    Return is (equity - contributed) / contributed, where contributed (cash put
+    in, net of withdrawals) is cash + cost basis of holdings - realized P&L.
+
+    Equity, return and the last price of each symbol are saved to the
+    leaderboard tables by a background thread, which also picks up trades and
+    cash changes made by other worker processes.
+    """
+
+    def __init__(self, db):
+        self.db = db
+        self._users = {}  # user_id -> state dict (see _set_user)
+        self._holders = {}  # symbol -> set of user ids
+        self._prices = {}  # symbol -> last price
+        self._by_equity = []  # sorted (-equity, user_id)
+        self._by_return = []  # sorted (-return_pct, user_id)
+        self._dirty = set()
+        self._last_trade_id = 0
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._users)
+
+    def load(self):
+        """Build the leaderboard from users, positions and the saved prices."""
+
+        users = self.db.execute("SELECT id, username, cash FROM users")
+        positions = self.db.execute(
+            "SELECT user_id, symbol, quantity, cost_basis, realized_pnl FROM positions"
+        )
+        prices = self.db.execute("SELECT symbol, price FROM leaderboard_prices")
+        trades = self.db.execute("SELECT MAX(id) AS id FROM stocks")
+
+        by_user = {}
+        for row in positions:
+            by_user.setdefault(row["user_id"], []).append(row)
+
+        with self._lock:
+            self._prices = {row["symbol"]: row["price"] for row in prices}
+            for user in users:
+                self._set_user(user, by_user.get(user["id"], []))
+            self._last_trade_id = trades[0]["id"] or 0
+
+    def refresh_user(self, user_id):
+        """Re-read a user's cash and positions (after a trade or deposit)."""
+
+        users = self.db.execute(
+            "SELECT id, username, cash FROM users WHERE id = ?", user_id
+        )
+        positions = self.db.execute(
+            "SELECT user_id, symbol, quantity, cost_basis, realized_pnl FROM positions WHERE user_id = ?",
+            user_id,
+        )
+        if users:
+            with self._lock:
+                self._set_user(users[0], positions)
+
+    def on_tick(self, symbol, price):
+        """Revalue the holders of symbol at price."""
+
+        with self._lock:
+            if self._prices.get(symbol) == price:
+                return
+            self._prices[symbol] = price
+            holders = self._holders.get(symbol, ())
+
+            # Moving users one by one shifts the lists each time; when a big
+            # part of them moves, re-sorting both lists at once is cheaper
+            if len(holders) * RESORT_FRACTION <= len(self._users):
+                for user_id in holders:
+                    self._revalue(user_id)
+            else:
+                for user_id in holders:
+                    self._revalue(user_id, move=False)
+                self._by_equity = sorted(
+                    (-user["equity"], user_id) for user_id, user in self._users.items()
+                )
+                self._by_return = sorted(
+                    (-user["return_pct"], user_id)
+                    for user_id, user in self._users.items()
+                )
+
+    def top(self, limit=50, by="equity"):
+        """Return the first limit users as dicts with their rank."""
+
+        with self._lock:
+            ranking = self._by_equity if by == "equity" else self._by_return
+            return [
+                self._entry(user_id, rank)
+                for rank, (_, user_id) in enumerate(ranking[:limit], 1)
+            ]
+
+    def rank(self, user_id, by="equity"):
+        """Return user's entry with its rank, or None for unknown users."""
+
+        with self._lock:
+            user = self._users.get(user_id)
+            if user is None:
+                return None
+            if by == "equity":
+                rank = bisect.bisect_left(self._by_equity, (-user["equity"], user_id))
+            else:
+                rank = bisect.bisect_left(
+                    self._by_return, (-user["return_pct"], user_id)
+                )
+            return self._entry(user_id, rank + 1)
+
+    def sync(self):
+        """
+        Pick up trades and cash changes made by other processes, then save
+        changed rows and prices.
+        """
+
+        # Users that traded since the last sync (in any process)
+        trades = self.db.execute("SELECT MAX(id) AS id FROM stocks")
+        last_trade_id = trades[0]["id"] or 0
+        for row in self.db.execute(
+            "SELECT DISTINCT user_id FROM stocks WHERE id > ? AND id <= ?",
+            self._last_trade_id,
+            last_trade_id,
+        ):
+            self.refresh_user(row["user_id"])
+        self._last_trade_id = last_trade_id
+
+        # Deposits and withdrawals
+        for row in self.db.execute("SELECT id, cash FROM users"):
+            user = self._users.get(row["id"])
+            if user is None or user["cash"] != row["cash"]:
+                self.refresh_user(row["id"])
+
+        self.save()
+
+    def save(self):
+        """Write changed users and the latest prices to the database."""
+
+        with self._lock:
+            rows = []
+            for user_id in self._dirty:
+                user = self._users.get(user_id)
+                if user is not None:
+                    rows.append((user_id, user["equity"], user["return_pct"]))
+            prices = list(self._prices.items())
+            self._dirty = set()
+
+        now = time.time()
+        self.db.execute("BEGIN TRANSACTION")
+        try:
+            for user_id, equity, return_pct in rows:
+                self.db.execute(
+                    "INSERT INTO leaderboard (user_id, equity, return_pct, updated_at) VALUES (?, ?, ?, ?) "
+                    "ON CONFLICT (user_id) DO UPDATE SET equity = excluded.equity, "
+                    "return_pct = excluded.return_pct, updated_at = excluded.updated_at",
+                    user_id,
+                    equity,
+                    return_pct,
+                    now,
+                )
+            for symbol, price in prices:
+                self.db.execute(
+                    "INSERT INTO leaderboard_prices (symbol, price) VALUES (?, ?) "
+                    "ON CONFLICT (symbol) DO UPDATE SET price = excluded.price",
+                    symbol,
+                    price,
+                )
+        except Exception:
+            self.db.execute("ROLLBACK")
+            raise
+        self.db.execute("COMMIT")
+
+    def start(self, interval):
+        """Run sync() every interval seconds in a daemon thread."""
+
+        def run():
+            while True:
+                time.sleep(interval)
+                try:
+                    self.sync()
+                except Exception as e:
+                    log_event("leaderboard_sync_failed", logging.ERROR, error=repr(e))
+
+        threading.Thread(target=run, name="leaderboard", daemon=True).start()
+
+    def _set_user(self, user, positions):
+        # Caller holds the lock. Replace a user's state and re-rank them
+        user_id = user["id"]
+        old = self._users.get(user_id)
+        if old is not None:
+            for symbol in old["holdings"]:
+                self._holders[symbol].discard(user_id)
+
+        holdings = {}
+        cost_basis = 0
+        realized = 0
+        for row in positions:
+            cost_basis += row["cost_basis"]
+            realized += row["realized_pnl"]
+            if row["quantity"] > 0:
+                holdings[row["symbol"]] = row["quantity"]
+                self._holders.setdefault(row["symbol"], set()).add(user_id)
+
+                # Without a price yet, value the position at its average cost
+                self._prices.setdefault(
+                    row["symbol"], row["cost_basis"] / row["quantity"]
+                )
+
+        self._users[user_id] = {
+            "username": user["username"],
+            "cash": user["cash"],
+            "holdings": holdings,
+            "contributed": user["cash"] + cost_basis - realized,
+            "equity": old["equity"] if old else 0,
+            "return_pct": old["return_pct"] if old else 0,
+        }
+        if old is None:
+            bisect.insort(self._by_equity, (0, user_id))
+            bisect.insort(self._by_return, (0, user_id))
+        self._revalue(user_id)
+
+    def _revalue(self, user_id, move=True):
+        # Caller holds the lock. Recompute equity and return and move the user
+        # in both rankings (unless the caller re-sorts them)
+        user = self._users[user_id]
+        equity = user["cash"] + sum(
+            quantity * self._prices[symbol]
+            for symbol, quantity in user["holdings"].items()
+        )
+        equity = round(equity, 2)
+        contributed = user["contributed"]
+        if contributed > 0:
+            return_pct = round((equity - contributed) / contributed * 100, 2)
+        else:
+            return_pct = 0
+
+        if move:
+            _move(self._by_equity, (-user["equity"], user_id), (-equity, user_id))
+            _move(
+                self._by_return, (-user["return_pct"], user_id), (-return_pct, user_id)
+            )
+        user["equity"] = equity
+        user["return_pct"] = return_pct
+        self._dirty.add(user_id)
+
+    def _entry(self, user_id, rank):
+        user = self._users[user_id]
+        return {
+            "rank": rank,
+            "user_id": user_id,
+            "username": user["username"],
+            "equity": user["equity"],
+            "return_pct": user["return_pct"],
+        }
+
+
+def _move(ranking, old, new):
+    # Replace old with new in a sorted list
+    if old == new:
+        return
+    index = bisect.bisect_left(ranking, old)
+    if index < len(ranking) and ranking[index] == old:
+        del ranking[index]
+    bisect.insort(ranking, new)
@@ -0,0 +1,108 @@
+from positions import apply_trade, carried_position
+from trading import run_transaction
+
+
+def compact_ledger(db, before, user_id=None):
+    """
+    Move trades made before a date (YYYY-MM-DD) into stocks_archive.
+
+    Each user's archived trades are replaced by one carry-forward row per
+    symbol (carry_forward = 1) that holds the position they add up to: amount
+    is the quantity, price the average cost and realized_pnl the P&L booked so
+    far, so positions, P&L and the portfolio still add up from the stocks
+    table alone. A carry-forward row takes the id and date_time of the last
+    archived trade of its symbol, so it sorts before the user's later trades.
+    Carry-forward rows from earlier compactions are folded into new ones.
+
+    Only a prefix of each user's ledger (by id) is archived, so trades are
+    never replayed out of order. Every user is compacted in a transaction of
+    its own. Returns (trades archived, carry-forward rows written).
+    """
+
+    query = "SELECT DISTINCT user_id FROM stocks WHERE date_time < ? AND carry_forward = 0"
+    args = [before]
+    if user_id is not None:
+        query += " AND user_id = ?"
+        args.append(user_id)
+
+    archived = carried = 0
+    for row in db.execute(query, *args):
+        counts = run_transaction(
+            db, lambda: _compact_user(db, row["user_id"], before)
+        )
+        archived += counts[0]
+        carried += counts[1]
+    return archived, carried
+
+
+def _compact_user(db, user_id, before):
+    # Archive the user's trades up to the first one made on or after before
+    rows = db.execute(
+        "SELECT MIN(id) AS id FROM stocks WHERE user_id = ? AND date_time >= ?",
+        user_id,
+        before,
+    )
+    boundary = rows[0]["id"]
+    query = (
+        "SELECT id, symbol, symbol_name, price, amount, date_time, carry_forward, "
+        "realized_pnl FROM stocks WHERE user_id = ?"
+    )
+    args = [user_id]
+    if boundary is not None:
+        query += " AND id < ?"
+        args.append(boundary)
+    rows = db.execute(query + " ORDER BY id", *args)
+    if all(row["carry_forward"] for row in rows):
+        return 0, 0
+
+    # Replay them into {symbol: (last row, [quantity, cost_basis, realized_pnl])}
+    positions = {}
+    for row in rows:
+        if row["carry_forward"]:
+            position = carried_position(row)
+        else:
+            position = positions.get(row["symbol"], (None, [0, 0, 0]))[1]
+            apply_trade(position, row["price"], row["amount"])
+        positions[row["symbol"]] = (row, position)
+
+    last_id = rows[-1]["id"]
+    db.execute(
+        "INSERT INTO stocks_archive (id, symbol, symbol_name, price, amount, date_time, user_id) "
+        "SELECT id, symbol, symbol_name, price, amount, date_time, user_id FROM stocks "
+        "WHERE user_id = ? AND id <= ? AND carry_forward = 0",
+        user_id,
+        last_id,
+    )
+    archived = db.execute(
+        "DELETE FROM stocks WHERE user_id = ? AND id <= ? AND carry_forward = 0",
+        user_id,
+        last_id,
+    )
+    db.execute(
+        "DELETE FROM stocks WHERE user_id = ? AND id <= ? AND carry_forward = 1",
+        user_id,
+        last_id,
+    )
+    # The saved P&L ledger no longer matches (see pnl.load_ledger)
+    db.execute("DELETE FROM ledger_columns WHERE user_id = ?", user_id)
+
+    # Closed positions without realized P&L need no row
+    carried = 0
+    for symbol, (row, (quantity, cost_basis, realized_pnl)) in positions.items():
+        if not quantity and not realized_pnl:
+            continue
+        db.execute(
+            "INSERT INTO stocks (id, symbol, symbol_name, price, amount, date_time, user_id, carry_forward, realized_pnl) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?, 1, ?)",
+            row["id"],
+            symbol,
+            row["symbol_name"],
+            cost_basis / quantity if quantity else 0,
+            quantity,
+            row["date_time"],
+            user_id,
+            realized_pnl,
+        )
+        carried += 1
+    return archived, carried
+
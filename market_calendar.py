@@ -0,0 +1,199 @@
+import bisect
+import calendar
+import time
+from datetime import date, datetime, timedelta
+
+import pytz
+
+# Regular NYSE session and early close (Eastern Time)
+OPEN = (9, 30)
+CLOSE = (16, 0)
+EARLY_CLOSE = (13, 0)
+
+# Unscheduled closures (national days of mourning, 9/11, Hurricane Sandy)
+SPECIAL_CLOSURES = {
+    date(2001, 9, 11),
+    date(2001, 9, 12),
+    date(2001, 9, 13),
+    date(2001, 9, 14),
+    date(2004, 6, 11),
+    date(2007, 1, 2),
+    date(2012, 10, 29),
+    date(2012, 10, 30),
+    date(2018, 12, 5),
+    date(2025, 1, 9),
+}
+
+
+class MarketCalendar:
+    """
+    NYSE trading sessions precomputed for first_year..last_year.
+
+    Sessions are kept in a dict by date (O(1) session lookups) and in sorted
+    arrays of open and close times in epoch seconds, so is_open, next_open
+    and next_close are binary searches with no time zone math per call.
+    """
+
+    def __init__(self, first_year=2000, last_year=2050):
+        self.timezone = pytz.timezone("US/Eastern")
+        self._sessions = {}  # date -> (open, close) in epoch seconds
+        for year in range(first_year, last_year + 1):
+            closed = nyse_holidays(year) | SPECIAL_CLOSURES
+            early = nyse_early_closes(year)
+            day = date(year, 1, 1)
+            offset = None
+            while day.year == year:
+                # DST starts and ends on Sundays, so the UTC offset only needs
+                # looking up once per week
+                if offset is None or day.weekday() == 0:
+                    offset = self._utc_offset(day)
+                if day.weekday() < 5 and day not in closed:
+                    close = EARLY_CLOSE if day in early else CLOSE
+                    self._sessions[day] = (
+                        _timestamp(day, OPEN, offset),
+                        _timestamp(day, close, offset),
+                    )
+                day += timedelta(days=1)
+        self._opens = [session[0] for session in self._sessions.values()]
+        self._closes = [session[1] for session in self._sessions.values()]
+
+    def session(self, day):
+        """Return (open, close) datetimes of the session on day or None."""
+
+        session = self._sessions.get(day)
+        if session is None:
+            return None
+        return self._datetime(session[0]), self._datetime(session[1])
+
+    def is_open(self, now=None):
+        """Return whether the market is open at now (epoch seconds)."""
+
+        now = time.time() if now is None else now
+        index = bisect.bisect_right(self._closes, now)
+        return index < len(self._opens) and self._opens[index] <= now
+
+    def next_open(self, now=None):
+        """Return start of the first session opening after now, or None."""
+
+        now = time.time() if now is None else now
+        index = bisect.bisect_right(self._opens, now)
+        if index == len(self._opens):
+            return None
+        return self._datetime(self._opens[index])
+
+    def next_close(self, now=None):
+        """Return end of the current or next session after now, or None."""
+
+        now = time.time() if now is None else now
+        index = bisect.bisect_right(self._closes, now)
+        if index == len(self._closes):
+            return None
+        return self._datetime(self._closes[index])
+
+    def last_close(self, now=None):
+        """Return end of the last session that closed at or before now, or None."""
+
+        now = time.time() if now is None else now
+        index = bisect.bisect_right(self._closes, now)
+        if index == 0:
+            return None
+        return self._datetime(self._closes[index - 1])
+
+    def seconds_until_open(self, now=None):
+        """Return 0 while the market is open, else seconds until it opens."""
+
+        now = time.time() if now is None else now
+        if self.is_open(now):
+            return 0
+        index = bisect.bisect_right(self._opens, now)
+        if index == len(self._opens):
+            return 0
+        return self._opens[index] - now
+
+    def _utc_offset(self, day):
+        # UTC offset of Eastern Time at noon on day, in seconds
+        noon = datetime(day.year, day.month, day.day, 12)
+        return self.timezone.utcoffset(noon).total_seconds()
+
+    def _datetime(self, timestamp):
+        return datetime.fromtimestamp(timestamp, self.timezone)
+
+
+def nyse_holidays(year):
+    """Return the set of NYSE full-day holidays in year (as observed)."""
+
+    holidays = {
+        _nth_weekday(year, 1, 0, 3),  # Martin Luther King Jr. Day
+        _nth_weekday(year, 2, 0, 3),  # Washington's Birthday
+        _easter(year) - timedelta(days=2),  # Good Friday
+        _last_weekday(year, 5, 0),  # Memorial Day
+        _observed(date(year, 7, 4)),  # Independence Day
+        _nth_weekday(year, 9, 0, 1),  # Labor Day
+        _nth_weekday(year, 11, 3, 4),  # Thanksgiving
+        _observed(date(year, 12, 25)),  # Christmas
+    }
+
+    # New Year's Day moves to Monday, but isn't moved back to a Friday
+    new_year = date(year, 1, 1)
+    if new_year.weekday() == 6:
+        holidays.add(new_year + timedelta(days=1))
+    elif new_year.weekday() < 5:
+        holidays.add(new_year)
+
+    if year >= 2022:
+        holidays.add(_observed(date(year, 6, 19)))  # Juneteenth
+    return holidays
+
+
+def nyse_early_closes(year):
+    """Return the set of days in year on which the NYSE closes at 1:00 PM."""
+
+    early = {_nth_weekday(year, 11, 3, 4) + timedelta(days=1)}  # Black Friday
+    for day in (date(year, 7, 3), date(year, 12, 24)):
+        # Eves of Independence Day and Christmas, when they're trading days
+        if day.weekday() < 4:
+            early.add(day)
+    return early
+
+
+def _timestamp(day, hour_minute, offset):
+    # Epoch seconds of hour_minute local time on day at the given UTC offset
+    hour, minute = hour_minute
+    midnight = calendar.timegm((day.year, day.month, day.day, 0, 0, 0))
+    return midnight + hour * 3600 + minute * 60 - offset
+
+
+def _observed(day):
+    # Saturday holidays are observed on Friday, Sunday ones on Monday
+    if day.weekday() == 5:
+        return day - timedelta(days=1)
+    if day.weekday() == 6:
+        return day + timedelta(days=1)
+    return day
+
+
+def _nth_weekday(year, month, weekday, n):
+    # n-th given weekday (0 = Monday) of month
+    first = date(year, month, 1)
+    return first + timedelta(days=(weekday - first.weekday()) % 7 + 7 * (n - 1))
+
+
+def _last_weekday(year, month, weekday):
+    # Last given weekday of month
+    last = date(year + month // 12, month % 12 + 1, 1) - timedelta(days=1)
+    return last - timedelta(days=(last.weekday() - weekday) % 7)
+
+
+def _easter(year):
+    # Western Easter Sunday (anonymous Gregorian algorithm)
+    a = year % 19
+    b, c = divmod(year, 100)
+    d, e = divmod(b, 4)
+    f = (b + 8) // 25
+    g = (b - f + 1) // 3
+    h = (19 * a + b - d - g + 15) % 30
+    i, k = divmod(c, 4)
+    l = (32 + 2 * e + 2 * i - h - k) % 7
+    m = (a + 11 * h + 22 * l) // 451
+    month, day = divmod(h + l - 7 * m + 114, 31)
+    return date(year, month, day + 1)
@@ -0,0 +1,376 @@
+import bisect
+import csv
+import json
+import os
+import re
+import threading
+import time
+import urllib
+import uuid
+from datetime import date, datetime, timedelta
+
+import pytz
+import yfinance as yf
+
+from upstream import UpstreamClient, UpstreamError
+
+# Ticker.info keys that change at most daily (see MarketDataProvider.fundamentals)
+FUNDAMENTAL_KEYS = (
+    "longName",
+    "currency",
+    "marketCap",
+    "trailingPE",
+    "forwardPE",
+    "fiftyTwoWeekHigh",
+    "fiftyTwoWeekLow",
+    "dividendYield",
+    "yield",
+    "averageVolume",
+)
+
+# Ticker.info keys of the best bid and ask (see YahooProvider.market)
+BID_ASK_KEYS = ("bid", "bidSize", "ask", "askSize")
+
+
+class MarketDataProvider:
+    """Backend that supplies quotes and market details to helpers.py."""
+
+    # Whether prices only move while the exchange is open (so quotes can be
+    # cached until the next open while it's closed)
+    follows_market_hours = False
+
+    def quote(self, symbol, agent=None):
+        """
+        Return {"price", "previous_close", "symbol"} for symbol.
+
+        Returns None if the symbol is unknown. Raises UpstreamError if the
+        backend can't be reached in time. agent is the User-Agent to send
+        upstream (if the backend uses HTTP).
+        """
+        raise NotImplementedError
+
+    def market(self, symbol):
+        """
+        Return fast-moving market details for symbol as Ticker.info keys.
+
+        E.g. previousClose, open, dayHigh, dayLow, bid, ask and volume.
+        """
+        raise NotImplementedError
+
+    def fundamentals(self, symbol):
+        """Return slow-moving details for symbol (the FUNDAMENTAL_KEYS fields)."""
+        raise NotImplementedError
+
+    def history(self, symbol, start, end):
+        """
+        Return daily bars of symbol from start to end (dates, inclusive).
+
+        Bars are {"date", "open", "high", "low", "close", "volume"} dicts in
+        date order, with "date" as YYYY-MM-DD. Missing days are just absent.
+        """
+        raise NotImplementedError
+
+    def available(self):
+        """Return whether the backend is currently taking calls."""
+        return True
+
+
+# Host of the CSV quote API, and the name yfinance calls are tracked under by
+# the upstream client (yfinance talks to several Yahoo hosts)
+QUOTE_HOST = "query1.finance.yahoo.com"
+YFINANCE_HOST = "yfinance"
+
+
+class YahooProvider(MarketDataProvider):
+    """
+    Live data from Yahoo Finance (CSV download API and yfinance).
+
+    All calls go through an UpstreamClient, so they share pooled connections
+    and have deadlines, retries and circuit breakers.
+    """
+
+    follows_market_hours = True
+
+    def __init__(self, client=None):
+        self.client = client or UpstreamClient()
+
+    def available(self):
+        return self.client.available(QUOTE_HOST)
+
+    def quote(self, symbol, agent=None):
+        # Prepare API request
+        symbol = symbol.upper()
+        end = datetime.now(pytz.timezone("US/Eastern"))
+        start = end - timedelta(days=7)
+
+        # Yahoo Finance API
+        url = (
+            f"https://{QUOTE_HOST}/v7/finance/download/{urllib.parse.quote_plus(symbol)}"
+            f"?period1={int(start.timestamp())}"
+            f"&period2={int(end.timestamp())}"
+            f"&interval=1d&events=history&includeAdjustedClose=true"
+        )
+
+        # Query API (UpstreamError is passed on to the caller)
+        response = self.client.get(
+            url,
+            operation="quote",
+            cookies={"session": str(uuid.uuid4())},
+            headers={"Accept": "*/*", "User-Agent": agent},
+        )
+        # Unknown symbols are 404s; other errors say nothing about the symbol
+        if response.status_code == 404:
+            return None
+        if not response.ok:
+            raise UpstreamError(f"{QUOTE_HOST} answered {response.status_code}")
+        try:
+            # CSV header: Date,Open,High,Low,Close,Adj Close,Volume
+            quotes = list(csv.DictReader(response.content.decode("utf-8").splitlines()))
+            price = round(float(quotes[-1]["Adj Close"]), 2)
+            previous_close = round(float(quotes[-2]["Adj Close"]), 2)
+
+            return {"price": price, "previous_close": previous_close, "symbol": symbol}
+        except (KeyError, IndexError, ValueError):
+            return None
+
+    def market(self, symbol):
+        # fast_info is derived from recent price history, which is much quicker
+        # than Ticker.info; it has no bid/ask though, so they're read from a
+        # Ticker.info call of their own (only the fundamentals are cached)
+        def fetch():
+            fast_info = self._ticker(symbol).fast_info
+            return {
+                "previousClose": fast_info.previous_close,
+                "open": fast_info.open,
+                "dayHigh": fast_info.day_high,
+                "dayLow": fast_info.day_low,
+                "volume": fast_info.last_volume,
+            }
+
+        market = self.client.call(YFINANCE_HOST, fetch, operation="market")
+        try:
+            info = self.client.call(
+                YFINANCE_HOST, lambda: self._ticker(symbol).info, operation="bid_ask"
+            )
+        except UpstreamError:
+            # Show the rest of the market details without bid/ask
+            return market
+        market.update(
+            {key: info[key] for key in BID_ASK_KEYS if info.get(key) is not None}
+        )
+        return market
+
+    def fundamentals(self, symbol):
+        info = self.client.call(
+            YFINANCE_HOST, lambda: self._ticker(symbol).info, operation="fundamentals"
+        )
+        return {key: info[key] for key in FUNDAMENTAL_KEYS if key in info}
+
+    def history(self, symbol, start, end):
+        frame = self.client.call(
+            YFINANCE_HOST,
+            lambda: self._ticker(symbol).history(
+                start=start.isoformat(),
+                end=(end + timedelta(days=1)).isoformat(),
+                interval="1d",
+                auto_adjust=False,
+            ),
+            operation="history",
+        )
+        return [
+            {
+                "date": index.date().isoformat(),
+                "open": round(float(row["Open"]), 4),
+                "high": round(float(row["High"]), 4),
+                "low": round(float(row["Low"]), 4),
+                "close": round(float(row["Close"]), 4),
+                "volume": int(row["Volume"]),
+            }
+            for index, row in frame.iterrows()
+        ]
+
+    def _ticker(self, symbol):
+        # yfinance Ticker using the client's pooled session
+        return yf.Ticker(symbol.upper(), session=self.client.session)
+
+
+# Monday that tape history counts weekdays from
+TAPE_EPOCH = date(1970, 1, 5)
+SECONDS_PER_DAY = 86400
+
+
+class TapeReplayProvider(MarketDataProvider):
+    """
+    Replay recorded quote tapes from local files instead of calling Yahoo.
+
+    A tape is <SYMBOL>.jsonl (one JSON tick per line) or <SYMBOL>.csv (one tick
+    per row, with a header) in directory. Every tick has a "time" in seconds
+    and a "price"; any other field is a Ticker.info key such as "bid" or
+    "volume". Ticks only need to carry the fields that changed.
+
+    The tape plays back at speed times real time from when the provider was
+    created and starts over after the last tick, so a given moment always
+    replays the same data and no network access is needed. Daily history
+    is made of the tape's days (one bar per 24 hours of ticks), taken in
+    turn by the weekdays of the calendar.
+    """
+
+    def __init__(self, directory, speed=1):
+        self.directory = directory
+        self.speed = speed
+        self.started = time.monotonic()
+        self._tapes = {}
+        self._lock = threading.Lock()
+
+    def quote(self, symbol, agent=None):
+        tick = self._tick(symbol)
+        if tick is None:
+            return None
+        return {
+            "price": round(tick["price"], 2),
+            "previous_close": round(tick["previousClose"], 2),
+            "symbol": symbol.upper(),
+        }
+
+    def market(self, symbol):
+        tick = self._tick(symbol) or {}
+        return {key: tick[key] for key in tick if key not in FUNDAMENTAL_KEYS}
+
+    def fundamentals(self, symbol):
+        tick = self._tick(symbol) or {}
+        return {key: tick[key] for key in FUNDAMENTAL_KEYS if key in tick}
+
+    def history(self, symbol, start, end):
+        tape = self._tape(symbol.upper())
+        if tape is None:
+            return []
+        bars = tape[2]
+
+        history = []
+        day = start
+        while day <= end:
+            if day.weekday() < 5:
+                # Count weekdays from a fixed Monday, so a date always gets the
+                # same bar
+                weekdays = (day - TAPE_EPOCH).days // 7 * 5 + day.weekday()
+                history.append(
+                    {"date": day.isoformat(), **bars[weekdays % len(bars)]}
+                )
+            day += timedelta(days=1)
+        return history
+
+    def _tick(self, symbol):
+        # Return the tape's state at the current replay time
+        tape = self._tape(symbol.upper())
+        if tape is None:
+            return None
+        times, ticks, _ = tape
+
+        elapsed = (time.monotonic() - self.started) * self.speed
+        if times[-1] > 0:
+            elapsed %= times[-1]
+        return ticks[bisect.bisect_right(times, elapsed) - 1]
+
+    def _tape(self, symbol):
+        with self._lock:
+            if symbol not in self._tapes:
+                self._tapes[symbol] = self._load(symbol)
+            return self._tapes[symbol]
+
+    def _load(self, symbol):
+        # Read a tape into (times, ticks, bars) with times starting at 0, each
+        # tick holding every field seen so far and a daily bar per tape day
+        if not re.fullmatch(r"[A-Z0-9.^=-]+", symbol):
+            return None
+
+        rows = None
+        path = os.path.join(self.directory, symbol)
+        if os.path.isfile(path + ".jsonl"):
+            with open(path + ".jsonl") as file:
+                rows = [json.loads(line) for line in file if line.strip()]
+        elif os.path.isfile(path + ".csv"):
+            with open(path + ".csv", newline="") as file:
+                rows = [
+                    {key: _number(value) for key, value in row.items() if value != ""}
+                    for row in csv.DictReader(file)
+                ]
+        if not rows:
+            return None
+
+        rows.sort(key=lambda row: float(row["time"]))
+        first = float(rows[0]["time"])
+        times = []
+        ticks = []
+        state = {"previousClose": rows[0]["price"], "currency": "USD"}
+        for row in rows:
+            state = {**state, **row}
+            state.pop("time")
+            times.append(float(row["time"]) - first)
+            ticks.append(state)
+        return times, ticks, _daily_bars(times, ticks)
+
+
+def create_provider(name, tapes="tapes", speed=1, client=None):
+    """Return market data provider by name ("yahoo" or "tape")."""
+
+    if name == "yahoo":
+        return YahooProvider(client)
+    elif name == "tape":
+        return TapeReplayProvider(tapes, speed)
+    raise ValueError(f"unknown market data provider: {name}")
+
+
+def record_tape(provider, symbol, path, ticks, interval):
+    """Append ticks polled from provider every interval seconds to a JSONL tape."""
+
+    started = time.monotonic()
+    last = {}
+    with open(path, "a") as file:
+        for _ in range(ticks):
+            quote = provider.quote(symbol)
+            if quote is not None:
+                state = {
+                    **provider.fundamentals(symbol),
+                    **provider.market(symbol),
+                    "price": quote["price"],
+                }
+
+                # Only write the fields that changed since the previous tick
+                tick = {
+                    key: value
+                    for key, value in state.items()
+                    if key not in last or last[key] != value
+                }
+                tick["time"] = round(time.monotonic() - started, 3)
+                file.write(json.dumps(tick) + "\n")
+                file.flush()
+                last = state
+            time.sleep(interval)
+
+
+def _daily_bars(times, ticks):
+    # OHLCV bar of every 24 hours of ticks (volume is the day's last, as tapes
+    # record the day's running total)
+    bars = {}
+    for tick_time, tick in zip(times, ticks):
+        price = tick["price"]
+        bar = bars.setdefault(
+            int(tick_time // SECONDS_PER_DAY),
+            {"open": price, "high": price, "low": price},
+        )
+        bar["high"] = max(bar["high"], price)
+        bar["low"] = min(bar["low"], price)
+        bar["close"] = price
+        bar["volume"] = int(tick.get("volume", 0))
+    return [
+        {key: round(value, 4) for key, value in bar.items()}
+        for _, bar in sorted(bars.items())
+    ]
+
+
+def _number(value):
+    # CSV values are strings: convert numeric ones
+    try:
+        return float(value)
+    except ValueError:
+        return value
@@ -0,0 +1,78 @@
+import json
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from cache import TTLCache
+
+
+class MetadataStore:
+    """
+    Slow-moving symbol fundamentals (name, market cap, P/E, 52-week range...).
+
+    Reads go through three tiers: an in-memory cache, the symbol_metadata
+    table and finally fetch(symbol). Rows older than ttl seconds are still
+    served, while a background thread refreshes them, so only the very first
+    request for a symbol waits for the upstream call.
+    """
+
+    def __init__(self, db, fetch, ttl=86400):
+        self.db = db
+        self.fetch = fetch
+        self.ttl = ttl
+        self.cache = TTLCache(maxsize=1024, ttl=300)
+        self._refreshing = set()
+        self._lock = threading.Lock()
+        self._pool = ThreadPoolExecutor(max_workers=2, thread_name_prefix="metadata")
+
+    def get(self, symbol):
+        """Return fundamentals for symbol as a dict of Ticker.info keys."""
+
+        symbol = symbol.upper()
+        return self.cache.get_or_load(symbol, lambda: self._load(symbol)) or {}
+
+    def refresh(self, symbol):
+        """Fetch fundamentals for symbol and store them; returns them or None."""
+
+        try:
+            data = self.fetch(symbol)
+        except Exception:
+            data = None
+        if not data:
+            return None
+
+        self.db.execute(
+            "INSERT INTO symbol_metadata (symbol, data, updated_at) VALUES (?, ?, ?) "
+            "ON CONFLICT (symbol) DO UPDATE SET data = excluded.data, updated_at = excluded.updated_at",
+            symbol,
+            json.dumps(data),
+            time.time(),
+        )
+        self.cache.set(symbol, data)
+        return data
+
+    def _load(self, symbol):
+        rows = self.db.execute(
+            "SELECT data, updated_at FROM symbol_metadata WHERE symbol = ?", symbol
+        )
+        if not rows:
+            return self.refresh(symbol)
+
+        # Serve stale rows right away and refresh them in the background
+        if time.time() - rows[0]["updated_at"] > self.ttl:
+            self._refresh_later(symbol)
+        return json.loads(rows[0]["data"])
+
+    def _refresh_later(self, symbol):
+        with self._lock:
+            if symbol in self._refreshing:
+                return
+            self._refreshing.add(symbol)
+        self._pool.submit(self._background_refresh, symbol)
+
+    def _background_refresh(self, symbol):
+        try:
+            self.refresh(symbol)
+        finally:
+            with self._lock:
+                self._refreshing.discard(symbol)
@@ -0,0 +1,259 @@
+import bisect
+import functools
+import json
+import logging
+import random
+import re
+import threading
+import time
+import weakref
+
+# Histogram bucket upper bounds in seconds
+BUCKETS = (
+    0.0005,
+    0.001,
+    0.0025,
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1,
+    2.5,
+    5,
+    10,
+)
+
+# Help text of each metric (metrics without one are still exported)
+HELP = {
+    "tradehub_request_duration_seconds": "Time to handle a request, by route.",
+    "tradehub_sql_duration_seconds": "Time to run a SQL statement, by shape.",
+    "tradehub_upstream_duration_seconds": "Time of upstream calls including retries.",
+    "tradehub_function_duration_seconds": "Time spent in hot helper functions.",
+    "tradehub_cache_hits_total": "Cache lookups served from memory.",
+    "tradehub_cache_misses_total": "Cache lookups that had to load the value.",
+    "tradehub_stale_quotes_total": "Last known quotes served while upstream failed.",
+}
+
+logger = logging.getLogger("tradehub")
+
+# Fraction of sampled events that log_sampled writes (set by app.py)
+log_sample_rate = 0.01
+
+
+class Registry:
+    """
+    Counters and latency histograms, exported in Prometheus text format.
+
+    Every thread writes to its own shard (a plain dict only it modifies), so
+    recording a value takes no lock. When a thread finishes, its shard is
+    folded into a shared total, so counts never go backwards and short-lived
+    threads (one per request on the dev server) don't pile up shards.
+    render() sums the total and the shards of the live threads.
+    """
+
+    def __init__(self, buckets=BUCKETS):
+        self.buckets = buckets
+        self._shards = []
+        self._total = {"counters": {}, "histograms": {}}  # of finished threads
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._caches = {}  # name -> TTLCache
+
+    def observe(self, name, seconds, **labels):
+        """Add seconds to histogram name."""
+
+        key = (name, tuple(sorted(labels.items())))
+        shard = self._shard()
+        series = shard["histograms"].get(key)
+        if series is None:
+            # Counts per bucket (the last one is +Inf), then the sum
+            series = [0] * (len(self.buckets) + 1) + [0.0]
+            shard["histograms"][key] = series
+        series[bisect.bisect_left(self.buckets, seconds)] += 1
+        series[-1] += seconds
+
+    def inc(self, name, amount=1, **labels):
+        """Add amount to counter name."""
+
+        key = (name, tuple(sorted(labels.items())))
+        counters = self._shard()["counters"]
+        counters[key] = counters.get(key, 0) + amount
+
+    def timer(self, name, **labels):
+        """Return a context manager that observes its duration into name."""
+
+        return _Timer(self, name, labels)
+
+    def register_cache(self, name, cache):
+        """Export hit and miss counts of a TTLCache under cache=name."""
+
+        self._caches[name] = cache
+
+    def render(self):
+        """Return all metrics in Prometheus text exposition format."""
+
+        counters = {}
+        histograms = {}
+        with self._lock:
+            _merge(counters, histograms, self._total)
+            shards = list(self._shards)
+        for shard in shards:
+            _merge(counters, histograms, shard)
+
+        for name, cache in self._caches.items():
+            counters[("tradehub_cache_hits_total", (("cache", name),))] = cache.hits
+            counters[("tradehub_cache_misses_total", (("cache", name),))] = (
+                cache.misses
+            )
+
+        lines = []
+        for name in sorted({key[0] for key in counters}):
+            _header(lines, name, "counter")
+            for key in sorted(key for key in counters if key[0] == name):
+                lines.append(f"{name}{_labels(key[1])} {counters[key]}")
+
+        for name in sorted({key[0] for key in histograms}):
+            _header(lines, name, "histogram")
+            for key in sorted(key for key in histograms if key[0] == name):
+                series = histograms[key]
+                cumulative = 0
+                for bound, count in zip(self.buckets + ("+Inf",), series[:-1]):
+                    cumulative += count
+                    le = _labels(key[1] + (("le", str(bound)),))
+                    lines.append(f"{name}_bucket{le} {cumulative}")
+                lines.append(f"{name}_sum{_labels(key[1])} {series[-1]:.6f}")
+                lines.append(f"{name}_count{_labels(key[1])} {cumulative}")
+        return "\n".join(lines) + "\n"
+
+    def _shard(self):
+        holder = getattr(self._local, "holder", None)
+        if holder is None:
+            holder = self._local.holder = _Holder()
+            with self._lock:
+                self._shards.append(holder.shard)
+            # The thread-local holder is dropped when the thread ends
+            weakref.finalize(holder, self._fold, holder.shard)
+        return holder.shard
+
+    def _fold(self, shard):
+        # Move a finished thread's shard into the total
+        with self._lock:
+            _merge(self._total["counters"], self._total["histograms"], shard)
+            self._shards.remove(shard)
+
+
+class _Holder:
+    # Thread-local owner of a shard (plain dicts can't be weakly referenced)
+    def __init__(self):
+        self.shard = {"counters": {}, "histograms": {}}
+
+
+class _Timer:
+    def __init__(self, registry, name, labels):
+        self.registry = registry
+        self.name = name
+        self.labels = labels
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        elapsed = time.perf_counter() - self.started
+        self.registry.observe(self.name, elapsed, **self.labels)
+
+
+# Registry of this process, shared by all modules
+registry = Registry()
+
+
+@functools.lru_cache(maxsize=2048)
+def statement_shape(sql):
+    """
+    Return sql with literals replaced by ? and placeholder lists collapsed,
+    so each statement in the code maps to one short histogram label.
+    """
+
+    shape = re.sub(r"'(?:[^']|'')*'", "?", sql)
+    shape = re.sub(r"\b\d+(?:\.\d+)?\b", "?", shape)
+    shape = re.sub(r"\?(?:\s*,\s*\?)+", "?, ...", shape)
+    shape = " ".join(shape.split())
+    return shape if len(shape) <= 120 else shape[:117] + "..."
+
+
+def timed(function):
+    """Decorate function to record its duration under function=its name."""
+
+    @functools.wraps(function)
+    def wrapper(*args, **kwargs):
+        started = time.perf_counter()
+        try:
+            return function(*args, **kwargs)
+        finally:
+            registry.observe(
+                "tradehub_function_duration_seconds",
+                time.perf_counter() - started,
+                function=function.__name__,
+            )
+
+    return wrapper
+
+
+def observe_query(sql, seconds):
+    """Record the duration of a SQL statement."""
+
+    registry.observe(
+        "tradehub_sql_duration_seconds", seconds, statement=statement_shape(sql)
+    )
+
+
+def set_log_sample_rate(rate):
+    """Set the fraction of events log_sampled writes (0 disables them)."""
+
+    global log_sample_rate
+    log_sample_rate = rate
+
+
+def log_sampled(event, **fields):
+    """Log event with fields as one JSON line for a sample of the calls."""
+
+    if log_sample_rate and random.random() < log_sample_rate:
+        log_event(event, sample_rate=log_sample_rate, **fields)
+
+
+def log_event(event, level=logging.INFO, **fields):
+    """Log event with fields as one JSON line."""
+
+    if logger.isEnabledFor(level):
+        logger.log(level, json.dumps({"event": event, **fields}, default=str))
+
+
+def _merge(counters, histograms, shard):
+    # Add a shard's counters and histogram series into counters and histograms
+    for key, value in list(shard["counters"].items()):
+        counters[key] = counters.get(key, 0) + value
+    for key, series in list(shard["histograms"].items()):
+        total = histograms.setdefault(key, [0] * len(series[:-1]) + [0.0])
+        for index, value in enumerate(series):
+            total[index] += value
+
+
+def _header(lines, name, kind):
+    if name in HELP:
+        lines.append(f"# HELP {name} {HELP[name]}")
+    lines.append(f"# TYPE {name} {kind}")
+
+
+def _labels(pairs):
+    if not pairs:
+        return ""
+    # Label values escape backslashes, double quotes and newlines
+    escaped = []
+    for key, value in pairs:
+        value = str(value).replace("\\", "\\\\").replace('"', '\\"')
+        value = value.replace("\n", "\\n")
+        escaped.append(f'{key}="{value}"')
+    return "{" + ",".join(escaped) + "}"
@@ -0,0 +1,271 @@
+import heapq
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from metrics import log_event
+from trading import (
+    TradeError,
+    execute_buy,
+    execute_sell,
+    run_transaction,
+    sql_now,
+)
+
+SIDES = ("buy", "sell")
+ORDER_TYPES = ("limit", "stop")
+
+# Columns of an order as loaded by the engine
+COLUMNS = "id, user_id, symbol, symbol_name, side, order_type, trigger_price, shares"
+
+
+class OrderBook:
+    """
+    Open orders of one symbol, keyed by trigger price.
+
+    Buy limits and sell stops trigger when the price falls to their trigger
+    price, so they sit in a max-heap; sell limits and buy stops trigger when
+    it rises to it and sit in a min-heap. A tick pops just the orders it
+    crosses, in O(log n) each. Cancelled orders are dropped lazily when they
+    reach the top of a heap.
+    """
+
+    def __init__(self):
+        self._falling = []  # (-trigger_price, id)
+        self._rising = []  # (trigger_price, id)
+
+    def __len__(self):
+        return len(self._falling) + len(self._rising)
+
+    def push(self, order):
+        if triggers_on_fall(order):
+            heapq.heappush(self._falling, (-order["trigger_price"], order["id"]))
+        else:
+            heapq.heappush(self._rising, (order["trigger_price"], order["id"]))
+
+    def pop_crossed(self, price, live):
+        """Pop and return ids of orders triggered at price that are in live."""
+
+        crossed = []
+        while self._falling and -self._falling[0][0] >= price:
+            order_id = heapq.heappop(self._falling)[1]
+            if order_id in live:
+                crossed.append(order_id)
+        while self._rising and self._rising[0][0] <= price:
+            order_id = heapq.heappop(self._rising)[1]
+            if order_id in live:
+                crossed.append(order_id)
+        return crossed
+
+
+class OrderEngine:
+    """
+    Trigger engine for resting limit and stop orders.
+
+    Open orders are kept in one OrderBook per symbol. on_tick(symbol, price)
+    is called for every fresh quote (see helpers.add_tick_listener); triggered
+    orders are handed to fill(order, price) on a single worker thread, so the
+    thread that fetched the quote isn't held up by database writes.
+
+    Orders placed by other worker processes are picked up by sync(), which
+    on_tick runs at most every sync_interval seconds. Several processes may
+    trigger the same order, but fill_order() claims it first, so it fills once.
+    """
+
+    def __init__(self, db, fill=None, sync_interval=1):
+        self.db = db
+        self.fill = fill or (lambda order, price: fill_order(db, order, price))
+        self.sync_interval = sync_interval
+        self._books = {}  # symbol -> OrderBook
+        self._orders = {}  # id -> order
+        self._last_id = 0
+        self._synced_at = 0
+        self._lock = threading.Lock()
+        self._filler = ThreadPoolExecutor(max_workers=1, thread_name_prefix="orders")
+
+    def __len__(self):
+        return len(self._orders)
+
+    def sync(self):
+        """Load open orders placed since the last sync."""
+
+        rows = self.db.execute(
+            f"SELECT {COLUMNS} FROM orders WHERE id > ? AND status = 'open' ORDER BY id",
+            self._last_id,
+        )
+        with self._lock:
+            for row in rows:
+                self._add(dict(row))
+                self._last_id = row["id"]
+            self._synced_at = time.monotonic()
+
+    def add(self, order):
+        """Start watching an order placed by this process."""
+
+        with self._lock:
+            self._add(order)
+
+    def discard(self, order_id):
+        """Stop watching an order (e.g. after it was cancelled)."""
+
+        with self._lock:
+            self._orders.pop(order_id, None)
+
+    def symbols(self):
+        """Return symbols that have open orders."""
+
+        with self._lock:
+            return sorted({order["symbol"] for order in self._orders.values()})
+
+    def on_tick(self, symbol, price):
+        """Trigger orders of symbol crossed by price; returns the triggered orders."""
+
+        if time.monotonic() - self._synced_at >= self.sync_interval:
+            self.sync()
+
+        with self._lock:
+            book = self._books.get(symbol)
+            if book is None:
+                return []
+            triggered = [
+                self._orders.pop(order_id)
+                for order_id in book.pop_crossed(price, self._orders)
+            ]
+            if not book:
+                del self._books[symbol]
+
+        if triggered:
+            self._filler.submit(self._fill_all, triggered, price)
+        return triggered
+
+    def shutdown(self):
+        """Wait for triggered orders that are still being filled."""
+
+        self._filler.shutdown(wait=True)
+
+    def start(self, poll, interval):
+        """
+        Call poll(symbols) with the symbols that have open orders every
+        interval seconds in a daemon thread, so that they get quotes (and
+        ticks) even when nobody is looking at them.
+        """
+
+        def run():
+            while True:
+                time.sleep(interval)
+                symbols = self.symbols()
+                if symbols:
+                    try:
+                        poll(symbols)
+                    except Exception as e:
+                        log_event("order_poll_failed", logging.ERROR, error=repr(e))
+
+        threading.Thread(target=run, name="order-poller", daemon=True).start()
+
+    def _fill_all(self, triggered, price):
+        for order in triggered:
+            try:
+                self.fill(order, price)
+            except TradeError:
+                pass
+            except Exception as e:
+                # Still open in the database (e.g. it was locked), so watch it
+                # again; the next tick that crosses it retries the fill
+                log_event(
+                    "order_fill_failed", logging.ERROR, order=order["id"], error=repr(e)
+                )
+                self.add(order)
+
+    def _add(self, order):
+        # Caller holds the lock
+        if order["id"] in self._orders:
+            return
+        self._orders[order["id"]] = order
+        self._books.setdefault(order["symbol"], OrderBook()).push(order)
+
+
+def triggers_on_fall(order):
+    """Return whether order triggers when the price falls to its trigger price."""
+
+    # Buy limits and sell stops
+    return (order["side"] == "buy") == (order["order_type"] == "limit")
+
+
+def place_order(db, user_id, symbol, symbol_name, side, order_type, price, shares):
+    """Store a new open order and return it (as loaded by the engine)."""
+
+    order_id = db.execute(
+        "INSERT INTO orders (user_id, symbol, symbol_name, side, order_type, trigger_price, shares, status, created_at) "
+        "VALUES (?, ?, ?, ?, ?, ?, ?, 'open', ?)",
+        user_id,
+        symbol,
+        symbol_name,
+        side,
+        order_type,
+        price,
+        shares,
+        sql_now(),
+    )
+    return {
+        "id": order_id,
+        "user_id": user_id,
+        "symbol": symbol,
+        "symbol_name": symbol_name,
+        "side": side,
+        "order_type": order_type,
+        "trigger_price": price,
+        "shares": shares,
+    }
+
+
+def cancel_order(db, user_id, order_id):
+    """Cancel user's open order; returns whether it was still open."""
+
+    return bool(
+        db.execute(
+            "UPDATE orders SET status = 'cancelled' WHERE id = ? AND user_id = ? AND status = 'open'",
+            order_id,
+            user_id,
+        )
+    )
+
+
+def fill_order(db, order, price):
+    """
+    Execute a triggered order at price in one transaction.
+
+    The order is claimed (open -> filled) in the same transaction as the cash
+    and position updates. If it's no longer open nothing happens; if the user
+    lacks cash or shares the order is rejected. Returns whether it was filled.
+    """
+
+    def operation():
+        if not db.execute(
+            "UPDATE orders SET status = 'filled', fill_price = ?, filled_at = ? WHERE id = ? AND status = 'open'",
+            price,
+            sql_now(),
+            order["id"],
+        ):
+            return False
+
+        execute = execute_buy if order["side"] == "buy" else execute_sell
+        execute(
+            db,
+            order["user_id"],
+            order["symbol"],
+            order["symbol_name"],
+            price,
+            order["shares"],
+        )
+        return True
+
+    try:
+        return run_transaction(db, operation)
+    except TradeError as e:
+        db.execute(
+            "UPDATE orders SET status = 'rejected', reason = ? WHERE id = ? AND status = 'open'",
+            str(e),
+            order["id"],
+        )
+        return False
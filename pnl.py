@@ -0,0 +1,448 @@
+import json
+
+import numpy as np
+
+from cache import TTLCache
+
+SECONDS_PER_DAY = 86400
+
+# Ledgers loaded by load_ledger, by user_id. Entries are checked against the
+# stocks table on every call, so they only expire to free memory (app.py sets
+# the size and TTL from LEDGER_CACHE_SIZE and LEDGER_CACHE_TTL)
+ledger_cache = TTLCache(maxsize=128, ttl=86400)
+
+# A ledger is saved to ledger_columns once this many of its rows aren't there
+STORE_ROWS = 10000
+
+
+def load_ledger(db, user_id):
+    """
+    Load a user's stocks ledger into NumPy arrays, in insertion order.
+
+    A carry-forward row of compacted trades (see ledger_archive.py) loads as a
+    single buy of the shares still held at their average cost; ones that only
+    carry realized P&L are left out.
+
+    Loaded ledgers are cached in memory and long ones are also saved as
+    columns of raw arrays in the ledger_columns table, since reading a million
+    rows through sqlite3 takes seconds. The ledger only grows by appended
+    trades, so later calls read just the rows added since; if rows were
+    removed (by compaction) the whole ledger is read again.
+
+    Returns a dict with symbols (the sorted array of distinct tickers), codes
+    (indexes into symbols for every row), prices, amounts, times (seconds
+    since the epoch) and carried ({symbol: realized P&L of compacted trades}).
+    """
+
+    # (Two queries: MAX(id) alone is a single index lookup)
+    count = db.tuples("SELECT COUNT(*) FROM stocks WHERE user_id = ?", user_id)[0][0]
+    last_id = db.tuples("SELECT MAX(id) FROM stocks WHERE user_id = ?", user_id)[0][0]
+    last_id = last_id or 0
+    ledger = ledger_cache.get(user_id)
+    if ledger is None or ledger["count"] > count:
+        ledger = _stored_ledger(db, user_id)
+    if ledger is None or ledger["count"] > count:
+        ledger = _empty_ledger()
+
+    if ledger["count"] != count or ledger["last_id"] != last_id:
+        rows = _ledger_rows(db, user_id, ledger["last_id"])
+        if ledger["count"] + len(rows) != count:
+            # Earlier rows were replaced: start over
+            ledger = _empty_ledger()
+            rows = _ledger_rows(db, user_id, 0)
+        ledger = _append_rows(ledger, rows)
+    if ledger["carried"] is None:
+        ledger["carried"] = _carried(db, user_id)
+    if ledger["count"] - ledger["stored"] >= STORE_ROWS:
+        _store_ledger(db, user_id, ledger)
+    ledger_cache.set(user_id, ledger)
+    return ledger
+
+
+def fifo_lots(codes, prices, amounts, times):
+    """
+    Match sells against buys first-in first-out, for all symbols at once.
+
+    Every buy is a tax lot. For each symbol, the shares bought are laid out one
+    after another on an axis in purchase order, and each sell consumes the next
+    stretch of it, so the cost of any sell is a difference of the cumulative
+    cost function at both ends of its stretch (found with searchsorted). No
+    Python loop runs over the rows.
+
+    Returns (lots, sales), two dicts of arrays:
+      lots: index (ledger row), quantity (still held), price, cost_basis
+      sales: index, quantity, price, cost_basis, realized, holding_days
+        (holding_days is the quantity-weighted age of the shares sold)
+    """
+
+    # Stable sort by symbol keeps rows of each symbol in ledger order (codes
+    # as the smallest integer type that holds them, which NumPy radix sorts)
+    count = int(codes.max()) + 1 if len(codes) else 0
+    order = np.argsort(codes.astype(np.min_scalar_type(count)), kind="stable")
+    codes, prices, amounts, times = (
+        codes[order],
+        prices[order],
+        amounts[order],
+        times[order],
+    )
+
+    buys = amounts > 0
+    buy_codes, buy_quantity = codes[buys], amounts[buys]
+    buy_prices, buy_times = prices[buys], times[buys]
+    sells = ~buys
+    sell_codes, sell_quantity = codes[sells], -amounts[sells]
+
+    # Cumulative share axis and the offset where each symbol's lots start
+    bought = np.bincount(buy_codes, weights=buy_quantity, minlength=count)
+    start = np.concatenate(([0.0], np.cumsum(bought)[:-1]))
+    axis = np.cumsum(buy_quantity)
+    cost = np.cumsum(buy_quantity * buy_prices)
+    age = np.cumsum(buy_quantity * buy_times)
+
+    # Each sell covers [sold before, sold after) within its symbol; shares sold
+    # beyond what was bought (a broken ledger) aren't matched to any lot
+    sold = np.bincount(sell_codes, weights=sell_quantity, minlength=count)
+    sold_after = np.cumsum(sell_quantity) - np.concatenate(
+        ([0.0], np.cumsum(sold)[:-1])
+    )[sell_codes]
+    sold_before = sold_after - sell_quantity
+    limit = bought[sell_codes]
+    end = start[sell_codes] + np.minimum(sold_after, limit)
+    begin = start[sell_codes] + np.minimum(sold_before, limit)
+    matched = end - begin
+
+    ends, begins = _segments(axis, end), _segments(axis, begin)
+    sale_cost = _interpolate(axis, cost, buy_prices, ends, end) - _interpolate(
+        axis, cost, buy_prices, begins, begin
+    )
+    sale_age = _interpolate(axis, age, buy_times, ends, end) - _interpolate(
+        axis, age, buy_times, begins, begin
+    )
+    sell_prices, sell_times = prices[sells], times[sells]
+    with np.errstate(invalid="ignore", divide="ignore"):
+        holding = np.where(
+            matched > 0,
+            (matched * sell_times - sale_age) / matched / SECONDS_PER_DAY,
+            np.nan,
+        )
+
+    # Shares of each lot not yet consumed by sells
+    consumed = start + np.minimum(sold, bought)
+    remaining = np.clip(axis - consumed[buy_codes], 0, buy_quantity)
+
+    lots = {
+        "index": order[buys],
+        "quantity": remaining,
+        "price": buy_prices,
+        "cost_basis": remaining * buy_prices,
+    }
+    sales = {
+        "index": order[sells],
+        "quantity": sell_quantity,
+        "price": sell_prices,
+        "cost_basis": sale_cost,
+        "realized": matched * sell_prices - sale_cost,
+        "holding_days": holding,
+    }
+    return lots, sales
+
+
+def portfolio_pnl(db, user_id, quotes, now=None, details=False):
+    """
+    Return FIFO P&L of a user's portfolio as a JSON-ready dict.
+
+    quotes maps symbols to lookup() results (or None if unavailable, in which
+    case market values and unrealized P&L of that symbol are None). now is a
+    datetime64 or epoch seconds for holding periods (default current time).
+    Open lots and sales are only listed with details, since long ledgers have
+    hundreds of thousands of them.
+    """
+
+    ledger = load_ledger(db, user_id)
+    symbols, codes, prices, times = (
+        ledger["symbols"],
+        ledger["codes"],
+        ledger["prices"],
+        ledger["times"],
+    )
+    # Lots only change with the ledger, so they're cached along with it
+    if "fifo" not in ledger:
+        ledger["fifo"] = fifo_lots(codes, prices, ledger["amounts"], times)
+    lots, sales = ledger["fifo"]
+    if now is None:
+        now = np.datetime64("now", "s")
+    now = np.datetime64(now, "s").astype(np.float64)
+
+    current = np.array(
+        [
+            quotes[symbol]["price"] if quotes.get(symbol) else np.nan
+            for symbol in symbols
+        ],
+        dtype=np.float64,
+    )
+
+    # Open lots valued at current prices
+    open_lots = lots["quantity"] > 0
+    lot_rows = lots["index"][open_lots]
+    lot_codes = codes[lot_rows]
+    quantity = lots["quantity"][open_lots]
+    cost_basis = lots["cost_basis"][open_lots]
+    market_value = quantity * current[lot_codes]
+    unrealized = market_value - cost_basis
+
+    # Totals per symbol
+    count = len(symbols)
+    held = np.bincount(lot_codes, weights=quantity, minlength=count)
+    held_cost = np.bincount(lot_codes, weights=cost_basis, minlength=count)
+    held_value = np.where(held > 0, held * current, 0)
+    held_gain = held_value - held_cost
+    # (bincount returns integers when there are no sales at all)
+    realized = np.bincount(
+        codes[sales["index"]], weights=sales["realized"], minlength=count
+    ).astype(np.float64)
+
+    # P&L realized by compacted trades, as booked at average cost
+    carried = ledger["carried"]
+    realized += np.array([carried.get(symbol, 0) for symbol in symbols], dtype=float)
+    closed = sum(value for symbol, value in carried.items() if symbol not in symbols)
+
+    result = {
+        "method": "fifo",
+        "realized": _round(realized.sum() + closed),
+        "unrealized": _round(np.nansum(held_gain)),
+        "symbols": _records(
+            symbol=symbols.tolist(),
+            quantity=held.astype(np.int64).tolist(),
+            cost_basis=_column(held_cost),
+            price=_column(current),
+            market_value=_column(held_value),
+            realized=_column(realized),
+            unrealized=_column(held_gain),
+            return_pct=_percent_column(held_gain, held_cost),
+        ),
+    }
+    if not details:
+        return result
+
+    result["lots"] = _records(
+        symbol=symbols[lot_codes].tolist(),
+        date_time=_date_time_column(times[lot_rows]),
+        quantity=quantity.astype(np.int64).tolist(),
+        price=_column(prices[lot_rows]),
+        cost_basis=_column(cost_basis),
+        market_value=_column(market_value),
+        unrealized=_column(unrealized),
+        return_pct=_percent_column(unrealized, cost_basis),
+        holding_days=_column((now - times[lot_rows]) / SECONDS_PER_DAY),
+    )
+    sale_rows = sales["index"]
+    result["sales"] = _records(
+        symbol=symbols[codes[sale_rows]].tolist(),
+        date_time=_date_time_column(times[sale_rows]),
+        quantity=sales["quantity"].astype(np.int64).tolist(),
+        price=_column(sales["price"]),
+        cost_basis=_column(sales["cost_basis"]),
+        realized=_column(sales["realized"]),
+        return_pct=_percent_column(sales["realized"], sales["cost_basis"]),
+        holding_days=_column(sales["holding_days"]),
+    )
+    return result
+
+
+def average_cost_pnl(db, user_id, quotes):
+    """
+    Return average-cost P&L per symbol from the positions table.
+
+    Positions are kept up to date with the average cost method on every trade
+    (see positions.apply_trade), so no ledger replay is needed.
+    """
+
+    rows = db.execute(
+        "SELECT symbol, quantity, cost_basis, realized_pnl FROM positions WHERE user_id = ? ORDER BY symbol",
+        user_id,
+    )
+
+    result = {"method": "average", "realized": 0, "unrealized": 0, "symbols": []}
+    for row in rows:
+        quote = quotes.get(row["symbol"])
+        market_value = row["quantity"] * quote["price"] if quote else None
+        unrealized = (
+            market_value - row["cost_basis"] if market_value is not None else None
+        )
+        result["realized"] += row["realized_pnl"]
+        result["unrealized"] += unrealized or 0
+        result["symbols"].append(
+            {
+                "symbol": row["symbol"],
+                "quantity": row["quantity"],
+                "cost_basis": _round(row["cost_basis"]),
+                "price": quote["price"] if quote else None,
+                "market_value": _round(market_value),
+                "realized": _round(row["realized_pnl"]),
+                "unrealized": _round(unrealized),
+                "return_pct": _percent(unrealized, row["cost_basis"]),
+            }
+        )
+    result["realized"] = _round(result["realized"])
+    result["unrealized"] = _round(result["unrealized"])
+    return result
+
+
+def _ledger_rows(db, user_id, after_id):
+    # Plain tuples (building sqlite3.Row objects takes several times longer);
+    # dates are parsed by NumPy in bulk, much faster than strftime() per row
+    return db.tuples(
+        "SELECT symbol, price, amount, date_time, id FROM stocks "
+        "WHERE user_id = ? AND id > ? ORDER BY id",
+        user_id,
+        after_id,
+    )
+
+
+def _carried(db, user_id):
+    # {symbol: realized P&L} of the user's carry-forward rows
+    rows = db.tuples(
+        "SELECT symbol, realized_pnl FROM stocks WHERE user_id = ? AND carry_forward = 1",
+        user_id,
+    )
+    return dict(rows)
+
+
+def _empty_ledger():
+    empty = np.zeros(0)
+    return {
+        "count": 0,
+        "last_id": 0,
+        "stored": 0,
+        "symbols": np.array([], dtype=str),
+        "codes": np.zeros(0, dtype=np.intp),
+        "prices": empty,
+        "amounts": empty,
+        "times": empty,
+        "carried": None,
+    }
+
+
+def _append_rows(ledger, rows):
+    # New ledger dict with rows (from _ledger_rows) added at the end
+    if not rows:
+        return ledger
+    trades = [row for row in rows if row[2]]
+    names = [row[0] for row in trades]
+    prices = np.array([row[1] for row in trades], dtype=np.float64)
+    amounts = np.array([row[2] for row in trades], dtype=np.float64)
+    times = np.array([row[3] for row in trades], dtype="datetime64[s]")
+
+    # Codes of the cached rows are remapped when new symbols show up
+    symbols = sorted(set(ledger["symbols"].tolist()).union(names))
+    index = {symbol: code for code, symbol in enumerate(symbols)}
+    codes = np.fromiter(map(index.__getitem__, names), np.intp, len(names))
+    remap = np.array(
+        [index[symbol] for symbol in ledger["symbols"].tolist()], dtype=np.intp
+    )
+    return {
+        "count": ledger["count"] + len(rows),
+        "last_id": rows[-1][4],
+        "stored": ledger["stored"],
+        "symbols": np.array(symbols, dtype=str),
+        "codes": np.concatenate((remap[ledger["codes"]], codes)),
+        "prices": np.concatenate((ledger["prices"], prices)),
+        "amounts": np.concatenate((ledger["amounts"], amounts)),
+        "times": np.concatenate((ledger["times"], times.astype(np.float64))),
+        "carried": ledger["carried"],
+    }
+
+
+def _stored_ledger(db, user_id):
+    # Ledger dict saved by _store_ledger, or None
+    rows = db.execute("SELECT * FROM ledger_columns WHERE user_id = ?", user_id)
+    if not rows:
+        return None
+    row = rows[0]
+    return {
+        "count": row["row_count"],
+        "last_id": row["last_id"],
+        "stored": row["row_count"],
+        "symbols": np.array(json.loads(row["symbols"]), dtype=str),
+        "codes": np.frombuffer(row["codes"], dtype=np.int32).astype(np.intp),
+        "prices": np.frombuffer(row["prices"], dtype=np.float64),
+        "amounts": np.frombuffer(row["amounts"], dtype=np.float64),
+        "times": np.frombuffer(row["times"], dtype=np.float64),
+        "carried": json.loads(row["carried"]),
+    }
+
+
+def _store_ledger(db, user_id, ledger):
+    # Save ledger's arrays (replacing any saved copy)
+    db.execute(
+        "INSERT INTO ledger_columns (user_id, row_count, last_id, symbols, codes, prices, amounts, times, carried) "
+        "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?) ON CONFLICT (user_id) DO UPDATE SET "
+        "row_count = excluded.row_count, last_id = excluded.last_id, symbols = excluded.symbols, "
+        "codes = excluded.codes, prices = excluded.prices, amounts = excluded.amounts, "
+        "times = excluded.times, carried = excluded.carried",
+        user_id,
+        ledger["count"],
+        ledger["last_id"],
+        json.dumps(ledger["symbols"].tolist()),
+        ledger["codes"].astype(np.int32).tobytes(),
+        ledger["prices"].tobytes(),
+        ledger["amounts"].tobytes(),
+        ledger["times"].tobytes(),
+        json.dumps(ledger["carried"]),
+    )
+    ledger["stored"] = ledger["count"]
+
+
+def _segments(axis, x):
+    # Index of the segment of the cumulative axis that each position x is on
+    return np.minimum(np.searchsorted(axis, x), len(axis) - 1)
+
+
+def _interpolate(axis, cumulative, rate, k, x):
+    # Value of the piecewise linear function with breakpoints (axis, cumulative)
+    # and slope rate[k] on segment k at positions x (k from _segments)
+    if not len(axis):
+        return np.zeros(len(x))
+    return cumulative[k] - (axis[k] - x) * rate[k]
+
+
+def _round(value, digits=2):
+    # JSON-friendly number: None for missing (NaN) values
+    if value is None or np.isnan(value):
+        return None
+    # (+ 0.0 turns -0.0 into 0.0)
+    return round(float(value), digits) + 0.0
+
+
+def _percent(gain, cost):
+    if gain is None or not cost or np.isnan(gain):
+        return None
+    return round(float(gain / cost * 100), 2) + 0.0
+
+
+def _column(values, digits=2):
+    # _round for a whole array, as a list
+    values = np.round(np.asarray(values, dtype=np.float64), digits) + 0.0
+    column = values.astype(object)
+    column[np.isnan(values)] = None
+    return column.tolist()
+
+
+def _percent_column(gain, cost):
+    # _percent for whole arrays, as a list
+    with np.errstate(invalid="ignore", divide="ignore"):
+        return _column(np.where(cost != 0, gain / cost * 100, np.nan))
+
+
+def _date_time_column(seconds):
+    # (np.char.replace fails on empty arrays)
+    if not len(seconds):
+        return []
+    stamps = np.datetime_as_string(seconds.astype("datetime64[s]"))
+    return np.char.replace(stamps, "T", " ").tolist()
+
+
+def _records(**columns):
+    # Lists of values per key -> list of dicts
+    keys = list(columns)
+    return [dict(zip(keys, values)) for values in zip(*columns.values())]
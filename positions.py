@@ -0,0 +1,176 @@
+def record_trade(db, user_id, symbol, symbol_name, price, amount, date_time):
+    """
+    Insert a trade into the stocks ledger and update the user's position.
+
+    amount is negative for sells. Call inside a transaction so that the ledger
+    row and the position change are committed together.
+    """
+
+    db.execute(
+        "INSERT INTO stocks (symbol, symbol_name, price, amount, date_time, user_id) VALUES (?, ?, ?, ?, ?, ?)",
+        symbol,
+        symbol_name,
+        price,
+        amount,
+        date_time,
+        user_id,
+    )
+
+    rows = db.execute(
+        "SELECT quantity, cost_basis, realized_pnl FROM positions WHERE user_id = ? AND symbol = ?",
+        user_id,
+        symbol,
+    )
+    if rows:
+        position = [rows[0]["quantity"], rows[0]["cost_basis"], rows[0]["realized_pnl"]]
+    else:
+        position = [0, 0, 0]
+
+    apply_trade(position, price, amount)
+    _save_position(db, user_id, symbol, symbol_name, position)
+
+
+def apply_trade(position, price, amount):
+    """
+    Apply a trade to a [quantity, cost_basis, realized_pnl] position in place.
+
+    Cost basis uses the average cost method: a sale removes shares at the
+    position's average price and books the difference as realized P&L.
+    """
+
+    quantity, cost_basis, realized_pnl = position
+
+    if amount > 0:
+        quantity += amount
+        cost_basis += amount * price
+    else:
+        average_price = cost_basis / quantity if quantity > 0 else price
+        cost_basis += amount * average_price
+        realized_pnl += -amount * (price - average_price)
+        quantity += amount
+
+    # Avoid leftover rounding errors on closed positions
+    if quantity == 0:
+        cost_basis = 0
+
+    position[:] = [quantity, round(cost_basis, 6), round(realized_pnl, 6)]
+
+
+def carried_position(row):
+    """
+    Return the [quantity, cost_basis, realized_pnl] position a carry-forward
+    row of the ledger stands for (see ledger_archive.py).
+    """
+
+    quantity = row["amount"]
+    return [quantity, round(quantity * row["price"], 6), row["realized_pnl"]]
+
+
+def rebuild_positions(db, user_id=None):
+    """
+    Rebuild positions from the stocks ledger (for one user or all users).
+
+    Returns number of positions written.
+    """
+
+    positions = _replay_ledger(db, user_id)
+
+    db.execute("BEGIN TRANSACTION")
+    try:
+        if user_id is None:
+            db.execute("DELETE FROM positions")
+        else:
+            db.execute("DELETE FROM positions WHERE user_id = ?", user_id)
+
+        for (user, symbol), (symbol_name, position) in positions.items():
+            _save_position(db, user, symbol, symbol_name, position)
+    except Exception:
+        db.execute("ROLLBACK")
+        raise
+    db.execute("COMMIT")
+
+    return len(positions)
+
+
+def check_positions(db, user_id=None):
+    """
+    Compare positions with the stocks ledger.
+
+    Returns a list of (user_id, symbol, expected, actual) tuples, one per
+    position that doesn't match, where expected/actual are
+    (quantity, cost_basis, realized_pnl) tuples (None if the row is missing).
+    """
+
+    expected = {
+        key: tuple(position) for key, (_, position) in _replay_ledger(db, user_id).items()
+    }
+
+    if user_id is None:
+        rows = db.execute(
+            "SELECT user_id, symbol, quantity, cost_basis, realized_pnl FROM positions"
+        )
+    else:
+        rows = db.execute(
+            "SELECT user_id, symbol, quantity, cost_basis, realized_pnl FROM positions WHERE user_id = ?",
+            user_id,
+        )
+    actual = {
+        (row["user_id"], row["symbol"]): (
+            row["quantity"],
+            row["cost_basis"],
+            row["realized_pnl"],
+        )
+        for row in rows
+    }
+
+    mismatches = []
+    for key in sorted(expected.keys() | actual.keys()):
+        if not _same_position(expected.get(key), actual.get(key)):
+            mismatches.append((*key, expected.get(key), actual.get(key)))
+    return mismatches
+
+
+def _replay_ledger(db, user_id=None):
+    # Replay ledger in insertion order into {(user_id, symbol): (symbol_name, position)}
+    if user_id is None:
+        rows = db.execute(
+            "SELECT user_id, symbol, symbol_name, price, amount, carry_forward, realized_pnl FROM stocks ORDER BY id"
+        )
+    else:
+        rows = db.execute(
+            "SELECT user_id, symbol, symbol_name, price, amount, carry_forward, realized_pnl FROM stocks WHERE user_id = ? ORDER BY id",
+            user_id,
+        )
+
+    positions = {}
+    for row in rows:
+        key = (row["user_id"], row["symbol"])
+        if row["carry_forward"]:
+            # Compacted trades start the position (see ledger_archive.py)
+            positions[key] = (row["symbol_name"], carried_position(row))
+            continue
+        if key not in positions:
+            positions[key] = (row["symbol_name"], [0, 0, 0])
+        apply_trade(positions[key][1], row["price"], row["amount"])
+    return positions
+
+
+def _save_position(db, user_id, symbol, symbol_name, position):
+    db.execute(
+        "INSERT INTO positions (user_id, symbol, symbol_name, quantity, cost_basis, realized_pnl) VALUES (?, ?, ?, ?, ?, ?) "
+        "ON CONFLICT (user_id, symbol) DO UPDATE SET symbol_name = excluded.symbol_name, quantity = excluded.quantity, "
+        "cost_basis = excluded.cost_basis, realized_pnl = excluded.realized_pnl",
+        user_id,
+        symbol,
+        symbol_name,
+        *position,
+    )
+
+
+def _same_position(expected, actual):
+    if expected is None or actual is None:
+        # A missing row is fine for an empty position
+        return (expected or (0, 0, 0)) == (actual or (0, 0, 0))
+    return expected[0] == actual[0] and all(
+        abs(a - b) < 0.01 for a, b in zip(expected[1:], actual[1:])
+    )
@@ -0,0 +1,131 @@
+import threading
+from datetime import date, timedelta
+
+from upstream import UpstreamError
+
+
+class PriceHistory:
+    """
+    Daily OHLCV bars kept in the price_history table.
+
+    The days already fetched for a symbol are one contiguous range stored in
+    price_history_ranges, so a request only fetches the days before or after
+    it (holidays inside the range aren't asked for again). Only completed days
+    are stored; the current day is left to live quotes. Reads are indexed
+    range scans on the (symbol, date) primary key.
+    """
+
+    def __init__(self, db, fetch):
+        self.db = db
+        self.fetch = fetch  # fetch(symbol, start, end) -> bars (see market_data.py)
+        self._locks = {}  # symbol -> lock held while filling its gaps
+        self._lock = threading.Lock()
+
+    def bars(self, symbol, start, end, today):
+        """Return bars of symbol from start to end (dates) as a list of dicts."""
+
+        symbol = symbol.upper()
+        end = min(end, today - timedelta(days=1))
+        if start > end:
+            return []
+        self._fill(symbol, start, end)
+
+        return [
+            dict(row)
+            for row in self.db.execute(
+                "SELECT date, open, high, low, close, volume FROM price_history WHERE symbol = ? AND date BETWEEN ? AND ? ORDER BY date",
+                symbol,
+                start.isoformat(),
+                end.isoformat(),
+            )
+        ]
+
+    def closes(self, symbol, start, end, today):
+        """Return {YYYY-MM-DD: close} of symbol from start to end."""
+
+        bars = self.bars(symbol, start, end, today)
+        return {bar["date"]: bar["close"] for bar in bars}
+
+    def previous_close(self, symbol, today):
+        """Return close of the last trading day before today or None."""
+
+        symbol = symbol.upper()
+        self._fill(symbol, today - timedelta(days=10), today - timedelta(days=1))
+        rows = self.db.execute(
+            "SELECT close FROM price_history WHERE symbol = ? AND date < ? ORDER BY date DESC LIMIT 1",
+            symbol,
+            today.isoformat(),
+        )
+        return rows[0]["close"] if rows else None
+
+    def year_range(self, symbol, today):
+        """Return (52-week high, 52-week low) of symbol or (None, None)."""
+
+        symbol = symbol.upper()
+        start = today - timedelta(weeks=52)
+        self._fill(symbol, start, today - timedelta(days=1))
+        rows = self.db.execute(
+            "SELECT MAX(high) AS high, MIN(low) AS low FROM price_history WHERE symbol = ? AND date >= ?",
+            symbol,
+            start.isoformat(),
+        )
+        return rows[0]["high"], rows[0]["low"]
+
+    def _fill(self, symbol, start, end):
+        # Fetch the parts of start..end outside the symbol's stored range
+        with self._lock:
+            lock = self._locks.setdefault(symbol, threading.Lock())
+        with lock:
+            rows = self.db.execute(
+                "SELECT first_date, last_date FROM price_history_ranges WHERE symbol = ?",
+                symbol,
+            )
+            if rows:
+                first = date.fromisoformat(rows[0]["first_date"])
+                last = date.fromisoformat(rows[0]["last_date"])
+                gaps = []
+                if start < first:
+                    gaps.append((start, first - timedelta(days=1)))
+                if end > last:
+                    gaps.append((last + timedelta(days=1), end))
+            else:
+                first, last = start, end
+                gaps = [(start, end)]
+
+            for gap_start, gap_end in gaps:
+                try:
+                    bars = self.fetch(symbol, gap_start, gap_end)
+                except UpstreamError:
+                    # Leave the gap for the next call
+                    return
+                self._store(symbol, bars, min(first, gap_start), max(last, gap_end))
+                first, last = min(first, gap_start), max(last, gap_end)
+
+    def _store(self, symbol, bars, first, last):
+        # Save bars and the new stored range together
+        self.db.execute("BEGIN TRANSACTION")
+        try:
+            for bar in bars:
+                self.db.execute(
+                    "INSERT INTO price_history (symbol, date, open, high, low, close, volume) VALUES (?, ?, ?, ?, ?, ?, ?) "
+                    "ON CONFLICT (symbol, date) DO UPDATE SET open = excluded.open, high = excluded.high, "
+                    "low = excluded.low, close = excluded.close, volume = excluded.volume",
+                    symbol,
+                    bar["date"],
+                    bar["open"],
+                    bar["high"],
+                    bar["low"],
+                    bar["close"],
+                    bar["volume"],
+                )
+            self.db.execute(
+                "INSERT INTO price_history_ranges (symbol, first_date, last_date) VALUES (?, ?, ?) "
+                "ON CONFLICT (symbol) DO UPDATE SET first_date = excluded.first_date, last_date = excluded.last_date",
+                symbol,
+                first.isoformat(),
+                last.isoformat(),
+            )
+        except Exception:
+            self.db.execute("ROLLBACK")
+            raise
+        self.db.execute("COMMIT")
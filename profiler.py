@@ -0,0 +1,191 @@
+import cProfile
+import io
+import os
+import pstats
+import random
+import re
+import sys
+import threading
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+
+COLLECTORS = ("sampling", "cprofile")
+
+# Profile file names: <unix ms>-<pid>-<method>-<endpoint>-<duration ms>ms.<ext>
+NAME = re.compile(r"(\d+)-(\d+)-([A-Z]+)-([\w.]+)-(\d+)ms\.(txt|prof)")
+
+
+class RequestProfiler:
+    """
+    Opt-in profiler of request dispatch.
+
+    A request is profiled when it's picked by sample_rate (a fraction of all
+    requests) or, with threshold set, when it ends up taking at least threshold
+    seconds; other profiles are dropped. Profiles are written to directory,
+    which keeps the newest keep files (a ring shared by all worker processes).
+
+    The "sampling" collector records the stack of each profiled request's
+    thread every interval seconds from one background thread and writes
+    collapsed stacks (flame graph input). "cprofile" runs cProfile on the
+    request thread and writes pstats files; it's exact but slows every request
+    it watches, so use it with sample_rate rather than threshold.
+
+    While disabled (no sample rate and no threshold) start() returns None
+    right away, so the hooks can stay installed.
+    """
+
+    def __init__(
+        self,
+        directory,
+        sample_rate=0,
+        threshold=0,
+        collector="sampling",
+        keep=100,
+        interval=0.005,
+    ):
+        if collector not in COLLECTORS:
+            raise ValueError(f"unknown profile collector: {collector}")
+        self.directory = directory
+        self.sample_rate = sample_rate
+        self.threshold = threshold
+        self.collector = collector
+        self.keep = keep
+        self.interval = interval
+        self.enabled = bool(sample_rate or threshold)
+        self._active = {}  # thread id -> Counter of collapsed stacks
+        self._sampler = None
+        self._lock = threading.Lock()
+        self._writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix="profiler")
+
+    def start(self):
+        """Start profiling the current request if it's picked; returns a token."""
+
+        if not self.enabled:
+            return None
+        sampled = random.random() < self.sample_rate
+        if not sampled and not self.threshold:
+            return None
+
+        token = {"sampled": sampled, "started": time.perf_counter()}
+        if self.collector == "cprofile":
+            token["profile"] = cProfile.Profile()
+            token["profile"].enable()
+        else:
+            self._start_sampler()
+            token["thread"] = threading.get_ident()
+            self._active[token["thread"]] = Counter()
+        return token
+
+    def finish(self, token, method, endpoint):
+        """Stop profiling; keep the profile if sampled or slow enough."""
+
+        elapsed = time.perf_counter() - token["started"]
+        if self.collector == "cprofile":
+            token["profile"].disable()
+            data = token["profile"]
+        else:
+            data = self._active.pop(token["thread"], Counter())
+
+        if token["sampled"] or (self.threshold and elapsed >= self.threshold):
+            self._writer.submit(self._write, data, method, endpoint, elapsed)
+
+    def profiles(self):
+        """Return the kept profiles, newest first, as dicts."""
+
+        found = []
+        for name in _listdir(self.directory):
+            match = NAME.fullmatch(name)
+            if match:
+                found.append(
+                    {
+                        "name": name,
+                        "time": int(match[1]) / 1000,
+                        "pid": int(match[2]),
+                        "method": match[3],
+                        "endpoint": match[4],
+                        "ms": int(match[5]),
+                        "collector": "cprofile" if match[6] == "prof" else "sampling",
+                    }
+                )
+        found.sort(key=lambda profile: profile["name"], reverse=True)
+        return found
+
+    def path(self, name):
+        """Return the path of a kept profile, or None for unknown names."""
+
+        if not NAME.fullmatch(name):
+            return None
+        path = os.path.join(self.directory, name)
+        return path if os.path.exists(path) else None
+
+    def _start_sampler(self):
+        with self._lock:
+            if self._sampler is None:
+                self._sampler = threading.Thread(
+                    target=self._sample, name="profile-sampler", daemon=True
+                )
+                self._sampler.start()
+
+    def _sample(self):
+        # Add the current stack of every profiled thread to its counter
+        while True:
+            time.sleep(self.interval)
+            if not self._active:
+                continue
+            frames = sys._current_frames()
+            for thread_id, stacks in list(self._active.items()):
+                frame = frames.get(thread_id)
+                if frame is not None:
+                    stacks[_collapse(frame)] += 1
+
+    def _write(self, data, method, endpoint, elapsed):
+        os.makedirs(self.directory, exist_ok=True)
+        extension = "prof" if self.collector == "cprofile" else "txt"
+        name = (
+            f"{time.time_ns() // 1_000_000}-{os.getpid()}-{method}-{endpoint}-"
+            f"{round(elapsed * 1000)}ms.{extension}"
+        )
+        path = os.path.join(self.directory, name)
+        if self.collector == "cprofile":
+            data.dump_stats(path)
+        else:
+            with open(path, "w") as file:
+                for stack, count in data.most_common():
+                    file.write(f"{stack} {count}\n")
+
+        # Drop the oldest profiles beyond keep
+        names = sorted(
+            name for name in _listdir(self.directory) if NAME.fullmatch(name)
+        )
+        for old in names[: max(len(names) - self.keep, 0)]:
+            try:
+                os.remove(os.path.join(self.directory, old))
+            except OSError:
+                pass
+
+
+def report(path, limit=60):
+    """Return a cProfile file as a text report sorted by cumulative time."""
+
+    output = io.StringIO()
+    stats = pstats.Stats(path, stream=output)
+    stats.sort_stats("cumulative").print_stats(limit)
+    return output.getvalue()
+
+
+def _collapse(frame):
+    # Stack as root;...;leaf of file:function entries
+    entries = []
+    while frame is not None:
+        code = frame.f_code
+        entries.append(f"{os.path.basename(code.co_filename)}:{code.co_name}")
+        frame = frame.f_back
+    return ";".join(reversed(entries))
+
+
+def _listdir(directory):
+    try:
+        return os.listdir(directory)
+    except FileNotFoundError:
+        return []
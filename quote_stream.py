@@ -0,0 +1,117 @@
+import queue
+import threading
+
+# Max updates buffered per subscriber before it's resynced with a full snapshot
+MAX_PENDING = 64
+
+
+class Subscription:
+    """A subscriber's queue of (symbol, changed fields) updates."""
+
+    def __init__(self, symbols):
+        self.symbols = symbols
+        self.updates = queue.Queue(maxsize=MAX_PENDING)
+
+    def get(self, timeout=None):
+        """Return next (symbol, fields) update, raising queue.Empty on timeout."""
+
+        return self.updates.get(timeout=timeout)
+
+
+class _Feed:
+    """Poller state for one symbol."""
+
+    def __init__(self):
+        self.subscribers = set()
+        self.last = None
+        self.stopped = threading.Event()
+
+
+class QuoteBroadcaster:
+    """
+    Fan quote updates out to many subscribers with one poller per symbol.
+
+    Each subscribed symbol gets a single background thread that calls
+    fetch(symbol) every interval seconds and pushes only the fields that
+    changed since the previous poll to every subscriber of that symbol. The
+    poller stops once the symbol's last subscriber unsubscribes.
+    """
+
+    def __init__(self, fetch, interval=5):
+        self.fetch = fetch
+        self.interval = interval
+        self._feeds = {}
+        self._lock = threading.Lock()
+
+    def subscribe(self, symbols):
+        """Subscribe to updates for symbols, returning a Subscription."""
+
+        subscription = Subscription(symbols)
+        with self._lock:
+            for symbol in symbols:
+                feed = self._feeds.get(symbol)
+                if feed is None:
+                    feed = self._feeds[symbol] = _Feed()
+                    threading.Thread(
+                        target=self._poll,
+                        args=(symbol, feed),
+                        name=f"quote-stream-{symbol}",
+                        daemon=True,
+                    ).start()
+
+                # Start the new subscriber off with the latest full quote
+                elif feed.last is not None:
+                    self._deliver(subscription, symbol, feed.last)
+                feed.subscribers.add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        """Stop delivering updates to subscription."""
+
+        with self._lock:
+            for symbol in subscription.symbols:
+                feed = self._feeds.get(symbol)
+                if feed is None:
+                    continue
+                feed.subscribers.discard(subscription)
+                if not feed.subscribers:
+                    feed.stopped.set()
+                    del self._feeds[symbol]
+
+    def _poll(self, symbol, feed):
+        while not feed.stopped.is_set():
+            try:
+                data = self.fetch(symbol)
+            except Exception:
+                data = None
+
+            if data is not None:
+                with self._lock:
+                    last = feed.last or {}
+                    changed = {
+                        key: value
+                        for key, value in data.items()
+                        if key not in last or last[key] != value
+                    }
+                    feed.last = data
+                    if changed:
+                        for subscription in feed.subscribers:
+                            self._deliver(subscription, symbol, changed)
+
+            feed.stopped.wait(self.interval)
+
+    def _deliver(self, subscription, symbol, changed):
+        # Caller holds the lock
+        try:
+            subscription.updates.put_nowait((symbol, changed))
+        except queue.Full:
+            # Subscriber fell behind: replace its backlog with full quotes
+            while True:
+                try:
+                    subscription.updates.get_nowait()
+                except queue.Empty:
+                    break
+            for symbol in subscription.symbols:
+                feed = self._feeds.get(symbol)
+                if feed is not None and feed.last is not None:
+                    subscription.updates.put_nowait((symbol, feed.last))
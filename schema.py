@@ -0,0 +1,181 @@
+from positions import rebuild_positions
+
+
+def init_schema(db):
+    """Create tables and indexes added since the original tradehub.db schema."""
+
+    # Carry-forward rows stand for the compacted trades of a symbol and hold
+    # their realized P&L; the trades themselves move to stocks_archive (see
+    # ledger_archive.py)
+    if not _column_exists(db, "stocks", "carry_forward"):
+        db.execute(
+            "ALTER TABLE stocks ADD COLUMN carry_forward INTEGER NOT NULL DEFAULT 0"
+        )
+        db.execute(
+            "ALTER TABLE stocks ADD COLUMN realized_pnl NUMERIC NOT NULL DEFAULT 0"
+        )
+    db.execute(
+        """CREATE TABLE IF NOT EXISTS stocks_archive (
+            id INTEGER PRIMARY KEY,
+            symbol TEXT NOT NULL,
+            symbol_name TEXT,
+            price NUMERIC NOT NULL,
+            amount INTEGER NOT NULL,
+            date_time DATETIME NOT NULL,
+            user_id INTEGER NOT NULL,
+            FOREIGN KEY (user_id) REFERENCES users (id)
+        )"""
+    )
+    db.execute(
+        "CREATE INDEX IF NOT EXISTS stocks_archive_user_date_time ON stocks_archive (user_id, date_time, id)"
+    )
+
+    # Positions: current holdings per user and symbol, kept in step with stocks
+    new_positions = not _table_exists(db, "positions")
+    db.execute(
+        """CREATE TABLE IF NOT EXISTS positions (
+            user_id INTEGER NOT NULL,
+            symbol TEXT NOT NULL,
+            symbol_name TEXT,
+            quantity INTEGER NOT NULL DEFAULT 0,
+            cost_basis NUMERIC NOT NULL DEFAULT 0,
+            realized_pnl NUMERIC NOT NULL DEFAULT 0,
+            PRIMARY KEY (user_id, symbol),
+            FOREIGN KEY (user_id) REFERENCES users (id)
+        )"""
+    )
+
+    # Backfill positions from the ledger the first time the table is created
+    if new_positions:
+        rebuild_positions(db)
+
+    # Long stocks ledgers as columns of raw NumPy arrays, so /api/pnl doesn't
+    # read them row by row (see pnl.load_ledger)
+    db.execute(
+        """CREATE TABLE IF NOT EXISTS ledger_columns (
+            user_id INTEGER PRIMARY KEY,
+            row_count INTEGER NOT NULL,
+            last_id INTEGER NOT NULL,
+            symbols TEXT NOT NULL,
+            codes BLOB NOT NULL,
+            prices BLOB NOT NULL,
+            amounts BLOB NOT NULL,
+            times BLOB NOT NULL,
+            carried TEXT NOT NULL,
+            FOREIGN KEY (user_id) REFERENCES users (id)
+        )"""
+    )
+
+    # Slow-moving symbol fundamentals as JSON (see metadata.py)
+    db.execute(
+        """CREATE TABLE IF NOT EXISTS symbol_metadata (
+            symbol TEXT PRIMARY KEY NOT NULL,
+            data TEXT NOT NULL,
+            updated_at REAL NOT NULL
+        )"""
+    )
+
+    # Server-side sessions (see sessions.py); the index lets the sweeper find
+    # expired rows without scanning the table
+    db.execute(
+        """CREATE TABLE IF NOT EXISTS sessions (
+            id TEXT PRIMARY KEY NOT NULL,
+            data TEXT NOT NULL,
+            expires_at REAL NOT NULL
+        ) WITHOUT ROWID"""
+    )
+    db.execute(
+        "CREATE INDEX IF NOT EXISTS sessions_expires_at ON sessions (expires_at)"
+    )
+
+    # End-of-day portfolio values for performance charts (see snapshots.py)
+    db.execute(
+        """CREATE TABLE IF NOT EXISTS portfolio_snapshots (
+            user_id INTEGER NOT NULL,
+            date TEXT NOT NULL,
+            equity NUMERIC NOT NULL,
+            cash NUMERIC NOT NULL,
+            positions TEXT NOT NULL,
+            PRIMARY KEY (user_id, date),
+            FOREIGN KEY (user_id) REFERENCES users (id)
+        ) WITHOUT ROWID"""
+    )
+
+    # Daily OHLCV bars and the range of days fetched per symbol (see
+    # price_history.py)
+    db.execute(
+        """CREATE TABLE IF NOT EXISTS price_history (
+            symbol TEXT NOT NULL,
+            date TEXT NOT NULL,
+            open REAL,
+            high REAL,
+            low REAL,
+            close REAL NOT NULL,
+            volume INTEGER,
+            PRIMARY KEY (symbol, date)
+        ) WITHOUT ROWID"""
+    )
+    db.execute(
+        """CREATE TABLE IF NOT EXISTS price_history_ranges (
+            symbol TEXT PRIMARY KEY NOT NULL,
+            first_date TEXT NOT NULL,
+            last_date TEXT NOT NULL
+        ) WITHOUT ROWID"""
+    )
+
+    # Resting limit and stop orders (see orders.py)
+    db.execute(
+        """CREATE TABLE IF NOT EXISTS orders (
+            id INTEGER PRIMARY KEY,
+            user_id INTEGER NOT NULL,
+            symbol TEXT NOT NULL,
+            symbol_name TEXT,
+            side TEXT NOT NULL,
+            order_type TEXT NOT NULL,
+            trigger_price NUMERIC NOT NULL,
+            shares INTEGER NOT NULL,
+            status TEXT NOT NULL,
+            created_at TEXT NOT NULL,
+            filled_at TEXT,
+            fill_price NUMERIC,
+            reason TEXT,
+            FOREIGN KEY (user_id) REFERENCES users (id)
+        )"""
+    )
+    db.execute("CREATE INDEX IF NOT EXISTS orders_user ON orders (user_id, id)")
+
+    # Saved leaderboard values and the prices they're based on (see
+    # leaderboard.py)
+    db.execute(
+        """CREATE TABLE IF NOT EXISTS leaderboard (
+            user_id INTEGER PRIMARY KEY,
+            equity NUMERIC NOT NULL,
+            return_pct NUMERIC NOT NULL,
+            updated_at REAL NOT NULL,
+            FOREIGN KEY (user_id) REFERENCES users (id)
+        )"""
+    )
+    db.execute(
+        """CREATE TABLE IF NOT EXISTS leaderboard_prices (
+            symbol TEXT PRIMARY KEY NOT NULL,
+            price NUMERIC NOT NULL
+        ) WITHOUT ROWID"""
+    )
+
+    # Keyset pagination of a user's history (newest first)
+    db.execute(
+        "CREATE INDEX IF NOT EXISTS stocks_user_date_time ON stocks (user_id, date_time, id)"
+    )
+
+
+def _table_exists(db, name):
+    return bool(
+        db.execute(
+            "SELECT name FROM sqlite_master WHERE type = 'table' AND name = ?", name
+        )
+    )
+
+
+def _column_exists(db, table, name):
+    rows = db.execute(f"PRAGMA table_info({table})")
+    return any(row["name"] == name for row in rows)
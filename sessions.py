@@ -0,0 +1,156 @@
+import secrets
+import threading
+import time
+
+from flask.json.tag import TaggedJSONSerializer
+from flask.sessions import SessionInterface, SessionMixin
+from werkzeug.datastructures import CallbackDict
+
+from cache import TTLCache
+
+
+class ServerSession(CallbackDict, SessionMixin):
+    """Session data kept on the server; the cookie only holds its id."""
+
+    def __init__(self, initial=None, sid=None, expires_at=0):
+        def on_update(self):
+            self.modified = True
+
+        super().__init__(initial, on_update)
+        self.sid = sid
+        self.expires_at = expires_at
+        self.modified = False
+        self.rotate = False
+
+    def clear(self):
+        # A cleared session (logout, login) gets a new id so old cookies are
+        # worthless and a planted session id can't be taken over
+        super().clear()
+        self.rotate = True
+
+
+class SQLiteSessionInterface(SessionInterface):
+    """
+    Sessions stored in the sessions table, keyed by a random id in the cookie.
+
+    Loads go through a short-lived in-memory cache, so a page with several
+    requests reads the row once, and rows are only written when the session
+    changes or half of its lifetime is used up. Expired rows are deleted by a
+    background sweeper using the index on expires_at, so the cost per request
+    doesn't grow with the number of users.
+
+    With several worker processes a session change may take up to cache_ttl
+    seconds to be seen by the other workers.
+    """
+
+    serializer = TaggedJSONSerializer()
+
+    def __init__(self, db, cache_ttl=5, sweep_interval=300):
+        self.db = db
+        self.sweep_interval = sweep_interval
+        self.cache = TTLCache(maxsize=10000, ttl=cache_ttl)
+        self._sweeper = None
+
+    def open_session(self, app, request):
+        sid = request.cookies.get(self.get_cookie_name(app))
+        if sid:
+            row = self.cache.get_or_load(sid, lambda: self._load(sid))
+            if row is not None and row[1] > time.time():
+                return ServerSession(self.serializer.loads(row[0]), sid, row[1])
+        return ServerSession()
+
+    def save_session(self, app, session, response):
+        name = self.get_cookie_name(app)
+        domain = self.get_cookie_domain(app)
+        path = self.get_cookie_path(app)
+
+        # Drop the old row when the session was emptied or its id rotated
+        if session.sid and (not session or session.rotate):
+            self._delete(session.sid)
+            if not session:
+                response.delete_cookie(name, domain=domain, path=path)
+                return
+            session.sid = None
+        if not session:
+            return
+
+        # Skip the write if nothing changed and the row isn't close to expiring
+        lifetime = app.permanent_session_lifetime.total_seconds()
+        now = time.time()
+        if (
+            session.sid
+            and not session.modified
+            and session.expires_at - now > lifetime / 2
+        ):
+            return
+
+        new = session.sid is None
+        if new:
+            session.sid = secrets.token_urlsafe(32)
+        data = self.serializer.dumps(dict(session))
+        expires_at = now + lifetime
+        self.db.execute(
+            "INSERT INTO sessions (id, data, expires_at) VALUES (?, ?, ?) "
+            "ON CONFLICT (id) DO UPDATE SET data = excluded.data, expires_at = excluded.expires_at",
+            session.sid,
+            data,
+            expires_at,
+        )
+        self.cache.set(session.sid, (data, expires_at))
+
+        # Only new ids need a cookie (or refreshing one that expires)
+        if new or session.permanent:
+            response.set_cookie(
+                name,
+                session.sid,
+                expires=self.get_expiration_time(app, session),
+                httponly=self.get_cookie_httponly(app),
+                domain=domain,
+                path=path,
+                secure=self.get_cookie_secure(app),
+                samesite=self.get_cookie_samesite(app),
+            )
+
+    def start_sweeper(self):
+        """Delete expired sessions every sweep_interval seconds in a daemon thread."""
+
+        if self._sweeper is None:
+            self._sweeper = threading.Thread(
+                target=self._sweep_forever, name="session-sweeper", daemon=True
+            )
+            self._sweeper.start()
+
+    def sweep(self, batch=1000):
+        """Delete expired sessions in small batches; returns number deleted."""
+
+        deleted = 0
+        while True:
+            count = self.db.execute(
+                "DELETE FROM sessions WHERE id IN "
+                "(SELECT id FROM sessions WHERE expires_at <= ? LIMIT ?)",
+                time.time(),
+                batch,
+            )
+            deleted += count
+            if count < batch:
+                return deleted
+
+    def _sweep_forever(self):
+        while True:
+            time.sleep(self.sweep_interval)
+            try:
+                self.sweep()
+            except Exception:
+                pass
+
+    def _load(self, sid):
+        rows = self.db.execute(
+            "SELECT data, expires_at FROM sessions WHERE id = ?", sid
+        )
+        if not rows:
+            return None
+        return rows[0]["data"], rows[0]["expires_at"]
+
+    def _delete(self, sid):
+        self.db.execute("DELETE FROM sessions WHERE id = ?", sid)
+        self.cache.invalidate(sid)
@@ -0,0 +1,171 @@
+import json
+from datetime import date, timedelta
+
+# Days shown by /api/portfolio/history for each range (None: everything)
+RANGES = {"1m": 31, "3m": 92, "6m": 183, "1y": 366, "5y": 1827, "all": None}
+
+# Every trade ever made: compacted ones are in stocks_archive, and the
+# carry-forward rows that replaced them hold positions rather than trades
+TRADES = (
+    "(SELECT user_id, symbol, price, amount, date_time FROM stocks WHERE carry_forward = 0 "
+    "UNION ALL SELECT user_id, symbol, price, amount, date_time FROM stocks_archive)"
+)
+
+
+def take_snapshots(db, start, end, closes, quote, today=None):
+    """
+    Write end-of-day portfolio snapshots of every user for start..end (dates).
+
+    A snapshot holds the user's cash, the market value of each position at
+    that day's close and their total (equity), one row per user and weekday.
+    Existing rows are replaced. closes(symbol, start, end) returns
+    {YYYY-MM-DD: close}; days without a close (holidays, missing data) use the
+    previous close, and symbols without any close use quote(symbol). Daily
+    bars of today (the market date) aren't stored until the next day, so
+    today's snapshot values positions at quote(symbol), which is the close
+    once the market has closed. quote is only called before the transaction.
+
+    Holdings are replayed from the trades in stocks and stocks_archive (so
+    days before a ledger compaction still add up). Cash on past days is the
+    current cash minus later trades, so deposits and withdrawals made after a
+    day aren't reflected in it: snapshots are exact when taken daily.
+
+    Returns number of rows written.
+    """
+
+    if start > end:
+        return 0
+    first = start.isoformat()
+
+    # Holdings at the end of the day before start
+    holdings = {}  # user_id -> {symbol: quantity}
+    for row in db.execute(
+        f"SELECT user_id, symbol, SUM(amount) AS quantity FROM {TRADES} WHERE date_time < ? GROUP BY user_id, symbol",
+        first,
+    ):
+        holdings.setdefault(row["user_id"], {})[row["symbol"]] = row["quantity"]
+
+    # Trades from start on, by day; cash is rolled back to before them
+    cash = {
+        row["id"]: row["cash"] for row in db.execute("SELECT id, cash FROM users")
+    }
+    trades = {}  # YYYY-MM-DD -> rows
+    for row in db.execute(
+        "SELECT user_id, date(date_time) AS day, symbol, SUM(amount) AS amount, SUM(amount * price) AS cost "
+        f"FROM {TRADES} WHERE date_time >= ? GROUP BY user_id, day, symbol",
+        first,
+    ):
+        trades.setdefault(row["day"], []).append(row)
+        if row["user_id"] in cash:
+            cash[row["user_id"]] += row["cost"]
+
+    # Daily closes of every symbol held during the period (starting a week
+    # early so a holiday on the first day still has a previous close)
+    symbols = {symbol for positions in holdings.values() for symbol in positions}
+    symbols.update(row["symbol"] for rows in trades.values() for row in rows)
+    prices = {
+        symbol: closes(symbol, start - timedelta(days=7), end) for symbol in symbols
+    }
+    last = {}
+    for symbol, series in prices.items():
+        earlier = [day for day in series if day < first]
+        if earlier:
+            last[symbol] = series[max(earlier)]
+
+    # Live quotes are fetched before the transaction so that no upstream call
+    # is made while it holds the write lock: every symbol's when today's
+    # closes are needed (markets are closed on weekends), otherwise those of
+    # symbols without a close before start
+    live = today is not None and start <= today <= end and today.weekday() < 5
+    quotes = {
+        symbol: quote(symbol) for symbol in (symbols if live else symbols - last.keys())
+    }
+    if live:
+        for symbol, price in quotes.items():
+            if price is not None:
+                prices[symbol][today.isoformat()] = price
+
+    written = 0
+    db.execute("BEGIN TRANSACTION")
+    try:
+        day = start
+        while day <= end:
+            key = day.isoformat()
+            for row in trades.get(key, ()):
+                positions = holdings.setdefault(row["user_id"], {})
+                quantity = positions.get(row["symbol"], 0) + row["amount"]
+                positions[row["symbol"]] = quantity
+                if row["user_id"] in cash:
+                    cash[row["user_id"]] -= row["cost"]
+            for symbol, series in prices.items():
+                if key in series:
+                    last[symbol] = series[key]
+
+            # Markets are closed on weekends
+            if day.weekday() < 5:
+                for user_id, balance in cash.items():
+                    positions = holdings.get(user_id, {})
+                    _save_snapshot(db, user_id, key, balance, positions, last, quotes)
+                    written += 1
+            day += timedelta(days=1)
+    except Exception:
+        db.execute("ROLLBACK")
+        raise
+    db.execute("COMMIT")
+
+    return written
+
+
+def catch_up(db, today, closes, quote):
+    """
+    Snapshot every day since the last snapshot (or the first trade) up to today.
+
+    The last snapshotted day is taken again, in case it was taken before the
+    close. Returns number of rows written.
+    """
+
+    rows = db.execute("SELECT MAX(date) AS date FROM portfolio_snapshots")
+    if rows[0]["date"]:
+        start = date.fromisoformat(rows[0]["date"])
+    else:
+        rows = db.execute(f"SELECT MIN(date(date_time)) AS date FROM {TRADES}")
+        start = date.fromisoformat(rows[0]["date"]) if rows[0]["date"] else today
+    return take_snapshots(db, start, today, closes, quote, today)
+
+
+def portfolio_history(db, user_id, period, today):
+    """Return [{"date", "equity", "cash"}] of user_id for period (a RANGES key)."""
+
+    days = RANGES[period]
+    since = (today - timedelta(days=days)).isoformat() if days else ""
+    return [
+        dict(row)
+        for row in db.execute(
+            "SELECT date, equity, cash FROM portfolio_snapshots WHERE user_id = ? AND date >= ? ORDER BY date",
+            user_id,
+            since,
+        )
+    ]
+
+
+def _save_snapshot(db, user_id, day, cash, positions, closes, quotes):
+    # Value positions at the last known close and upsert the snapshot row
+    values = {}
+    for symbol, quantity in positions.items():
+        if quantity <= 0:
+            continue
+        if symbol not in closes:
+            closes[symbol] = quotes.get(symbol)
+        if closes[symbol] is not None:
+            values[symbol] = round(quantity * closes[symbol], 2)
+
+    db.execute(
+        "INSERT INTO portfolio_snapshots (user_id, date, equity, cash, positions) VALUES (?, ?, ?, ?, ?) "
+        "ON CONFLICT (user_id, date) DO UPDATE SET equity = excluded.equity, cash = excluded.cash, "
+        "positions = excluded.positions",
+        user_id,
+        day,
+        round(cash + sum(values.values()), 2),
+        round(cash, 2),
+        json.dumps(values),
+    )
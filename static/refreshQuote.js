@@ -1,3 +1,48 @@
+// Quote fields that are shown in an element with the same id on the quote page
+const quoteFields = [
+    "price", "price_diff", "current_time", "market", "bid_price", "bid_size", "ask_price", "ask_size",
+    "day_high", "day_low", "market_cap", "pe", "fifty_two_week_high", "fifty_two_week_low",
+    "volume", "average_volume"
+];
+
+// updateQuote function that updates the page content with the fields present in data
+function updateQuote(data) {
+    quoteFields.forEach(field => {
+        if (field in data) {
+            document.getElementById(field).textContent = data[field];
+        }
+    });
+
+    if ("percentage_change" in data) {
+        document.getElementById("percentage_change").textContent = `(${data.percentage_change}%)`;
+    }
+
+    // Set color dynamically
+    if ("price_diff_color" in data) {
+        document.getElementById("price_diff").style.color = data.price_diff_color;
+        document.getElementById("percentage_change").style.color = data.price_diff_color;
+    }
+}
+
+// streamQuote function that subscribes to server-sent quote updates for symbol
+function streamQuote(symbol) {
+    const source = new EventSource("/stream/quotes?symbols=" + encodeURIComponent(symbol));
+
+    // Each event carries only the fields that changed since the previous one
+    source.addEventListener("quote", event => {
+        const data = JSON.parse(event.data);
+        if (data.symbol === symbol) {
+            updateQuote(data);
+        }
+    });
+
+    source.onerror = () => {
+        console.error("Quote stream interrupted, reconnecting...");
+    };
+
+    return source;
+}
+
 // refreshQuote function script that creates AJAX request to server to get updated stock data
 function refreshQuote(symbol) {
     const payload = JSON.stringify({ symbol: symbol });
@@ -14,9 +59,9 @@ function refreshQuote(symbol) {
     .then(response => {
         console.log("Response status:", response.status);
         if (!response.ok) {
-            return response.json().then(error => { 
+            return response.json().then(error => {
                 console.error("Response error content:", error);
-                throw new Error(error.error); 
+                throw new Error(error.error);
             });
         }
         return response.json();
@@ -27,51 +72,8 @@ function refreshQuote(symbol) {
             console.error("Error refreshing quote:", data.error);
             return;
         }
-        // Update the page content with new data        
-        document.getElementById("price").textContent = data.price;
-        document.getElementById("price_diff").textContent = data.price_diff;
-        document.getElementById("percentage_change").textContent = `(${data.percentage_change}%)`;
-
-        // Set color dynamically
-        document.getElementById("price_diff").style.color = data.price_diff_color;
-        document.getElementById("percentage_change").style.color = data.price_diff_color;
-
-        document.getElementById("current_time").textContent = data.current_time;
-        document.getElementById("market").textContent = data.market;
-        document.getElementById("bid_price").textContent = data.bid_price;
-        document.getElementById("bid_size").textContent = data.bid_size;
-        document.getElementById("ask_price").textContent = data.ask_price;
-        document.getElementById("ask_size").textContent = data.ask_size;
-        document.getElementById("day_high").textContent = data.day_high;
-        document.getElementById("day_low").textContent = data.day_low;
-        document.getElementById("market_cap").textContent = data.market_cap;
-        document.getElementById("pe").textContent = data.pe;
-        document.getElementById("fifty_two_week_high").textContent = data.fifty_two_week_high;
-        document.getElementById("fifty_two_week_low").textContent = data.fifty_two_week_low;
-        document.getElementById("volume").textContent = data.volume;
-        document.getElementById("average_volume").textContent = data.average_volume;
-                
-        // Log updated info
-        console.log("Updated information:", {
-            price: document.getElementById("price").textContent,
-            price_diff: document.getElementById("price_diff").textContent,
-            percent_change: document.getElementById("percentage_change").textContent,
-            price_diff_color: data.price_diff_color,
-            current_time: document.getElementById("current_time").textContent,
-            market: document.getElementById("market").textContent,
-            bid_price: document.getElementById("bid_price").textContent,
-            bid_size: document.getElementById("bid_size").textContent,
-            ask_price: document.getElementById("ask_price").textContent,
-            ask_size: document.getElementById("ask_size").textContent,
-            day_high: document.getElementById("day_high").textContent,
-            day_low: document.getElementById("day_low").textContent,
-            market_cap: document.getElementById("market_cap").textContent,
-            pe: document.getElementById("pe").textContent,
-            fifty_two_week_high: document.getElementById("fifty_two_week_high").textContent,
-            fifty_two_week_low: document.getElementById("fifty_two_week_low").textContent,
-            volume: document.getElementById("volume").textContent,
-            average_volume: document.getElementById("average_volume").textContent            
-        });
+        // Update the page content with new data
+        updateQuote(data);
     })
     .catch(error => {
         console.error("Error refreshing quote:", error);
@@ -0,0 +1,30 @@
+// Suggests ticker symbols while typing into inputs that have a data-symbol-search attribute
+document.querySelectorAll("input[data-symbol-search]").forEach(input => {
+    const list = document.createElement("datalist");
+    list.id = input.name + "-suggestions";
+    input.setAttribute("list", list.id);
+    input.after(list);
+
+    let timer;
+    input.addEventListener("input", () => {
+        clearTimeout(timer);
+
+        // Wait for a short pause in typing before asking the server
+        timer = setTimeout(() => {
+            fetch("/symbols/search?q=" + encodeURIComponent(input.value))
+                .then(response => response.json())
+                .then(symbols => {
+                    list.innerHTML = "";
+                    symbols.forEach(symbol => {
+                        const option = document.createElement("option");
+                        option.value = symbol.symbol;
+                        option.textContent = `${symbol.name} (${symbol.exchange})`;
+                        list.appendChild(option);
+                    });
+                })
+                .catch(error => {
+                    console.error("Error searching symbols:", error);
+                });
+        }, 150);
+    });
+});
@@ -0,0 +1,90 @@
+import bisect
+import csv
+import threading
+
+
+class SymbolIndex:
+    """
+    In-memory index of known ticker symbols.
+
+    Tickers and lowercased company names are kept in sorted arrays, so
+    validation and prefix search are binary searches (O(log n)).
+    """
+
+    def __init__(self, rows=()):
+        self._symbols = {}  # symbol -> {"symbol", "name", "exchange", "currency"}
+        self._tickers = []
+        self._names = []  # (lowercased name, symbol)
+        self._lock = threading.Lock()
+        for row in rows:
+            self.add(row)
+
+    @classmethod
+    def load(cls, path):
+        """Load index from a CSV file with symbol,name,exchange,currency columns."""
+
+        with open(path, newline="") as file:
+            return cls(csv.DictReader(file))
+
+    def add(self, row):
+        """Add a {"symbol", "name", "exchange", "currency"} row to the index."""
+
+        symbol = row["symbol"].upper()
+        row = {
+            "symbol": symbol,
+            "name": row.get("name") or symbol,
+            "exchange": row.get("exchange") or "",
+            "currency": row.get("currency") or "USD",
+        }
+        with self._lock:
+            if symbol in self._symbols:
+                return
+            self._symbols[symbol] = row
+            bisect.insort(self._tickers, symbol)
+            bisect.insort(self._names, (row["name"].lower(), symbol))
+
+    def __contains__(self, symbol):
+        symbol = symbol.upper()
+        index = bisect.bisect_left(self._tickers, symbol)
+        return index < len(self._tickers) and self._tickers[index] == symbol
+
+    def __len__(self):
+        return len(self._tickers)
+
+    def get(self, symbol):
+        """Return row for symbol or None."""
+
+        return self._symbols.get(symbol.upper())
+
+    def search(self, query, limit=10):
+        """Return up to limit rows whose ticker or company name starts with query."""
+
+        query = query.strip()
+        if not query:
+            return []
+
+        results = []
+        for symbol in _prefixed(self._tickers, query.upper(), limit):
+            results.append(self._symbols[symbol])
+
+        # Fill up with company name matches
+        if len(results) < limit:
+            for _, symbol in _prefixed(self._names, (query.lower(),), limit * 2):
+                if len(results) == limit:
+                    break
+                if self._symbols[symbol] not in results:
+                    results.append(self._symbols[symbol])
+        return results
+
+
+def _prefixed(array, prefix, limit):
+    # Yield up to limit items of sorted array starting with prefix (a str, or a
+    # 1-tuple holding a str for arrays of tuples)
+    text = prefix[0] if isinstance(prefix, tuple) else prefix
+    for index in range(bisect.bisect_left(array, prefix), len(array)):
+        item = array[index]
+        key = item[0] if isinstance(item, tuple) else item
+        if not key.startswith(text) or limit == 0:
+            return
+        limit -= 1
+        yield item
@@ -0,0 +1,128 @@
+import random
+import sqlite3
+import time
+from datetime import datetime
+
+from positions import record_trade
+
+# Attempts and base delay (seconds) for transactions that hit a locked database
+RETRIES = 5
+RETRY_DELAY = 0.05
+
+
+class TradeError(Exception):
+    """Raised when an order can't be executed (e.g. not enough cash or shares)."""
+
+
+def run_transaction(db, operation):
+    """
+    Run operation() inside BEGIN IMMEDIATE ... COMMIT and return its result.
+
+    BEGIN IMMEDIATE takes the database write lock up front, so concurrent
+    orders are serialized instead of overwriting each other's balances. If the
+    database stays locked past the busy timeout, the whole transaction is
+    retried with jittered exponential backoff. Any exception rolls back.
+    """
+
+    for attempt in range(RETRIES):
+        try:
+            db.execute("BEGIN IMMEDIATE")
+            try:
+                result = operation()
+            except Exception:
+                _rollback(db)
+                raise
+            db.execute("COMMIT")
+            return result
+        except sqlite3.OperationalError as e:
+            if "database is locked" not in str(e) or attempt == RETRIES - 1:
+                raise
+            _rollback(db)
+            time.sleep(RETRY_DELAY * 2**attempt * random.uniform(0.5, 1.5))
+
+
+def buy(db, user_id, symbol, symbol_name, price, shares):
+    """Buy shares of symbol at price, debiting the user's cash atomically."""
+
+    run_transaction(
+        db, lambda: execute_buy(db, user_id, symbol, symbol_name, price, shares)
+    )
+
+
+def sell(db, user_id, symbol, symbol_name, price, shares):
+    """Sell shares of symbol at price, crediting the user's cash atomically."""
+
+    run_transaction(
+        db, lambda: execute_sell(db, user_id, symbol, symbol_name, price, shares)
+    )
+
+
+def execute_buy(db, user_id, symbol, symbol_name, price, shares):
+    """Buy shares within the caller's transaction (see run_transaction)."""
+
+    # Debit cash only if the user still has enough
+    total = price * shares
+    if not db.execute(
+        "UPDATE users SET cash = cash - ? WHERE id = ? AND cash >= ?",
+        total,
+        user_id,
+        total,
+    ):
+        raise TradeError("not enough cash")
+    record_trade(db, user_id, symbol, symbol_name, price, shares, sql_now())
+
+
+def execute_sell(db, user_id, symbol, symbol_name, price, shares):
+    """Sell shares within the caller's transaction (see run_transaction)."""
+
+    # Ensure the user still holds enough shares
+    rows = db.execute(
+        "SELECT quantity FROM positions WHERE user_id = ? AND symbol = ?",
+        user_id,
+        symbol,
+    )
+    if not rows or rows[0]["quantity"] < shares:
+        raise TradeError("not enough shares")
+
+    record_trade(db, user_id, symbol, symbol_name, price, -shares, sql_now())
+    db.execute("UPDATE users SET cash = cash + ? WHERE id = ?", price * shares, user_id)
+
+
+def deposit(db, user_id, amount):
+    """Add amount to the user's cash."""
+
+    run_transaction(
+        db,
+        lambda: db.execute(
+            "UPDATE users SET cash = cash + ? WHERE id = ?", amount, user_id
+        ),
+    )
+
+
+def withdraw(db, user_id, amount):
+    """Take amount from the user's cash if the balance allows it."""
+
+    def operation():
+        if not db.execute(
+            "UPDATE users SET cash = cash - ? WHERE id = ? AND cash >= ?",
+            amount,
+            user_id,
+            amount,
+        ):
+            raise TradeError("insufficient funds")
+
+    run_transaction(db, operation)
+
+
+def sql_now():
+    """Return current date/time in SQL format YYYY-MM-DD HH:MM:SS."""
+
+    return datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+
+
+def _rollback(db):
+    # The transaction may already be gone (e.g. if BEGIN itself failed)
+    try:
+        db.execute("ROLLBACK")
+    except sqlite3.OperationalError:
+        pass
@@ -0,0 +1,226 @@
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import TimeoutError as FutureTimeoutError
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from metrics import registry
+
+
+class UpstreamError(Exception):
+    """An upstream call failed or ran out of time."""
+
+
+class CircuitOpenError(UpstreamError):
+    """An upstream call was refused because the host's breaker is open."""
+
+
+class CircuitBreaker:
+    """
+    Circuit breaker of one upstream host.
+
+    After failure_threshold consecutive failures the breaker opens and calls
+    are refused for reset_timeout seconds. Then a single trial call is let
+    through (half-open): if it succeeds the breaker closes, otherwise it opens
+    for another reset_timeout seconds.
+    """
+
+    def __init__(self, failure_threshold=5, reset_timeout=30):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at = None
+        self._trial = False
+        self._lock = threading.Lock()
+
+    @property
+    def state(self):
+        """Return "closed", "open" or "half-open"."""
+
+        with self._lock:
+            if self.opened_at is None:
+                return "closed"
+            if time.monotonic() - self.opened_at < self.reset_timeout:
+                return "open"
+            return "half-open"
+
+    def allow(self):
+        """Return whether a call may be made now (claims the half-open trial)."""
+
+        with self._lock:
+            if self.opened_at is None:
+                return True
+            if time.monotonic() - self.opened_at < self.reset_timeout or self._trial:
+                return False
+            self._trial = True
+            return True
+
+    def record_success(self):
+        with self._lock:
+            self.failures = 0
+            self.opened_at = None
+            self._trial = False
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self._trial or self.failures >= self.failure_threshold:
+                self.opened_at = time.monotonic()
+            self._trial = False
+
+
+class UpstreamClient:
+    """
+    Shared client for calls to market data hosts.
+
+    HTTP requests go through one requests.Session with keep-alive connection
+    pools. Every call has a deadline: each attempt gets at most timeout
+    seconds, failed attempts are retried with jittered exponential backoff
+    while the deadline allows, and each host has a CircuitBreaker so that a
+    degraded host fails fast instead of tying up worker threads.
+
+    Libraries without timeouts of their own (yfinance) are run through call(),
+    which waits for them on a bounded thread pool for at most the deadline.
+    """
+
+    def __init__(
+        self,
+        timeout=3,
+        deadline=8,
+        retries=2,
+        backoff=0.25,
+        pool_size=16,
+        failure_threshold=5,
+        reset_timeout=30,
+    ):
+        self.timeout = timeout
+        self.deadline = deadline
+        self.retries = retries
+        self.backoff = backoff
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+        self._breakers = {}  # host -> CircuitBreaker
+        self._lock = threading.Lock()
+        self._pool = ThreadPoolExecutor(
+            max_workers=pool_size, thread_name_prefix="upstream"
+        )
+
+    def breaker(self, host):
+        """Return the CircuitBreaker of host."""
+
+        with self._lock:
+            if host not in self._breakers:
+                self._breakers[host] = CircuitBreaker(
+                    self.failure_threshold, self.reset_timeout
+                )
+            return self._breakers[host]
+
+    def available(self, host):
+        """Return whether calls to host are currently let through."""
+
+        return self.breaker(host).state != "open"
+
+    def get(self, url, deadline=None, operation="get", **kwargs):
+        """
+        GET url and return the response.
+
+        Connection errors, timeouts, 429 and 5xx responses are retried; other
+        responses are returned as they are. Raises UpstreamError when the
+        deadline passes or the host's breaker is open. operation names the
+        call in metrics.
+        """
+
+        def attempt(timeout):
+            response = self.session.get(url, timeout=timeout, **kwargs)
+            if response.status_code == 429 or response.status_code >= 500:
+                response.raise_for_status()
+            return response
+
+        return self._run(urlsplit(url).hostname, operation, attempt, deadline)
+
+    def call(self, host, function, deadline=None, operation="call"):
+        """
+        Return function() for a call to host that has no timeout of its own.
+
+        Only connection errors and timeouts count as failures of host; any
+        other exception is raised right away (e.g. an unknown symbol).
+        """
+
+        def attempt(timeout):
+            future = self._pool.submit(function)
+            try:
+                return future.result(timeout)
+            except FutureTimeoutError:
+                # The call keeps its pool thread until it returns by itself
+                raise UpstreamError(f"{host} didn't answer within {timeout:.1f}s")
+
+        return self._run(host, operation, attempt, deadline)
+
+    def _run(self, host, operation, attempt, deadline):
+        # Run the call and record its duration and outcome
+        started = time.perf_counter()
+        outcome = "error"
+        try:
+            result = self._retry(host, attempt, deadline)
+            outcome = "ok"
+            return result
+        except CircuitOpenError:
+            outcome = "circuit_open"
+            raise
+        finally:
+            registry.observe(
+                "tradehub_upstream_duration_seconds",
+                time.perf_counter() - started,
+                host=host,
+                operation=operation,
+                outcome=outcome,
+            )
+
+    def _retry(self, host, attempt, deadline):
+        # Call attempt(timeout) until it succeeds, it fails for good, or the
+        # deadline or the retries run out
+        breaker = self.breaker(host)
+        give_up = time.monotonic() + (self.deadline if deadline is None else deadline)
+        error = None
+        for retry in range(self.retries + 1):
+            remaining = give_up - time.monotonic()
+            if remaining <= 0:
+                break
+            if not breaker.allow():
+                raise CircuitOpenError(f"circuit open for {host}")
+            try:
+                result = attempt(min(self.timeout, remaining))
+            except Exception as e:
+                if not _transient(e):
+                    breaker.record_success()
+                    raise
+                breaker.record_failure()
+                error = e
+            else:
+                breaker.record_success()
+                return result
+
+            # Full jitter, so that workers don't retry in lockstep
+            pause = random.uniform(0, self.backoff * 2**retry)
+            if time.monotonic() + pause >= give_up:
+                break
+            time.sleep(pause)
+        raise UpstreamError(f"{host} failed: {error}") from error
+
+
+def _transient(error):
+    # Errors worth retrying (and counted against the host's breaker)
+    if isinstance(error, requests.HTTPError):
+        status = error.response.status_code if error.response is not None else 0
+        return status == 429 or status >= 500
+    return isinstance(
+        error, (UpstreamError, requests.ConnectionError, requests.Timeout)
+    )